@@ -1,16 +1,20 @@
 #app.py
+import time
+APP_IMPORT_STARTED = time.perf_counter()
+
 import os
 from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, Response
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from functools import wraps
-from database import Database
-from ml_engine import FraudDetector
+from database import Database, ActivityWriter, parse_alert_cursor
+from lazy_detector import LazyDetector
 from dotenv import load_dotenv
 import csv
+import zlib
 from io import StringIO
 import datetime
-import time
+import atexit
 from flask import session
 # Load environment variables from .env file
 load_dotenv()
@@ -20,17 +24,41 @@ app = Flask(__name__)
 app.secret_key = os.urandom(24) 
 
 db = Database()
-fraud_detector = FraudDetector() 
+fraud_detector = LazyDetector() 
 
 # INIT APP
 load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
 db = Database()
-fraud_detector = FraudDetector()
+# The ML stack (pandas, scikit-learn) loads on first scoring or via warm-up below
+fraud_detector = LazyDetector()
+ML_WARMUP = os.getenv("ML_WARMUP", "1") == "1"
+# New activity drops the employee's cached risk score
+db.activity_listeners.append(fraud_detector.activity_logged)
+
+# Optional write-behind ingestion: activity samples are queued and written in batches
+activity_writer = None
+if os.getenv("ACTIVITY_WRITE_BEHIND", "0") == "1":
+    activity_writer = ActivityWriter(
+        db,
+        batch_size=int(os.getenv("ACTIVITY_BATCH_SIZE", 500)),
+        flush_interval=float(os.getenv("ACTIVITY_FLUSH_INTERVAL", 1.0))
+    )
+    atexit.register(activity_writer.close)
 
 socketio = SocketIO(app, cors_allowed_origins="*", ping_interval=5, ping_timeout=10)
 
+def record_activity(employee_id, mouse, keyboard, idle, active_window_title):
+    """
+    Stores one activity sample and returns its log record. With write-behind
+    ingestion the record is synthetic (id None) and the row is written later.
+    """
+    if activity_writer is not None:
+        return activity_writer.submit(employee_id, mouse, keyboard, idle, active_window_title)
+    log_id = db.create_activity_log(employee_id, mouse, keyboard, idle, active_window_title)
+    return db.get_activity_log_by_id(log_id)
+
 # AUTH DECORATORS
 def login_required(f):
     """Decorator to check if an employee is logged in."""
@@ -171,13 +199,12 @@ def handle_desktop_activity_log(data):
                       room=f"employee_{employee_id}")
         return
 
-    new_log_id = db.create_activity_log(employee_id, mouse, keyboard, idle, active_window)
-    new_log = db.get_activity_log_by_id(new_log_id)
+    new_log = record_activity(employee_id, mouse, keyboard, idle, active_window)
    
     if new_log and isinstance(new_log.get('timestamp'), datetime.datetime):
         new_log['timestamp'] = new_log['timestamp'].isoformat()
   
-    analysis_result = fraud_detector.analyze_and_flag(db, employee_id)
+    analysis_result = fraud_detector.analyze_and_flag(db, employee_id, sample=new_log)
 
     activity_summary = db.get_activity_summary(employee_id)
     
@@ -318,12 +345,49 @@ def admin_dashboard():
         employees_at_risk=employees_at_risk
     )
 
+ALERTS_PAGE_SIZE = 50
+ALERTS_MAX_PAGE_SIZE = 500
+
+def alert_page_filters(args):
+    """
+    Alert page arguments from a query string: cursor, limit, level,
+    employee_id, and since/until as ISO dates or datetimes (until is
+    exclusive). Raises ValueError on malformed values.
+    """
+    filters = {
+        'limit': min(max(int(args.get('limit') or ALERTS_PAGE_SIZE), 1), ALERTS_MAX_PAGE_SIZE),
+        'cursor': args.get('cursor') or None,
+        'level': args.get('level') or None,
+        'employee_id': int(args['employee_id']) if args.get('employee_id') else None,
+        'since': datetime.datetime.fromisoformat(args['since']) if args.get('since') else None,
+        'until': datetime.datetime.fromisoformat(args['until']) if args.get('until') else None
+    }
+    if filters['level'] not in (None, 'Low', 'Medium', 'High'):
+        raise ValueError(f"Unknown alert level: {filters['level']}")
+    if filters['cursor'] is not None:
+        parse_alert_cursor(filters['cursor'])
+    return filters
+
 @app.route('/admin/alerts')
 @admin_required
 def alerts():
-    """Displays a full history of all fraud alerts."""
-    alerts = db.get_all_alerts()
-    return render_template("alerts.html", alerts=alerts)
+    """Displays fraud alert history a page at a time, with level/employee/date filters."""
+    try:
+        filters = alert_page_filters(request.args)
+    except ValueError as e:
+        flash(f"Invalid alert filter: {e}", "error")
+        return redirect(url_for('alerts'))
+    page = db.get_alerts_page(**filters)
+    # Links to the next page keep the current filters
+    next_args = {key: value for key, value in request.args.items() if key != 'cursor'}
+    return render_template(
+        "alerts.html",
+        alerts=page['alerts'],
+        next_cursor=page['next_cursor'],
+        next_args=next_args,
+        filters=request.args,
+        employees=db.get_all_employees()
+    )
 
 # EMPLOYEE MANAGEMENT
 
@@ -361,7 +425,14 @@ def add_employee():
 @admin_required
 def delete_employee(employee_id):
     try:
+        # Queued samples would fail the foreign key once the employee is gone
+        if activity_writer is not None:
+            activity_writer.discard(employee_id)
         db.delete_employee(employee_id)
+        # Their days already moved out of activity_logs live in the archive segments
+        from archive import purge_employee
+        purge_employee(db, employee_id)
+        fraud_detector.forget(employee_id)
         flash("Employee and all related data deleted successfully.", "success")
     except Exception as e:
         flash("Error deleting employee. Check database constraints.", "error")
@@ -406,7 +477,7 @@ def log_activity():
         return jsonify({"error": "Employee ID required"}), 400
     
     # Log the received activity data
-    db.create_activity_log(
+    new_log = record_activity(
         employee_id,
         data.get("mouse_activity", 0),
         data.get("keyboard_activity", 0),
@@ -415,7 +486,7 @@ def log_activity():
     )
     
     # Run ML analysis immediately after logging
-    fraud_detector.analyze_and_flag(db, employee_id)
+    fraud_detector.analyze_and_flag(db, employee_id, sample=new_log)
     
     return jsonify({"status": "success", "message": "Activity logged and analyzed"})
 
@@ -493,7 +564,36 @@ def api_anomaly_data():
 @app.route('/api/admin/alerts')
 @admin_required
 def api_alerts():
-    return jsonify(db.get_all_alerts())
+    """One page of alerts as {alerts, next_cursor}; pass ?cursor=next_cursor for the next page."""
+    try:
+        filters = alert_page_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(db.get_alerts_page(**filters))
+
+@app.route('/api/admin/ml-stats')
+@admin_required
+def api_ml_stats():
+    """Cache counters for the ML engine, used to size and monitor it."""
+    stats = fraud_detector.stats()
+    stats['startup'] = {'app_seconds': APP_STARTUP_SECONDS}
+    return jsonify(stats)
+
+@app.route('/api/admin/db-stats')
+@admin_required
+def api_db_stats():
+    """Connection pool usage and wait times, plus the write-behind queue if enabled."""
+    stats = {'pool': db.pool.stats()}
+    if activity_writer is not None:
+        stats['activity_writer'] = activity_writer.stats()
+    return jsonify(stats)
+
+@app.route('/api/admin/ml-drift')
+@admin_required
+def api_ml_drift():
+    """Per-employee model drift, refit counts and buffered-window aggregates (optionally ?employee_id=N)."""
+    employee_id = request.args.get('employee_id', type=int)
+    return jsonify(fraud_detector.drift_report(employee_id))
 
 @app.route('/api/admin/dashboard')
 @admin_required
@@ -506,32 +606,105 @@ def api_dashboard():
 
 # EXPORT CSV
 
-@app.route('/api/admin/export')
-@admin_required
-def export_data():
-    """Exports all fraud alerts into a downloadable CSV file."""
-    alerts = db.get_all_alerts()
+EXPORT_FLUSH_BYTES = 64 * 1024
+
+def csv_chunks(rows, fieldnames, compress=False):
+    """
+    Yields a CSV document for rows in pieces of about EXPORT_FLUSH_BYTES,
+    gzip-compressed on the fly if compress is set, so nothing larger than
+    one piece is ever held in memory.
+    """
+    gzipper = zlib.compressobj(wbits=31) if compress else None # 31: gzip container
     output = StringIO()
-    # Ensure all required fields are present for DictWriter
-    fieldnames=['id', 'employee_id', 'employee_name', 'employee_role', 'risk_score', 'alert_level', 'description', 'timestamp']
     writer = csv.DictWriter(output, fieldnames=fieldnames)
     writer.writeheader()
-    for row in alerts:
+
+    def take():
+        data = output.getvalue().encode('utf-8')
+        output.seek(0)
+        output.truncate()
+        return gzipper.compress(data) if gzipper else data
+
+    for row in rows:
         writer.writerow(row)
-        
-    output.seek(0)
+        if output.tell() >= EXPORT_FLUSH_BYTES:
+            chunk = take()
+            if chunk:
+                yield chunk
+
+    chunk = take()
+    if gzipper:
+        chunk += gzipper.flush()
+    if chunk:
+        yield chunk
+
+def csv_response(rows, fieldnames, filename):
+    """Streaming CSV download of rows; ?gzip=1 sends it as filename.gz."""
+    compress = request.args.get('gzip') == '1'
+    if compress:
+        filename += '.gz'
     return Response(
-        output.getvalue(),
-        mimetype='text/csv',
-        headers={'Content-Disposition': 'attachment; filename=fraud_alerts.csv'}
+        csv_chunks(rows, fieldnames, compress),
+        mimetype='application/gzip' if compress else 'text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
     )
 
+@app.route('/api/admin/export')
+@admin_required
+def export_data():
+    """Streams fraud alerts as CSV, optionally filtered like /api/admin/alerts (level, employee_id, since, until)."""
+    try:
+        filters = alert_page_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    for key in ('cursor', 'limit'):
+        filters.pop(key)
+    fieldnames=['id', 'employee_id', 'employee_name', 'employee_role', 'risk_score', 'alert_level', 'description', 'timestamp']
+    return csv_response(db.iter_alerts(**filters), fieldnames, 'fraud_alerts.csv')
+
+@app.route('/api/admin/export/activity')
+@admin_required
+def export_activity():
+    """
+    Streams activity logs in [since, until) as CSV for audits. since is
+    required; until defaults to now; employee_id is optional.
+    """
+    try:
+        since = datetime.datetime.fromisoformat(request.args['since'])
+        until = (datetime.datetime.fromisoformat(request.args['until'])
+                 if request.args.get('until') else datetime.datetime.now())
+        employee_id = request.args.get('employee_id', type=int)
+    except KeyError:
+        return jsonify({"error": "since is required"}), 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    fieldnames = ['id', 'employee_id', 'employee_name', 'timestamp', 'mouse_activity', 'keyboard_activity',
+                  'idle_time', 'active_window_title', 'login_id']
+    filename = f"activity_logs_{since:%Y%m%d}_{until:%Y%m%d}.csv"
+    # Imported here so numpy only loads for exports; covers archived days as well as MySQL
+    from archive import iter_activity_logs
+    return csv_response(iter_activity_logs(db, since, until, employee_id), fieldnames, filename)
+
 # INIT DB ON FIRST RUN
 
 with app.app_context():
-    db.init_db()
+    # Web workers don't queue behind another process's migration (and its
+    # backfills) at import; `python migrations.py` applies large upgrades up front
+    db.init_db(wait_for_migrations=False)
     db.seed_demo_data()
 
+APP_STARTUP_SECONDS = time.perf_counter() - APP_IMPORT_STARTED
+print(f"App ready in {APP_STARTUP_SECONDS:.2f}s (ML engine {'warming up' if ML_WARMUP else 'loads on first use'})")
+
+if ML_WARMUP:
+    if socketio.async_mode == 'eventlet':
+        # Importing pandas/sklearn never yields, so in a green thread it would
+        # stall the hub; run it on a real OS thread from eventlet's pool instead
+        from eventlet import tpool
+        socketio.start_background_task(tpool.execute, fraud_detector.warm_up)
+    else:
+        socketio.start_background_task(fraud_detector.warm_up)
+
 if __name__ == "__main__":
     #app.run(host="0.0.0.0", port=5000, debug=True)
     socketio.run(app, host="0.0.0.0", port=5000, debug=True, allow_unsafe_werkzeug=True)
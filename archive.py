@@ -0,0 +1,283 @@
+# archive.py
+"""
+Retention for activity_logs.
+
+activity_logs is treated as partitioned by calendar day. Days older than
+the hot window (ACTIVITY_HOT_DAYS) are archived, oldest first. Each day is
+written to a compressed columnar segment file in ACTIVITY_ARCHIVE_DIR: one
+.npz per day, one array per column, window titles dictionary-encoded. The
+day is then recorded in activity_archive and its rows are deleted from
+MySQL in small batches.
+This bounds the hot table, and its indexes, to the hot window. The hourly
+rollups and per-employee totals are left alone, so dashboards and summaries
+still cover all history.
+
+Reporting and backfills read archived days back through SegmentStore, or
+through iter_activity_logs(), which covers both archived and hot rows.
+
+    python archive.py                 # archive days older than ACTIVITY_HOT_DAYS
+    python archive.py --hot-days 30   # ... or older than 30 days
+"""
+import os
+import sys
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+# Days of activity kept in MySQL; 0 disables archival
+ACTIVITY_HOT_DAYS = int(os.getenv("ACTIVITY_HOT_DAYS", 90))
+ACTIVITY_ARCHIVE_DIR = os.getenv("ACTIVITY_ARCHIVE_DIR", "archive")
+
+SEGMENT_FORMAT_VERSION = 1
+# Integer columns; NULL is stored as -1 (real values are never negative)
+INT_COLUMNS = ['id', 'employee_id', 'mouse_activity', 'keyboard_activity', 'idle_time', 'login_id']
+COLUMNS = INT_COLUMNS + ['timestamp', 'active_window_title']
+BUILD_CHUNK_ROWS = 10000
+
+
+class SegmentBuilder:
+    """
+    Accumulates activity rows as column arrays, a chunk at a time, so a
+    day of rows never sits in memory as dicts. Window titles are
+    dictionary-encoded (title_codes index into titles, -1 for NULL), which
+    suits their heavy repetition.
+    """
+    def __init__(self):
+        self.parts = []
+        self.titles = []
+        self._title_codes = {}
+
+    def add(self, rows):
+        """Adds an iterable of activity_logs-shaped dicts."""
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= BUILD_CHUNK_ROWS:
+                self._add_chunk(chunk)
+                chunk = []
+        if chunk:
+            self._add_chunk(chunk)
+
+    def _add_chunk(self, rows):
+        part = {
+            column: np.array([-1 if row[column] is None else row[column] for row in rows], dtype=np.int64)
+            for column in INT_COLUMNS
+        }
+        part['timestamp'] = np.array([row['timestamp'] for row in rows], dtype='datetime64[s]')
+        part['title_codes'] = np.array([self._title_code(row['active_window_title']) for row in rows], dtype=np.int32)
+        self.parts.append(part)
+
+    def _title_code(self, title):
+        if title is None:
+            return -1
+        code = self._title_codes.get(title)
+        if code is None:
+            code = self._title_codes[title] = len(self.titles)
+            self.titles.append(title)
+        return code
+
+    def columns(self):
+        """
+        Final column arrays, de-duplicated by id (the first row added wins)
+        and sorted by (timestamp, id).
+        """
+        columns = {
+            column: np.concatenate([part[column] for part in self.parts])
+            for column in INT_COLUMNS + ['timestamp', 'title_codes']
+        }
+        _, first = np.unique(columns['id'], return_index=True)
+        keep = first[np.lexsort((columns['id'][first], columns['timestamp'][first]))]
+        return {column: values[keep] for column, values in columns.items()}
+
+
+def write_segment(path, columns, titles):
+    """
+    Writes SegmentBuilder columns and its title dictionary to a compressed
+    .npz (one array per column), replacing the file atomically.
+    """
+    encoded = [title.encode('utf-8') for title in titles]
+    arrays = dict(columns)
+    arrays['title_offsets'] = np.concatenate(([0], np.cumsum([len(b) for b in encoded]))).astype(np.int64)
+    arrays['title_bytes'] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    arrays['format_version'] = np.array(SEGMENT_FORMAT_VERSION)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_segment(path, columns=None):
+    """
+    {column: numpy array} for a segment, decompressing only the given
+    columns (default all). active_window_title is an object array of str/None.
+    """
+    columns = COLUMNS if columns is None else columns
+    with np.load(path) as segment:
+        if int(segment['format_version']) != SEGMENT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported activity segment format in {path}")
+        data = {column: segment[column] for column in columns if column != 'active_window_title'}
+        if 'active_window_title' in columns:
+            blob = segment['title_bytes'].tobytes()
+            offsets = segment['title_offsets']
+            titles = [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+            # Code -1 picks the trailing None
+            data['active_window_title'] = np.array(titles + [None], dtype=object)[segment['title_codes']]
+    return data
+
+
+def segment_rows(data, mask=None):
+    """Yields activity_logs-shaped dicts from read_segment() output, optionally for a boolean mask."""
+    if mask is not None:
+        data = {column: values[mask] for column, values in data.items()}
+    timestamps = data['timestamp'].astype(object) # datetime.datetime
+    for i in range(len(timestamps)):
+        row = {'timestamp': timestamps[i], 'active_window_title': data['active_window_title'][i]}
+        for column in INT_COLUMNS:
+            value = int(data[column][i])
+            row[column] = None if value == -1 else value
+        yield row
+
+
+class SegmentStore:
+    """Daily activity segments on local disk, activity_logs_YYYYMMDD.npz."""
+    def __init__(self, directory=ACTIVITY_ARCHIVE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, day):
+        return os.path.join(self.directory, f"activity_logs_{day:%Y%m%d}.npz")
+
+    def has(self, day):
+        return os.path.exists(self.path(day))
+
+    def days(self):
+        """Days with a segment on disk, oldest first."""
+        days = []
+        for name in os.listdir(self.directory):
+            if name.startswith('activity_logs_') and name.endswith('.npz'):
+                days.append(datetime.strptime(name[len('activity_logs_'):-len('.npz')], '%Y%m%d').date())
+        return sorted(days)
+
+    def read_day(self, day, columns=None):
+        return read_segment(self.path(day), columns)
+
+    def iter_rows(self, since, until, employee_id=None):
+        """Archived rows in [since, until), optionally for one employee, oldest first."""
+        since64 = np.datetime64(since, 's')
+        until64 = np.datetime64(until, 's')
+        day = since.date() if isinstance(since, datetime) else since
+        while datetime.combine(day, datetime.min.time()) < until:
+            if self.has(day):
+                data = self.read_day(day)
+                mask = (data['timestamp'] >= since64) & (data['timestamp'] < until64)
+                if employee_id is not None:
+                    mask &= data['employee_id'] == employee_id
+                yield from segment_rows(data, mask)
+            day += timedelta(days=1)
+
+
+def archive_day(db, store, day):
+    """
+    Archives one day of activity_logs: merges its rows into the day's
+    segment (de-duplicated by id, so re-running after an interrupted archive
+    is safe), records the day, then deletes the archived rows from MySQL.
+    Returns the number of rows deleted.
+    """
+    start = datetime.combine(day, datetime.min.time())
+    end = start + timedelta(days=1)
+
+    builder = SegmentBuilder()
+    builder.add(db.iter_activity_logs(start, end))
+    if not builder.parts:
+        return 0
+    max_id = int(max(part['id'].max() for part in builder.parts))
+    if store.has(day):
+        builder.add(segment_rows(store.read_day(day)))
+
+    columns = builder.columns()
+    write_segment(store.path(day), columns, builder.titles)
+    db.record_archived_day(day, len(columns['id']), store.path(day))
+    # Rows that arrive for this day after the read have higher ids and wait for the next run
+    return db.delete_activity_range(start, end, max_id)
+
+
+def archive_cold_days(db, store=None, hot_days=ACTIVITY_HOT_DAYS, today=None):
+    """
+    Archives every day of activity_logs older than hot_days, oldest first.
+    Returns {'days': days archived, 'rows': rows moved out of MySQL}.
+    """
+    if hot_days <= 0:
+        return {'days': 0, 'rows': 0}
+    store = store or SegmentStore()
+    cutoff = (today or date.today()) - timedelta(days=hot_days)
+
+    days = rows = 0
+    oldest = db.get_oldest_activity_time()
+    while oldest is not None and oldest.date() < cutoff:
+        day = oldest.date()
+        rows += archive_day(db, store, day)
+        days += 1
+        # Skip straight over days with no rows
+        oldest = db.get_oldest_activity_time(since=datetime.combine(day + timedelta(days=1), datetime.min.time()))
+    return {'days': days, 'rows': rows}
+
+
+def purge_employee(db, employee_id, store=None):
+    """
+    Removes a deleted employee's rows from the archived segments, rewriting
+    only the days that have any, and updates those days' row counts.
+    Returns the number of rows removed.
+    """
+    store = store or SegmentStore()
+    removed = 0
+    for day in store.days():
+        keep = store.read_day(day, ['employee_id'])['employee_id'] != employee_id
+        if keep.all():
+            continue
+        builder = SegmentBuilder()
+        builder.add(segment_rows(store.read_day(day), keep))
+        if builder.parts:
+            write_segment(store.path(day), builder.columns(), builder.titles)
+        else:
+            os.remove(store.path(day))
+        db.record_archived_day(day, int(keep.sum()), store.path(day))
+        removed += int((~keep).sum())
+    return removed
+
+
+def iter_activity_logs(db, since, until, employee_id=None, store=None):
+    """
+    Like Database.iter_activity_logs, but also covering archived days:
+    archived rows first (for days before the archive watermark), then the
+    rows still in MySQL. Deleting an employee deletes their MySQL rows and
+    purges them from the segments (purge_employee); archived rows of
+    employees that no longer exist are skipped in case a purge didn't finish.
+    """
+    watermark = db.get_archive_watermark()
+    if watermark is not None and since < watermark:
+        store = store or SegmentStore()
+        names = {employee['id']: employee['name'] for employee in db.get_all_employees()}
+        for row in store.iter_rows(since, min(until, watermark), employee_id):
+            if row['employee_id'] in names:
+                row['employee_name'] = names[row['employee_id']]
+                yield row
+    yield from db.iter_activity_logs(since, until, employee_id)
+
+
+def main(argv):
+    from database import Database
+
+    hot_days = ACTIVITY_HOT_DAYS
+    if '--hot-days' in argv:
+        hot_days = int(argv[argv.index('--hot-days') + 1])
+
+    stats = archive_cold_days(Database(), hot_days=hot_days)
+    print(f"Archived {stats['rows']} activity rows from {stats['days']} days older than {hot_days} days")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,510 @@
+# benchmark.py
+"""
+Offline benchmarks for ml_engine.
+
+Generates synthetic activity_logs/login_logs-shaped rows (with injected
+anomalies), serves them from an in-memory stand-in for Database, and times the
+FraudDetector entry points across row and employee counts. Results (throughput,
+p50/p99 latency, peak memory) are written as JSON. The imports suite times
+cold imports in fresh interpreters, to keep web startup cheap. With --check,
+any mismatch against a legacy baseline (results_match false) exits 1.
+Feature builder parity is covered by tests/test_feature_parity.py.
+
+    python benchmark.py --rows 10,100,1000 --employees 10,50 --output bench.json
+    python benchmark.py --suites rules,forest --check
+"""
+import argparse
+import json
+import os
+import pickle
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd # type: ignore
+import sklearn # type: ignore
+from ml_engine import CompactForest, FraudDetector, DEFAULT_TITLE_CATEGORIES
+
+
+def legacy_identify_risk_factors(activity_data, distracting_keywords):
+    """
+    The row-wise implementation RiskRuleEngine replaced (pandas apply lambdas
+    and nunique calls per request). Kept as the baseline for benchmarks.
+    """
+    if not activity_data:
+        return []
+
+    factors = []
+    df = pd.DataFrame(activity_data)
+
+    if 'active_window_title' in df.columns:
+        distracting_logs = df['active_window_title'].apply(
+            lambda x: 1 if any(k in str(x).lower() for k in distracting_keywords) else 0
+        ).sum()
+        distracting_ratio = distracting_logs / len(df)
+        if distracting_ratio > 0.3:
+            factors.append({
+                'type': 'Distracting App Use',
+                'severity': 'high' if distracting_ratio > 0.5 else 'medium',
+                'description': f'{distracting_logs} out of {len(df)} recent logs show foreground use of non-work applications (e.g., social media, streaming).'
+            })
+
+    if 'idle_time' in df.columns:
+        avg_idle = df['idle_time'].mean()
+        if avg_idle > 45:
+            factors.append({
+                'type': 'High Idle Time',
+                'severity': 'high' if avg_idle > 60 else 'medium',
+                'description': f'Average idle time of {avg_idle:.0f} seconds exceeds normal threshold (low physical input).'
+            })
+
+    if 'hour' in df.columns:
+        after_hours = df[df['hour'].apply(lambda x: x < 8 or x > 18)]
+        if len(after_hours) > len(df) * 0.3:
+            factors.append({
+                'type': 'After Hours Activity',
+                'severity': 'medium',
+                'description': 'Significant activity detected outside normal business hours (8AM-6PM).'
+            })
+
+    if 'ip_address' in df.columns:
+        unique_ips = df['ip_address'].nunique()
+        if unique_ips > 3:
+            factors.append({
+                'type': 'IP Mismatch',
+                'severity': 'high',
+                'description': f'Multiple IP addresses ({unique_ips}) detected in recent sessions, indicating a change in working location.'
+            })
+
+    if 'device_id' in df.columns:
+        unique_devices = df['device_id'].nunique()
+        if unique_devices > 2:
+            factors.append({
+                'type': 'Device Anomaly',
+                'severity': 'medium',
+                'description': f'Multiple devices ({unique_devices}) used in recent sessions.'
+            })
+
+    if 'mouse_activity' in df.columns and 'keyboard_activity' in df.columns:
+        total_activity = df['mouse_activity'] + df['keyboard_activity']
+        activity_std = total_activity.std()
+        activity_mean = total_activity.mean()
+        if activity_mean > 0 and activity_std / activity_mean > 1.5:
+            factors.append({
+                'type': 'Pattern Deviation',
+                'severity': 'medium',
+                'description': 'Irregular activity patterns detected (high variance in mouse/keyboard inputs).'
+            })
+
+    return factors
+
+
+WORK_TITLES = [
+    'Visual Studio Code - app.py', 'Slack - #engineering', 'Outlook - Inbox',
+    'Jira - Sprint Board', 'Google Docs - Design Review', 'Terminal', 'Zoom Meeting'
+]
+DISTRACTING_TITLES = [
+    'YouTube - Music Mix', 'Reddit - r/all', 'Netflix', 'Steam - Store',
+    'Instagram', 'Discord - general', 'Spotify Premium'
+]
+
+
+class SyntheticWorkload:
+    """
+    Generates activity rows shaped like the ML queries' output
+    (activity_logs joined with login_logs), newest first.
+
+    Each employee has a home IP and device, kept across calls so later rows
+    come from the same place, and works office hours. A fraction of rows
+    (anomaly_rate) are anomalous: long idle, no or bursty input, off-hours,
+    unfamiliar IP/device and distracting window titles.
+    """
+    def __init__(self, seed=42, anomaly_rate=0.05):
+        self.rng = random.Random(seed)
+        self.anomaly_rate = anomaly_rate
+        self.next_id = 1
+        self.homes = {} # employee_id -> (home IP, home device)
+
+    def employee_rows(self, employee_id, count, end_time=None):
+        end_time = end_time or datetime(2026, 1, 15, 17, 0)
+        home_ip, home_device = self.home(employee_id)
+
+        rows = []
+        for index in range(count):
+            timestamp = end_time - timedelta(seconds=15 * index)
+            if self.rng.random() < self.anomaly_rate:
+                row = self._anomalous_row(timestamp)
+            else:
+                row = self._normal_row(timestamp, home_ip, home_device)
+            row['id'] = self.next_id
+            row['employee_id'] = employee_id
+            row['timestamp'] = timestamp
+            self.next_id += 1
+            rows.append(row)
+
+        # ids increase with time, like AUTO_INCREMENT
+        for row, row_id in zip(rows, sorted((row['id'] for row in rows), reverse=True)):
+            row['id'] = row_id
+        return rows
+
+    def home(self, employee_id):
+        """The employee's home IP and device, picked on first use."""
+        if employee_id not in self.homes:
+            home_ip = f"10.{employee_id % 250}.{self.rng.randint(0, 250)}.{self.rng.randint(1, 250)}"
+            self.homes[employee_id] = (home_ip, f"laptop-{employee_id}")
+        return self.homes[employee_id]
+
+    def fleet(self, employees, rows_per_employee):
+        return {employee_id: self.employee_rows(employee_id, rows_per_employee) for employee_id in range(1, employees + 1)}
+
+    def _normal_row(self, timestamp, ip_address, device_id):
+        rng = self.rng
+        return {
+            'idle_time': max(0, int(rng.gauss(8, 6))),
+            'mouse_activity': max(0, int(rng.gauss(120, 40))),
+            'keyboard_activity': max(0, int(rng.gauss(150, 60))),
+            'hour': rng.choice([9, 10, 11, 12, 13, 14, 15, 16, 17]),
+            'ip_address': ip_address,
+            'device_id': device_id,
+            'active_window_title': rng.choice(WORK_TITLES)
+        }
+
+    def _anomalous_row(self, timestamp):
+        rng = self.rng
+        return {
+            'idle_time': rng.randint(60, 900),
+            'mouse_activity': rng.choice([0, 0, rng.randint(800, 2000)]),
+            'keyboard_activity': rng.choice([0, 0, rng.randint(800, 2000)]),
+            'hour': rng.choice([0, 1, 2, 3, 4, 5, 20, 21, 22, 23]),
+            'ip_address': f"172.16.{rng.randint(0, 255)}.{rng.randint(1, 254)}",
+            'device_id': f"unknown-{rng.randint(1, 50)}",
+            'active_window_title': rng.choice(DISTRACTING_TITLES)
+        }
+
+
+class InMemoryDatabase:
+    """
+    Offline stand-in for Database implementing the methods ml_engine uses.
+    Rows come back with the same columns the real ML queries select.
+    """
+    ML_COLUMNS = ('id', 'idle_time', 'mouse_activity', 'keyboard_activity', 'active_window_title',
+                  'timestamp', 'hour', 'ip_address', 'device_id')
+
+    def __init__(self, activity_by_employee=None):
+        self.activity = {k: list(v) for k, v in (activity_by_employee or {}).items()}
+        self.alerts = []
+
+    def add_activity(self, employee_id, rows):
+        """Adds rows (newest first) in front of the employee's history."""
+        self.activity[employee_id] = list(rows) + self.activity.get(employee_id, [])
+
+    def get_all_employees(self):
+        return [{'id': employee_id} for employee_id in self.activity]
+
+    def get_employee_activity_for_ml(self, employee_id):
+        return [self._ml_row(row) for row in self.activity.get(employee_id, [])[:100]]
+
+    def get_activity_for_ml_batch(self, employee_ids=None, limit_per_employee=100):
+        employee_ids = list(self.activity) if employee_ids is None else employee_ids
+        return {
+            employee_id: [dict(self._ml_row(row), employee_id=employee_id) for row in self.activity[employee_id][:limit_per_employee]]
+            for employee_id in employee_ids if self.activity.get(employee_id)
+        }
+
+    def create_fraud_alert(self, employee_id, risk, level, description):
+        self.alerts.append((employee_id, risk, level, description))
+
+    def create_fraud_alerts(self, alerts):
+        self.alerts.extend(alerts)
+
+    def _ml_row(self, row):
+        return {column: row.get(column) for column in self.ML_COLUMNS}
+
+
+def measure(func, repeat, units=1):
+    """
+    Calls func repeat times and returns latency percentiles and throughput.
+    Peak memory comes from one extra, separately traced call so tracing
+    doesn't distort the timings. units is the work per call (rows, employees).
+    """
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - started)
+
+    latencies = np.array(latencies)
+    total = latencies.sum()
+    return {
+        'calls': repeat,
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+        'mean_ms': float(latencies.mean() * 1000),
+        'calls_per_s': float(repeat / total) if total > 0 else 0.0,
+        'units_per_s': float(repeat * units / total) if total > 0 else 0.0,
+        'peak_memory_kb': peak / 1024
+    }
+
+
+def bench_row_scaling(row_counts, repeat, seed=42):
+    """Times prepare_features, fit, predict_anomaly and _identify_risk_factors per row count."""
+    results = []
+    for rows in row_counts:
+        activity = SyntheticWorkload(seed).employee_rows(1, rows)
+        detector = FraudDetector(model_dir='')
+
+        cases = [('prepare_features', lambda: detector.prepare_features(activity))]
+        if rows >= 10:
+            cases.append(('fit', lambda: detector.fit(activity)))
+        cases.append(('_identify_risk_factors', lambda: detector._identify_risk_factors(activity)))
+
+        for name, func in cases:
+            results.append(dict(benchmark=name, rows=rows, employees=1, **measure(func, repeat, rows)))
+
+        if detector.fit(activity):
+            recent = activity[:10]
+            results.append(dict(
+                benchmark='predict_anomaly', rows=len(recent), employees=1,
+                **measure(lambda: detector.predict_anomaly(recent), repeat, len(recent))
+            ))
+    return results
+
+
+def bench_forest(sample_sizes=(1, 10), rows=100, repeat=10, seed=42):
+    """
+    Times sklearn's score_samples + predict against CompactForest.evaluate on
+    one employee's fitted model, checks the outputs are identical and
+    compares the pickled size of each model.
+    """
+    detector = FraudDetector(model_dir='')
+    features = detector.prepare_features(SyntheticWorkload(seed).employee_rows(1, rows))
+    scaler, model = detector._fit_pair(features)
+    forest = CompactForest.from_fitted(scaler, model)
+
+    def sklearn_eval(batch):
+        scaled = scaler.transform(batch)
+        return model.score_samples(scaled), model.predict(scaled)
+
+    results = []
+    for size in sample_sizes:
+        batch = features[:size]
+        expected, actual = sklearn_eval(batch), forest.evaluate(batch)
+        for name, func in (('sklearn_forest', sklearn_eval), ('compact_forest', forest.evaluate)):
+            results.append(dict(benchmark=name, rows=size, employees=1, **measure(lambda: func(batch), repeat, size)))
+        results[-1]['results_match'] = all(np.array_equal(a, b) for a, b in zip(expected, actual))
+
+    results.append({
+        'benchmark': 'forest_model_bytes',
+        'rows': rows,
+        'sklearn_bytes': len(pickle.dumps((scaler, model))),
+        'compact_bytes': len(pickle.dumps(forest)),
+        'compact_array_bytes': forest.nbytes
+    })
+    return results
+
+
+def bench_fleet(employee_counts, rows_per_employee=100, seed=42):
+    """
+    Times analyze_and_flag across a fleet: a cold pass (every model fitted)
+    and a warm pass (cached models, one new sample per employee), plus one
+    analyze_batch sweep. Latencies are per employee. Peak memory for each pass
+    comes from repeating it under tracemalloc, so tracing doesn't skew timings.
+    """
+    results = []
+    for employees in employee_counts:
+        workload = SyntheticWorkload(seed)
+        fleet = workload.fleet(employees, rows_per_employee)
+        samples = {
+            employee_id: workload.employee_rows(employee_id, 1, end_time=datetime(2026, 1, 15, 17, 1))
+            for employee_id in fleet
+        }
+
+        for phase in ('cold', 'warm'):
+            latencies, _ = _fleet_pass(fleet, samples, phase)
+            _, peak = _fleet_pass(fleet, samples, phase, trace_memory=True)
+
+            total = latencies.sum()
+            results.append({
+                'benchmark': f'analyze_and_flag_{phase}',
+                'rows': rows_per_employee,
+                'employees': employees,
+                'calls': len(latencies),
+                'p50_ms': float(np.percentile(latencies, 50) * 1000),
+                'p99_ms': float(np.percentile(latencies, 99) * 1000),
+                'mean_ms': float(latencies.mean() * 1000),
+                'calls_per_s': float(len(latencies) / total),
+                'units_per_s': float(len(latencies) / total),
+                'peak_memory_kb': peak / 1024
+            })
+
+        db = InMemoryDatabase(fleet)
+        results.append(dict(
+            benchmark='analyze_batch', rows=rows_per_employee, employees=employees,
+            **measure(lambda: FraudDetector(model_dir='').analyze_batch(db), 1, employees)
+        ))
+    return results
+
+
+def _fleet_pass(fleet, samples, phase, trace_memory=False):
+    """
+    Runs analyze_and_flag once per employee on a fresh detector and returns
+    (latencies, peak traced bytes) for the measured phase. For 'warm', models
+    are fitted first (untraced) and each measured call ingests one new sample.
+    """
+    db = InMemoryDatabase(fleet)
+    detector = FraudDetector(model_dir='')
+
+    if phase == 'warm':
+        for employee_id in fleet:
+            detector.analyze_and_flag(db, employee_id)
+
+    if trace_memory:
+        tracemalloc.start()
+
+    latencies = []
+    for employee_id in fleet:
+        sample = None
+        if phase == 'warm':
+            db.add_activity(employee_id, samples[employee_id])
+            sample = samples[employee_id][0]
+        started = time.perf_counter()
+        detector.analyze_and_flag(db, employee_id, sample=sample)
+        latencies.append(time.perf_counter() - started)
+
+    peak = 0
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return np.array(latencies), peak
+
+
+def bench_risk_rules(employees=200, rows_per_employee=10, seed=42):
+    """
+    Times the legacy per-request risk factor code against RiskRuleEngine,
+    both per employee and grouped over the whole fleet in one pass.
+    """
+    activity = SyntheticWorkload(seed, anomaly_rate=0.3).fleet(employees, rows_per_employee)
+
+    detector = FraudDetector(model_dir='')
+    engine = detector.rule_engine
+    keywords = [k for spec in DEFAULT_TITLE_CATEGORIES.values() for k in spec['keywords']]
+
+    started = time.perf_counter()
+    legacy = {employee_id: legacy_identify_risk_factors(rows, keywords) for employee_id, rows in activity.items()}
+    legacy_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    per_employee = {employee_id: engine.evaluate(rows) for employee_id, rows in activity.items()}
+    per_employee_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    grouped = engine.evaluate_grouped(activity)
+    grouped_time = time.perf_counter() - started
+
+    return {
+        'benchmark': 'risk_rules',
+        'employees': employees,
+        'rows_per_employee': rows_per_employee,
+        'legacy_seconds': legacy_time,
+        'engine_seconds': per_employee_time,
+        'engine_grouped_seconds': grouped_time,
+        'speedup_per_employee': legacy_time / per_employee_time,
+        'speedup_grouped': legacy_time / grouped_time,
+        'results_match': legacy == per_employee == grouped
+    }
+
+
+IMPORT_MODULES = ('lazy_detector', 'database', 'ml_engine')
+
+
+def bench_imports(modules=IMPORT_MODULES, repeat=5):
+    """
+    Cold import time of each module, measured in a fresh interpreter per run
+    so nothing is already in sys.modules. lazy_detector is what app.py pays
+    at startup; ml_engine is what it defers.
+    """
+    script = (
+        "import sys, time; started = time.perf_counter(); "
+        "__import__(sys.argv[1]); print(time.perf_counter() - started)"
+    )
+    results = []
+    for module in modules:
+        timings = []
+        for _ in range(repeat):
+            output = subprocess.run(
+                [sys.executable, '-c', script, module],
+                capture_output=True, text=True, check=True,
+                cwd=os.path.dirname(os.path.abspath(__file__))
+            ).stdout
+            timings.append(float(output.strip().splitlines()[-1]))
+
+        timings = np.array(timings)
+        results.append({
+            'benchmark': 'import_time',
+            'module': module,
+            'runs': repeat,
+            'p50_ms': float(np.percentile(timings, 50) * 1000),
+            'max_ms': float(timings.max() * 1000)
+        })
+    return results
+
+
+def run(row_counts, employee_counts, repeat, suites):
+    results = []
+    if 'rows' in suites:
+        results.extend(bench_row_scaling(row_counts, repeat))
+    if 'fleet' in suites:
+        results.extend(bench_fleet(employee_counts))
+    if 'forest' in suites:
+        results.extend(bench_forest(repeat=repeat))
+    if 'rules' in suites:
+        results.append(bench_risk_rules())
+    if 'imports' in suites:
+        results.extend(bench_imports())
+
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'sklearn': sklearn.__version__,
+            'machine': platform.machine()
+        },
+        'results': results
+    }
+
+
+def _int_list(value):
+    return [int(part) for part in value.split(',') if part]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ml_engine against a synthetic workload.")
+    parser.add_argument('--rows', type=_int_list, default=[10, 100, 1000], help="comma-separated row counts")
+    parser.add_argument('--employees', type=_int_list, default=[10, 50], help="comma-separated fleet sizes")
+    parser.add_argument('--repeat', type=int, default=10, help="calls per row-scaling measurement")
+    parser.add_argument('--suites', default='rows,fleet,forest,rules,imports',
+                        help="any of: rows, fleet, forest, rules, imports")
+    parser.add_argument('--check', action='store_true', help="exit 1 if any results_match is false")
+    parser.add_argument('--output', help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    report = run(args.rows, args.employees, args.repeat, args.suites.split(','))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output + '\n')
+
+    if args.check and not all(result.get('results_match', True) for result in report['results']):
+        sys.exit(1)
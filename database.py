@@ -1,535 +1,1250 @@
 # database.py
 import mysql.connector
 from mysql.connector import Error
+from mysql.connector.errors import IntegrityError, PoolError
 from werkzeug.security import generate_password_hash
+from migrations import run_migrations
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+import os
 import random
 import decimal
+import threading
+import time
+
+# Connections kept per Database instance, and how long a checkout may wait for one
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+
+
+# Keeps employee_risk (latest alert per employee) in step with fraud_alerts
+LATEST_RISK_UPSERT = """
+    INSERT INTO employee_risk (employee_id, risk_score, alert_level)
+    VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        risk_score = VALUES(risk_score),
+        alert_level = VALUES(alert_level),
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+# Hourly activity rollups per employee, incremented with each batch of activity
+# rows. Dashboards sum these by hour instead of aggregating raw activity_logs.
+# There is no all-employee row per hour: every agent would update it at once.
+EMPLOYEE_HOURLY_ROLLUP_UPSERT = """
+    INSERT INTO employee_activity_hourly (employee_id, bucket, log_count, mouse_sum, keyboard_sum, idle_sum)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        log_count = log_count + VALUES(log_count),
+        mouse_sum = mouse_sum + VALUES(mouse_sum),
+        keyboard_sum = keyboard_sum + VALUES(keyboard_sum),
+        idle_sum = idle_sum + VALUES(idle_sum)
+"""
+
+# The same for one activity_logs row (by id), bucketed by its server-side timestamp
+EMPLOYEE_HOURLY_ROLLUP_FROM_LOG = """
+    INSERT INTO employee_activity_hourly (employee_id, bucket, log_count, mouse_sum, keyboard_sum, idle_sum)
+    SELECT employee_id, DATE(timestamp) + INTERVAL HOUR(timestamp) HOUR,
+           1, IFNULL(mouse_activity, 0), IFNULL(keyboard_activity, 0), IFNULL(idle_time, 0)
+    FROM activity_logs
+    WHERE id = %s
+    ON DUPLICATE KEY UPDATE
+        log_count = log_count + VALUES(log_count),
+        mouse_sum = mouse_sum + VALUES(mouse_sum),
+        keyboard_sum = keyboard_sum + VALUES(keyboard_sum),
+        idle_sum = idle_sum + VALUES(idle_sum)
+"""
+
+def current_login_ids(cur, employee_ids):
+    """
+    {employee_id: id of their latest login_logs row} for the given employees,
+    the session new activity samples are recorded against. Employees who
+    never logged in are left out.
+    """
+    employee_ids = sorted(set(employee_ids))
+    cur.execute(f"""
+        SELECT employee_id, MAX(id) FROM login_logs
+        WHERE employee_id IN ({", ".join(["%s"] * len(employee_ids))})
+        GROUP BY employee_id
+    """, tuple(employee_ids))
+    return dict(cur.fetchall())
+
+
+def alert_cursor(alert):
+    """Opaque page cursor for the position just after an alert row."""
+    return f"{alert['timestamp']:%Y-%m-%dT%H:%M:%S}_{alert['id']}"
+
+
+def parse_alert_cursor(cursor):
+    """(timestamp, id) from alert_cursor(); raises ValueError if it's malformed."""
+    timestamp, _, alert_id = cursor.rpartition('_')
+    return datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S'), int(alert_id)
+
+
+def alert_filters(level=None, employee_id=None, since=None, until=None):
+    """SQL conditions and params on fraud_alerts (aliased fa) for the alert filters."""
+    conditions = []
+    params = []
+    if level is not None:
+        conditions.append("fa.alert_level = %s")
+        params.append(level)
+    if employee_id is not None:
+        conditions.append("fa.employee_id = %s")
+        params.append(employee_id)
+    if since is not None:
+        conditions.append("fa.timestamp >= %s")
+        params.append(since)
+    if until is not None:
+        conditions.append("fa.timestamp < %s")
+        params.append(until)
+    return conditions, params
+
+
+def fetch_in_chunks(cur, chunk_size):
+    """Yields an executed cursor's rows, fetching chunk_size at a time."""
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield from rows
+
+
+# Lifetime activity totals per employee, so summaries don't scan their history
+EMPLOYEE_TOTALS_UPSERT = """
+    INSERT INTO employee_activity_totals (employee_id, log_count, mouse_sum, keyboard_sum, idle_sum)
+    VALUES (%s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        log_count = log_count + VALUES(log_count),
+        mouse_sum = mouse_sum + VALUES(mouse_sum),
+        keyboard_sum = keyboard_sum + VALUES(keyboard_sum),
+        idle_sum = idle_sum + VALUES(idle_sum),
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+
+def roll_up_activity(cur, rows):
+    """
+    Adds (employee_id, timestamp, mouse, keyboard, idle) activity rows to the
+    hourly rollups and the per-employee totals, one upsert per employee-hour
+    and per employee touched. Run it in the transaction that inserts the rows
+    so they never disagree.
+    """
+    employee_hourly = {}
+    employee_totals = {}
+    for employee_id, timestamp, mouse, keyboard, idle in rows:
+        bucket = timestamp.replace(minute=0, second=0, microsecond=0)
+        for totals in (employee_hourly.setdefault((employee_id, bucket), [0, 0, 0, 0]),
+                       employee_totals.setdefault(employee_id, [0, 0, 0, 0])):
+            totals[0] += 1
+            totals[1] += mouse or 0
+            totals[2] += keyboard or 0
+            totals[3] += idle or 0
+
+    cur.executemany(EMPLOYEE_HOURLY_ROLLUP_UPSERT, [
+        (employee_id, bucket, *totals) for (employee_id, bucket), totals in sorted(employee_hourly.items())
+    ])
+    cur.executemany(EMPLOYEE_TOTALS_UPSERT, [
+        (employee_id, *totals) for employee_id, totals in sorted(employee_totals.items())
+    ])
+
+
+# Hot read queries. Database runs these, and `python migrations.py --explain`
+# checks their plans, so keep both reading the same text.
+IS_EMPLOYEE_ACTIVE_SQL = """
+    SELECT COUNT(*) AS count
+    FROM login_logs
+    WHERE employee_id = %s AND logout_time IS NULL
+"""
+
+RECENT_ACTIVITY_SQL = """
+    SELECT * FROM activity_logs
+    WHERE employee_id = %s
+    ORDER BY timestamp DESC
+    LIMIT %s
+"""
+
+ML_ACTIVITY_SQL = """
+    SELECT
+        a.id,
+        a.idle_time,
+        a.mouse_activity,
+        a.keyboard_activity,
+        a.active_window_title,
+        a.timestamp,
+        HOUR(a.timestamp) AS hour,
+        l.ip_address,
+        l.device_id
+    FROM activity_logs a
+    LEFT JOIN login_logs l ON l.id = a.login_id
+    WHERE a.employee_id = %s
+    ORDER BY a.timestamp DESC
+    LIMIT 100
+"""
+
+# The same for many employees: each one's newest rows are read through
+# idx_activity_employee_time with a LIMIT, rather than ranking all their history
+ML_ACTIVITY_BATCH_SQL = """
+    SELECT
+        a.id,
+        a.employee_id,
+        a.idle_time,
+        a.mouse_activity,
+        a.keyboard_activity,
+        a.active_window_title,
+        a.timestamp,
+        HOUR(a.timestamp) AS hour,
+        l.ip_address,
+        l.device_id
+    FROM employees e
+    JOIN LATERAL (
+        SELECT id, employee_id, idle_time, mouse_activity, keyboard_activity,
+               active_window_title, timestamp, login_id
+        FROM activity_logs
+        WHERE employee_id = e.id
+        ORDER BY timestamp DESC
+        LIMIT %s
+    ) a ON TRUE
+    LEFT JOIN login_logs l ON l.id = a.login_id
+    {where}
+    ORDER BY a.employee_id, a.timestamp DESC
+"""
+
+
+def ml_activity_batch_query(employee_ids=None, limit_per_employee=100):
+    """SQL and params for the newest activity rows of all (or the given) employees."""
+    where = ""
+    params = [limit_per_employee]
+    if employee_ids is not None:
+        where = "WHERE e.id IN (" + ", ".join(["%s"] * len(employee_ids)) + ")"
+        params.extend(employee_ids)
+    return ML_ACTIVITY_BATCH_SQL.format(where=where), tuple(params)
+
+
+ACTIVITY_SUMMARY_SQL = """
+    SELECT
+        mouse_sum AS total_mouse,
+        keyboard_sum AS total_keyboard,
+        idle_sum AS total_idle,
+        log_count * 15 AS total_time,
+        log_count
+    FROM employee_activity_totals
+    WHERE employee_id = %s
+"""
+
+CRITICAL_ALERTS_SQL = "SELECT COUNT(*) AS count FROM fraud_alerts WHERE alert_level='High'"
+
+ACTIVE_EMPLOYEES_SQL = """
+    SELECT COUNT(DISTINCT employee_id) AS count
+    FROM login_logs
+    WHERE login_time > NOW() - INTERVAL 1 HOUR
+"""
+
+# At most 24 rollup rows per employee, however many samples came in today
+TODAYS_PRODUCTIVITY_SQL = """
+    SELECT
+        IFNULL(ROUND(
+            100 * SUM(mouse_sum + keyboard_sum) /
+            (SUM(mouse_sum + keyboard_sum) + SUM(idle_sum)), 1
+        ), 0) AS productivity
+    FROM employee_activity_hourly
+    WHERE bucket >= CURDATE() AND bucket < CURDATE() + INTERVAL 1 DAY
+"""
+
+RISK_LEADERBOARD_SQL = """
+    SELECT
+        e.id, e.name, e.email, e.role,
+            'Engineering' AS department,
+            '9:00 AM - 5:00 PM' AS shift_time,
+        COALESCE(r.risk_score, 0) AS latest_risk_score,
+        COALESCE(r.alert_level, 'Low') AS alert_level
+    FROM employees e
+    LEFT JOIN employee_risk r ON r.employee_id = e.id
+    ORDER BY latest_risk_score DESC
+"""
+
+# Averages are weighted by sample count, matching AVG() over the raw rows
+HOURLY_ACTIVITY_SQL = """
+    SELECT
+        HOUR(bucket) AS hour,
+        SUM(mouse_sum + keyboard_sum) / SUM(log_count) AS avg_activity,
+        SUM(idle_sum) / SUM(log_count) AS avg_idle
+    FROM employee_activity_hourly
+    WHERE bucket > NOW() - INTERVAL 7 DAY - INTERVAL 1 HOUR
+    GROUP BY HOUR(bucket)
+    ORDER BY hour
+"""
+
+ALERTS_PAGE_SQL = """
+    SELECT fa.*, e.name AS employee_name, e.role AS employee_role
+    FROM fraud_alerts fa
+    JOIN employees e ON fa.employee_id = e.id
+    {where}
+    ORDER BY fa.timestamp DESC, fa.id DESC
+    LIMIT %s
+"""
+
+
+def alerts_page_query(limit, cursor=None, level=None, employee_id=None, since=None, until=None):
+    """
+    SQL and params for a page of alerts after cursor, newest first. One
+    extra row is selected to tell whether there is a next page.
+    """
+    conditions, params = alert_filters(level, employee_id, since, until)
+    if cursor is not None:
+        timestamp, alert_id = parse_alert_cursor(cursor)
+        conditions.append("(fa.timestamp < %s OR (fa.timestamp = %s AND fa.id < %s))")
+        params.extend([timestamp, timestamp, alert_id])
+    where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+    return ALERTS_PAGE_SQL.format(where=where), (*params, limit + 1)
+
+
+# (name, sql, sample params, tables it reads whole by design), for
+# migrations.explain_hot_queries. The leaderboard lists every employee.
+HOT_QUERIES = [
+    ("is_employee_active", IS_EMPLOYEE_ACTIVE_SQL, (1,), ()),
+    ("recent_activity", RECENT_ACTIVITY_SQL, (1, 10), ()),
+    ("activity_for_ml", ML_ACTIVITY_SQL, (1,), ()),
+    ("activity_for_ml_batch", *ml_activity_batch_query([1, 2, 3]), ()),
+    ("activity_summary", ACTIVITY_SUMMARY_SQL, (1,), ()),
+    ("critical_alerts", CRITICAL_ALERTS_SQL, (), ()),
+    ("active_employees", ACTIVE_EMPLOYEES_SQL, (), ()),
+    ("todays_productivity", TODAYS_PRODUCTIVITY_SQL, (), ()),
+    ("hourly_activity", HOURLY_ACTIVITY_SQL, (), ()),
+    ("risk_leaderboard", RISK_LEADERBOARD_SQL, (), ("e",)),
+    ("alerts_page", *alerts_page_query(50, "2038-01-01T00:00:00_0", level="High"), ()),
+]
+
+
+class PooledConnection:
+    """
+    A pooled MySQL connection. Behaves like the underlying connection, except
+    that close() hands it back to the pool instead of disconnecting.
+    """
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        self._released = False
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool.release(self._conn)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class ConnectionPool:
+    """
+    Bounded pool of MySQL connections.
+
+    Connections are opened lazily, up to size. A checkout takes an idle
+    connection (pinging it first if it has sat idle for more than
+    ping_after_seconds and replacing it if the ping fails) or waits up to
+    timeout seconds for one to be returned, then raises PoolError. Returned
+    connections have any open transaction rolled back, so the next user
+    doesn't see a stale snapshot; connections that can't be reset are
+    dropped.
+    """
+    def __init__(self, config, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, ping_after_seconds=1.0):
+        self.config = config
+        self.size = size
+        self.timeout = timeout
+        self.ping_after_seconds = ping_after_seconds
+
+        self._idle = [] # (conn, returned_at), most recently returned last
+        self._open = 0
+        self._cond = threading.Condition()
+
+        self.checkouts = 0
+        self.created = 0
+        self.replaced = 0
+        self.discarded = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def checkout(self):
+        """Returns a PooledConnection; close() it (or use Database.connection()) to give it back."""
+        started = time.perf_counter()
+        waited = False
+        with self._cond:
+            while not self._idle and self._open >= self.size:
+                waited = True
+                remaining = self.timeout - (time.perf_counter() - started)
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolError(f"No database connection available within {self.timeout}s (pool size {self.size})")
+                self._cond.wait(remaining)
+
+            if self._idle:
+                conn, returned_at = self._idle.pop()
+            else:
+                conn, returned_at = None, None
+                self._open += 1
+
+            wait = time.perf_counter() - started
+            self.checkouts += 1
+            if waited:
+                self.waits += 1
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+        # Connect and health-check outside the lock
+        try:
+            if conn is not None and time.time() - returned_at > self.ping_after_seconds and not self._ping(conn):
+                self._disconnect(conn)
+                conn = None
+                with self._cond:
+                    self.replaced += 1
+            if conn is None:
+                conn = mysql.connector.connect(**self.config)
+                with self._cond:
+                    self.created += 1
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        """Takes a connection back, resetting it or dropping it if it's unusable."""
+        try:
+            # A half-read result set would break the next query on this connection
+            healthy = not conn.unread_result
+            if healthy and conn.in_transaction:
+                conn.rollback()
+        except Exception:
+            healthy = False
+
+        with self._cond:
+            if healthy:
+                self._idle.append((conn, time.time()))
+            else:
+                self._open -= 1
+                self.discarded += 1
+            self._cond.notify()
+
+        if not healthy:
+            self._disconnect(conn)
+
+    def close(self):
+        """Disconnects all idle connections."""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for conn, _ in idle:
+            self._disconnect(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self.size,
+                'open': self._open,
+                'in_use': self._open - len(self._idle),
+                'idle': len(self._idle),
+                'checkouts': self.checkouts,
+                'created': self.created,
+                'replaced': self.replaced,
+                'discarded': self.discarded,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'avg_wait_ms': round(1000 * self.wait_seconds / self.checkouts, 3) if self.checkouts else 0.0,
+                'max_wait_ms': round(1000 * self.max_wait_seconds, 3)
+            }
+
+    @staticmethod
+    def _ping(conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _disconnect(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
 
 class Database:
-    def __init__(self):
-        self.db_config = {
+    def __init__(self, pool_size=DB_POOL_SIZE, config=None):
+        self.db_config = config or {
             "host": "localhost",
             "user": "root",
             "password": "",
             "database": "fraud_detection"
         }
+        self.pool = ConnectionPool(self.db_config, size=pool_size)
+        # Called as listener(employee_id, log_id) after each activity row is committed
+        self.activity_listeners = []
 
     def get_connection(self):
-        return mysql.connector.connect(**self.db_config)
+        """Checks a connection out of the pool; its close() returns it."""
+        return self.pool.checkout()
+
+    @contextmanager
+    def connection(self):
+        """Pooled connection for a with block, returned to the pool even if the block raises."""
+        conn = self.pool.checkout()
+        try:
+            yield conn
+        finally:
+            conn.close()
 
     # CREATE ALL TABLES
 
-    def init_db(self):
-        conn = self.get_connection()
-        cur = conn.cursor()
-
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS employees (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            name VARCHAR(100),
-            email VARCHAR(100) UNIQUE,
-            password_hash VARCHAR(255),
-            role VARCHAR(50) DEFAULT 'employee'
-        )
-        """)
-
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS login_logs (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            employee_id INT,
-            login_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            logout_time TIMESTAMP NULL,
-            ip_address VARCHAR(50),
-            device_id VARCHAR(100),
-            FOREIGN KEY (employee_id) REFERENCES employees(id)
-        )
-        """)
-
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS activity_logs (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            employee_id INT,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            mouse_activity INT DEFAULT 0,
-            keyboard_activity INT DEFAULT 0,
-            idle_time INT DEFAULT 0,
-            active_window_title VARCHAR(255) NULL, 
-            FOREIGN KEY (employee_id) REFERENCES employees(id)
-        )
-        """)
-
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS fraud_alerts (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            employee_id INT,
-            risk_score FLOAT,
-            alert_level VARCHAR(20),
-            description TEXT,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (employee_id) REFERENCES employees(id)
-        )
-        """)
-
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS admin_users (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            email VARCHAR(100) UNIQUE,
-            password_hash VARCHAR(255)
-        )
-        """)
-
-        conn.commit()
-        cur.close()
-        conn.close()
+    def init_db(self, wait_for_migrations=True):
+        """
+        Creates any missing tables, then applies pending migrations. Without
+        wait_for_migrations, returns as soon as it sees another process
+        already migrating (see run_migrations).
+        """
+        with self.connection() as conn:
+            cur = conn.cursor()
+
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS employees (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                name VARCHAR(100),
+                email VARCHAR(100) UNIQUE,
+                password_hash VARCHAR(255),
+                role VARCHAR(50) DEFAULT 'employee'
+            )
+            """)
+
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS login_logs (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                employee_id INT,
+                login_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                logout_time TIMESTAMP NULL,
+                ip_address VARCHAR(50),
+                device_id VARCHAR(100),
+                FOREIGN KEY (employee_id) REFERENCES employees(id)
+            )
+            """)
+
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS activity_logs (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                employee_id INT,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                mouse_activity INT DEFAULT 0,
+                keyboard_activity INT DEFAULT 0,
+                idle_time INT DEFAULT 0,
+                active_window_title VARCHAR(255) NULL, 
+                FOREIGN KEY (employee_id) REFERENCES employees(id)
+            )
+            """)
+
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS fraud_alerts (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                employee_id INT,
+                risk_score FLOAT,
+                alert_level VARCHAR(20),
+                description TEXT,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (employee_id) REFERENCES employees(id)
+            )
+            """)
+
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS admin_users (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                email VARCHAR(100) UNIQUE,
+                password_hash VARCHAR(255)
+            )
+            """)
+
+            conn.commit()
+            cur.close()
+
+            # Indexes and later schema changes, applied once per deployment
+            run_migrations(conn, wait=wait_for_migrations)
 
     # SEED DEMO DATA
     def seed_demo_data(self):
-        conn = self.get_connection()
-        cur = conn.cursor(dictionary=True)
+        with self.connection() as conn:
+            cur = conn.cursor(dictionary=True)
 
-        cur.execute("SELECT COUNT(*) AS count FROM employees")
-        if cur.fetchone()['count'] > 0:
-            cur.close()
-            conn.close()
-            return
+            cur.execute("SELECT COUNT(*) AS count FROM employees")
+            if cur.fetchone()['count'] > 0:
+                cur.close()
+                return
 
-        employees = [
-            ('Vikram Singh', 'vikram@company.com', 'password123', 'employee'),
-            ('Priya Sharma', 'priya@company.com', 'password123', 'employee'),
-            ('Anand Patil', 'anand@company.com', 'password123', 'employee'),
-            ('Kavita Mhatre', 'kavita@company.com', 'password123', 'manager'),
-            ('Krish Patel', 'krish@company.com', 'password123', 'employee'),
-            ('Saloni Shukla ', 'Saloni@company.com', 'password123', 'employee')
-        ]
+            employees = [
+                ('Vikram Singh', 'vikram@company.com', 'password123', 'employee'),
+                ('Priya Sharma', 'priya@company.com', 'password123', 'employee'),
+                ('Anand Patil', 'anand@company.com', 'password123', 'employee'),
+                ('Kavita Mhatre', 'kavita@company.com', 'password123', 'manager'),
+                ('Krish Patel', 'krish@company.com', 'password123', 'employee'),
+                ('Saloni Shukla ', 'Saloni@company.com', 'password123', 'employee')
+            ]
 
-        for name, email, password, role in employees:
-            cur.execute("""
-                INSERT INTO employees (name, email, password_hash, role)
-                VALUES (%s, %s, %s, %s)
-            """, (name, email, generate_password_hash(password), role))
+            for name, email, password, role in employees:
+                cur.execute("""
+                    INSERT INTO employees (name, email, password_hash, role)
+                    VALUES (%s, %s, %s, %s)
+                """, (name, email, generate_password_hash(password), role))
 
-        cur.execute("""
-            INSERT INTO admin_users (email, password_hash)
-            VALUES (%s, %s)
-        """, ('admin@company.com', generate_password_hash('admin123')))
+            cur.execute("""
+                INSERT INTO admin_users (email, password_hash)
+                VALUES (%s, %s)
+            """, ('admin@company.com', generate_password_hash('admin123')))
 
-        conn.commit()
-        cur.close()
-        conn.close()
+            conn.commit()
+            cur.close()
 
     # LOGIN / AUTH
     def get_employee_by_email(self, email):
-        conn = self.get_connection()
-        cur = conn.cursor(dictionary=True)
-        cur.execute("SELECT * FROM employees WHERE email = %s", (email,))
-        data = cur.fetchone()
-        cur.close()
-        conn.close()
-        return data
+        with self.connection() as conn:
+            cur = conn.cursor(dictionary=True)
+            cur.execute("SELECT * FROM employees WHERE email = %s", (email,))
+            data = cur.fetchone()
+            cur.close()
+            return data
 
     def get_admin_by_email(self, email):
-        conn = self.get_connection()
-        cur = conn.cursor(dictionary=True)
-        cur.execute("SELECT * FROM admin_users WHERE email = %s", (email,))
-        data = cur.fetchone()
-        cur.close()
-        conn.close()
-        return data
-    def get_employee_by_id(self, employee_id): 
-        """Fetches a single employee record by ID, including hardcoded Department/Shift."""
-        conn = self.get_connection()
-        cur = conn.cursor(dictionary=True)
-        try:
-            cur.execute("""
-                SELECT id, name, email, role
-                FROM employees 
-                WHERE id = %s
-            """, (employee_id,))
+        with self.connection() as conn:
+            cur = conn.cursor(dictionary=True)
+            cur.execute("SELECT * FROM admin_users WHERE email = %s", (email,))
             data = cur.fetchone()
-            
-            if data:
-                data['department'] = 'Information Technology'
-                data['shift_time'] = '9:00 AM - 5:00 PM'
-            
-            return data
-        except Exception as e:
-            print(f"Error fetching employee by ID: {e}")
-            return None
-        finally:
             cur.close()
-            conn.close()
+            return data
+    def get_employee_by_id(self, employee_id): 
+        """Fetches a single employee record by ID, including hardcoded Department/Shift."""
+        with self.connection() as conn:
+            cur = conn.cursor(dictionary=True)
+            try:
+                cur.execute("""
+                    SELECT id, name, email, role
+                    FROM employees 
+                    WHERE id = %s
+                """, (employee_id,))
+                data = cur.fetchone()
+
+                if data:
+                    data['department'] = 'Information Technology'
+                    data['shift_time'] = '9:00 AM - 5:00 PM'
+
+                return data
+            except Exception as e:
+                print(f"Error fetching employee by ID: {e}")
+                return None
+            finally:
+                cur.close()
 
     # LOGIN LOGS
     def create_login_log(self, employee_id, ip_address, device_id):
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO login_logs (employee_id, ip_address, device_id)
-            VALUES (%s, %s, %s)
-        """, (employee_id, ip_address, device_id))
-        conn.commit()
-        cur.close()
-        conn.close()
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO login_logs (employee_id, ip_address, device_id)
+                VALUES (%s, %s, %s)
+            """, (employee_id, ip_address, device_id))
+            conn.commit()
+            cur.close()
 
-    def update_logout_time(self, employee_id):
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            UPDATE login_logs
-            SET logout_time = CURRENT_TIMESTAMP
-            WHERE employee_id = %s AND logout_time IS NULL
-        """, (employee_id,))
-        conn.commit()
-        cur.close()
-        conn.close()
+    def get_current_session(self, employee_id):
+        """
+        The employee's latest login (id, ip_address, device_id), the session
+        new activity samples are recorded against, or None if they never logged in.
+        """
+        with self.connection() as conn:
+            cur = conn.cursor(dictionary=True)
+            cur.execute("""
+                SELECT id, ip_address, device_id FROM login_logs
+                WHERE employee_id = %s
+                ORDER BY id DESC
+                LIMIT 1
+            """, (employee_id,))
+            login = cur.fetchone()
+            cur.close()
+            return login
 
-    def is_employee_active(self, employee_id):
-        """Checks if an employee has a current login session (login_time set, logout_time is NULL)."""
-        conn = self.get_connection()
-        cur = conn.cursor(dictionary=True)
-        try:
+    def update_logout_time(self, employee_id):
+        with self.connection() as conn:
+            cur = conn.cursor()
             cur.execute("""
-                SELECT COUNT(*) AS count 
-                FROM login_logs
+                UPDATE login_logs
+                SET logout_time = CURRENT_TIMESTAMP
                 WHERE employee_id = %s AND logout_time IS NULL
             """, (employee_id,))
-            count = cur.fetchone()['count']
-            return count > 0
-        except Exception as e:
-            print(f"Error checking active status: {e}")
-            return False
-        finally:
+            conn.commit()
             cur.close()
-            conn.close()
+
+    def is_employee_active(self, employee_id):
+        """Checks if an employee has a current login session (login_time set, logout_time is NULL)."""
+        with self.connection() as conn:
+            cur = conn.cursor(dictionary=True)
+            try:
+                cur.execute(IS_EMPLOYEE_ACTIVE_SQL, (employee_id,))
+                count = cur.fetchone()['count']
+                return count > 0
+            except Exception as e:
+                print(f"Error checking active status: {e}")
+                return False
+            finally:
+                cur.close()
 
     # ACTIVITY LOGS 
     def create_activity_log(self, employee_id, mouse, keyboard, idle, active_window_title=''):
-        """Inserts an activity log record, including the active window title."""
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO activity_logs (employee_id, mouse_activity, keyboard_activity, idle_time, active_window_title)
-            VALUES (%s, %s, %s, %s, %s)
-        """, (employee_id, mouse, keyboard, idle, active_window_title))
-        last_id = cur.lastrowid
-        conn.commit()
-        cur.close()
-        conn.close()
+        """Inserts an activity log record, including the active window title and current login session."""
+        with self.connection() as conn:
+            cur = conn.cursor()
+            login_id = current_login_ids(cur, [employee_id]).get(employee_id)
+            cur.execute("""
+                INSERT INTO activity_logs (employee_id, mouse_activity, keyboard_activity, idle_time, active_window_title, login_id)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, (employee_id, mouse, keyboard, idle, active_window_title, login_id))
+            last_id = cur.lastrowid
+            # The row's timestamp comes from the server clock, so MySQL picks its hour
+            cur.execute(EMPLOYEE_HOURLY_ROLLUP_FROM_LOG, (last_id,))
+            cur.execute(EMPLOYEE_TOTALS_UPSERT, (employee_id, 1, mouse or 0, keyboard or 0, idle or 0))
+            conn.commit()
+            cur.close()
+        for listener in self.activity_listeners:
+            listener(employee_id, last_id)
         return last_id
     
+    def create_activity_logs(self, logs):
+        """
+        Inserts many (employee_id, mouse, keyboard, idle, active_window_title, timestamp)
+        activity records in one multi-row INSERT, each linked to its employee's
+        current login session, updates the hourly rollups in
+        the same transaction, and notifies activity_listeners (with no log id,
+        since ids of a multi-row insert aren't reported per row).
+        """
+        if not logs:
+            return
+        with self.connection() as conn:
+            cur = conn.cursor()
+            login_ids = current_login_ids(cur, [log[0] for log in logs])
+            cur.executemany("""
+                INSERT INTO activity_logs (employee_id, mouse_activity, keyboard_activity, idle_time, active_window_title, timestamp, login_id)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """, [(*log, login_ids.get(log[0])) for log in logs])
+            roll_up_activity(cur, [
+                (employee_id, timestamp, mouse, keyboard, idle)
+                for employee_id, mouse, keyboard, idle, _, timestamp in logs
+            ])
+            conn.commit()
+            cur.close()
+        for employee_id in {log[0] for log in logs}:
+            for listener in self.activity_listeners:
+                listener(employee_id, None)
+
+    def iter_activity_logs(self, since, until, employee_id=None, chunk_size=1000):
+        """
+        Yields the activity rows in [since, until), optionally for one
+        employee, oldest first with the employee's name, streamed from an
+        unbuffered cursor like iter_alerts().
+        """
+        conditions = ["a.timestamp >= %s", "a.timestamp < %s"]
+        params = [since, until]
+        if employee_id is not None:
+            conditions.append("a.employee_id = %s")
+            params.append(employee_id)
+        with self.connection() as conn:
+            cur = conn.cursor(dictionary=True, buffered=False)
+            try:
+                cur.execute(f"""
+                    SELECT a.id, a.employee_id, e.name AS employee_name, a.timestamp,
+                           a.mouse_activity, a.keyboard_activity, a.idle_time,
+                           a.active_window_title, a.login_id
+                    FROM activity_logs a
+                    LEFT JOIN employees e ON a.employee_id = e.id
+                    WHERE {" AND ".join(conditions)}
+                    ORDER BY a.timestamp, a.id
+                """, tuple(params))
+                yield from fetch_in_chunks(cur, chunk_size)
+            finally:
+                try:
+                    cur.close()
+                except Error:
+                    pass
+
+    # ACTIVITY RETENTION (see archive.py)
+    def get_oldest_activity_time(self, since=None):
+        """Timestamp of the oldest activity row (at or after since), or None."""
+        with self.connection() as conn:
+            cur = conn.cursor()
+            if since is None:
+                cur.execute("SELECT MIN(timestamp) FROM activity_logs")
+            else:
+                cur.execute("SELECT MIN(timestamp) FROM activity_logs WHERE timestamp >= %s", (since,))
+            oldest = cur.fetchone()[0]
+            cur.close()
+            return oldest
+
+    def get_archive_watermark(self):
+        """Start of the first day after the newest archived day, or None if nothing is archived."""
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT MAX(day) FROM activity_archive")
+            day = cur.fetchone()[0]
+            cur.close()
+        if day is None:
+            return None
+        return datetime.combine(day + timedelta(days=1), datetime.min.time())
+
+    def record_archived_day(self, day, row_count, path):
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO activity_archive (day, row_count, path)
+                VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    row_count = VALUES(row_count),
+                    path = VALUES(path),
+                    archived_at = CURRENT_TIMESTAMP
+            """, (day, row_count, path))
+            conn.commit()
+            cur.close()
+
+    def delete_activity_range(self, since, until, max_id, batch_size=5000):
+        """
+        Deletes activity rows in [since, until) with id <= max_id, batch_size
+        rows per transaction so locks and undo stay small. Rollups and totals
+        are deliberately left as they are. Returns the number of rows deleted.
+        """
+        deleted = 0
+        with self.connection() as conn:
+            cur = conn.cursor()
+            while True:
+                cur.execute("""
+                    DELETE FROM activity_logs
+                    WHERE timestamp >= %s AND timestamp < %s AND id <= %s
+                    LIMIT %s
+                """, (since, until, max_id, batch_size))
+                count = cur.rowcount
+                conn.commit()
+                deleted += count
+                if count < batch_size:
+                    break
+            cur.close()
+        return deleted
+
     def get_activity_log_by_id(self, log_id): # NEW: Helper to fetch single log by ID
-        conn = self.get_connection()
-        cur = conn.cursor(dictionary=True)
-        cur.execute("SELECT * FROM activity_logs WHERE id = %s", (log_id,))
-        log = cur.fetchone()
-        cur.close()
-        conn.close()
-        return log
+        """The activity row with the IP address and device of its login session."""
+        with self.connection() as conn:
+            cur = conn.cursor(dictionary=True)
+            cur.execute("""
+                SELECT a.*, l.ip_address, l.device_id
+                FROM activity_logs a
+                LEFT JOIN login_logs l ON l.id = a.login_id
+                WHERE a.id = %s
+            """, (log_id,))
+            log = cur.fetchone()
+            cur.close()
+            return log
 
     def get_activity_summary(self, employee_id):
-        conn = self.get_connection()
-        cur = conn.cursor(dictionary=True)
-        cur.execute("""
-            SELECT 
-                SUM(mouse_activity) AS total_mouse,
-                SUM(keyboard_activity) AS total_keyboard,
-                SUM(idle_time) AS total_idle,
-                COUNT(*) * 15 AS total_time,
-                COUNT(*) AS log_count
-            FROM activity_logs
-            WHERE employee_id = %s
-        """, (employee_id,))
-        data = cur.fetchone()
-        if data['total_mouse'] is None:
-            data = {
-                'total_mouse': 0,
-                'total_keyboard': 0,
-                'total_idle': 0,
-                'total_time': 0,
-                'log_count': 0
-            }
-        if data:
-            for key in data:
-                if isinstance(data[key], decimal.Decimal):
-                    data[key] = float(data[key])
-            
-        cur.close()
-        conn.close()
-        return data
+        """Lifetime activity totals for an employee: one primary-key lookup, maintained at ingest."""
+        with self.connection() as conn:
+            cur = conn.cursor(dictionary=True)
+            cur.execute(ACTIVITY_SUMMARY_SQL, (employee_id,))
+            data = cur.fetchone()
+            if data is None:
+                data = {
+                    'total_mouse': 0,
+                    'total_keyboard': 0,
+                    'total_idle': 0,
+                    'total_time': 0,
+                    'log_count': 0
+                }
+            if data:
+                for key in data:
+                    if isinstance(data[key], decimal.Decimal):
+                        data[key] = float(data[key])
+
+            cur.close()
+            return data
+
+    def rebuild_activity_totals(self, employee_id=None):
+        """
+        Reconciles employee_activity_totals with activity_logs, for one
+        employee or all of them, e.g. after rows were written or deleted
+        outside create_activity_log(s). Days already archived out of
+        activity_logs are counted from the hourly rollups instead.
+        """
+        and_employee = and_t_employee = ""
+        employee_params = ()
+        if employee_id is not None:
+            and_employee = "AND employee_id = %s"
+            and_t_employee = "AND t.employee_id = %s"
+            employee_params = (employee_id,)
+        # Before anything is archived, the rollup part matches nothing
+        watermark = self.get_archive_watermark() or datetime(1970, 1, 1)
+
+        with self.connection() as conn:
+            cur = conn.cursor()
+            # Recount from raw logs plus archived rollups, then drop totals of employees with no activity left
+            cur.execute(f"""
+                INSERT INTO employee_activity_totals (employee_id, log_count, mouse_sum, keyboard_sum, idle_sum)
+                SELECT employee_id, SUM(log_count), SUM(mouse_sum), SUM(keyboard_sum), SUM(idle_sum)
+                FROM (
+                    SELECT employee_id, COUNT(*) AS log_count, IFNULL(SUM(mouse_activity), 0) AS mouse_sum,
+                           IFNULL(SUM(keyboard_activity), 0) AS keyboard_sum, IFNULL(SUM(idle_time), 0) AS idle_sum
+                    FROM activity_logs
+                    WHERE timestamp >= %s AND employee_id IS NOT NULL {and_employee}
+                    GROUP BY employee_id
+                    UNION ALL
+                    SELECT employee_id, SUM(log_count), SUM(mouse_sum), SUM(keyboard_sum), SUM(idle_sum)
+                    FROM employee_activity_hourly
+                    WHERE bucket < %s {and_employee}
+                    GROUP BY employee_id
+                ) parts
+                GROUP BY employee_id
+                ON DUPLICATE KEY UPDATE
+                    log_count = VALUES(log_count),
+                    mouse_sum = VALUES(mouse_sum),
+                    keyboard_sum = VALUES(keyboard_sum),
+                    idle_sum = VALUES(idle_sum),
+                    updated_at = CURRENT_TIMESTAMP
+            """, (watermark, *employee_params, watermark, *employee_params))
+            cur.execute(f"""
+                DELETE t FROM employee_activity_totals t
+                WHERE NOT EXISTS (SELECT 1 FROM activity_logs a WHERE a.employee_id = t.employee_id)
+                AND NOT EXISTS (SELECT 1 FROM employee_activity_hourly h WHERE h.employee_id = t.employee_id)
+                {and_t_employee}
+            """, employee_params)
+            conn.commit()
+            cur.close()
 
     def get_recent_activity_logs(self, employee_id, limit=10):
-        conn = self.get_connection()
-        cur = conn.cursor(dictionary=True)
-        cur.execute("""
-            SELECT * FROM activity_logs
-            WHERE employee_id = %s
-            ORDER BY timestamp DESC
-            LIMIT %s
-        """, (employee_id, limit))
-        logs = cur.fetchall()
-        cur.close()
-        conn.close()
-        return logs
+        with self.connection() as conn:
+            cur = conn.cursor(dictionary=True)
+            cur.execute(RECENT_ACTIVITY_SQL, (employee_id, limit))
+            logs = cur.fetchall()
+            cur.close()
+            return logs
     
     def get_detailed_activity(self, employee_id, limit=100):
         """Retrieves detailed activity logs for a specific employee, including the window title."""
-        conn = self.get_connection()
-        cur = conn.cursor(dictionary=True)
-        try:
-            cur.execute("""
-                SELECT 
-                    timestamp, mouse_activity, keyboard_activity, idle_time, active_window_title
-                FROM activity_logs
-                WHERE employee_id = %s
-                ORDER BY timestamp DESC
-                LIMIT %s
-            """, (employee_id, limit))
-            logs = cur.fetchall()
-            return logs
-        except Exception as e:
-            print(f"Error fetching detailed activity: {e}")
-            return []
-        finally:
-            cur.close()
-            conn.close()
+        with self.connection() as conn:
+            cur = conn.cursor(dictionary=True)
+            try:
+                cur.execute("""
+                    SELECT 
+                        timestamp, mouse_activity, keyboard_activity, idle_time, active_window_title
+                    FROM activity_logs
+                    WHERE employee_id = %s
+                    ORDER BY timestamp DESC
+                    LIMIT %s
+                """, (employee_id, limit))
+                logs = cur.fetchall()
+                return logs
+            except Exception as e:
+                print(f"Error fetching detailed activity: {e}")
+                return []
+            finally:
+                cur.close()
 
     # ALERTS
     def create_fraud_alert(self, employee_id, risk, level, description):
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO fraud_alerts (employee_id, risk_score, alert_level, description)
-            VALUES (%s, %s, %s, %s)
-        """, (employee_id, risk, level, description))
-        conn.commit()
-        cur.close()
-        conn.close()
+        """Inserts an alert and updates the employee's latest risk in the same transaction."""
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO fraud_alerts (employee_id, risk_score, alert_level, description)
+                VALUES (%s, %s, %s, %s)
+            """, (employee_id, risk, level, description))
+            cur.execute(LATEST_RISK_UPSERT, (employee_id, risk, level))
+            conn.commit()
+            cur.close()
+
+    def create_fraud_alerts(self, alerts):
+        """
+        Inserts many (employee_id, risk, level, description) alerts in one
+        multi-row INSERT and updates latest risks in the same transaction;
+        an employee's last alert in the list wins.
+        """
+        if not alerts:
+            return
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.executemany("""
+                INSERT INTO fraud_alerts (employee_id, risk_score, alert_level, description)
+                VALUES (%s, %s, %s, %s)
+            """, alerts)
+            latest = {}
+            for employee_id, risk, level, _ in alerts:
+                latest[employee_id] = (employee_id, risk, level)
+            cur.executemany(LATEST_RISK_UPSERT, list(latest.values()))
+            conn.commit()
+            cur.close()
 
     def get_recent_alerts(self, limit=10):
-        conn = self.get_connection()
-        cur = conn.cursor(dictionary=True)
-        cur.execute("""
-            SELECT fa.*, e.name AS employee_name, e.role AS employee_role
-            FROM fraud_alerts fa
-            JOIN employees e ON fa.employee_id = e.id
-            ORDER BY fa.timestamp DESC
-            LIMIT %s
-        """, (limit,))
-        alerts = cur.fetchall()
-        cur.close()
-        conn.close()
-        return alerts
-
-    def get_all_alerts(self):
-        conn = self.get_connection()
-        cur = conn.cursor(dictionary=True)
-        cur.execute("""
-            SELECT fa.*, e.name AS employee_name, e.role AS employee_role
-            FROM fraud_alerts fa
-            JOIN employees e ON fa.employee_id = e.id
-            ORDER BY fa.timestamp DESC
-        """)
-        data = cur.fetchall()
-        cur.close()
-        conn.close()
-        return data
+        with self.connection() as conn:
+            cur = conn.cursor(dictionary=True)
+            cur.execute("""
+                SELECT fa.*, e.name AS employee_name, e.role AS employee_role
+                FROM fraud_alerts fa
+                JOIN employees e ON fa.employee_id = e.id
+                ORDER BY fa.timestamp DESC
+                LIMIT %s
+            """, (limit,))
+            alerts = cur.fetchall()
+            cur.close()
+            return alerts
+
+    def get_alerts_page(self, limit=50, cursor=None, level=None, employee_id=None, since=None, until=None):
+        """
+        One page of alerts, newest first, optionally filtered by alert level,
+        employee and [since, until) time range. Pages are keyset-paginated on
+        (timestamp, id): pass the returned next_cursor back in to get the
+        following page, which costs the same however deep it is. next_cursor
+        is None on the last page.
+        """
+        sql, params = alerts_page_query(limit, cursor, level, employee_id, since, until)
+
+        with self.connection() as conn:
+            cur = conn.cursor(dictionary=True)
+            cur.execute(sql, params)
+            alerts = cur.fetchall()
+            cur.close()
+
+        next_cursor = None
+        if len(alerts) > limit:
+            alerts = alerts[:limit]
+            next_cursor = alert_cursor(alerts[-1])
+        return {'alerts': alerts, 'next_cursor': next_cursor}
+
+    def iter_alerts(self, level=None, employee_id=None, since=None, until=None, chunk_size=1000):
+        """
+        Yields every alert matching the filters, newest first, streamed from
+        an unbuffered cursor chunk_size rows at a time, so memory stays flat
+        however many alerts there are. Holds a pooled connection until the
+        generator is exhausted or closed.
+        """
+        conditions, params = alert_filters(level, employee_id, since, until)
+        where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+        with self.connection() as conn:
+            cur = conn.cursor(dictionary=True, buffered=False)
+            try:
+                cur.execute(f"""
+                    SELECT fa.*, e.name AS employee_name, e.role AS employee_role
+                    FROM fraud_alerts fa
+                    JOIN employees e ON fa.employee_id = e.id
+                    {where}
+                    ORDER BY fa.timestamp DESC, fa.id DESC
+                """, tuple(params))
+                yield from fetch_in_chunks(cur, chunk_size)
+            finally:
+                try:
+                    cur.close()
+                except Error:
+                    # An abandoned stream leaves unread rows; the pool drops that connection
+                    pass
 
     # ADMIN DASHBOARD QUERIES
     def get_dashboard_stats(self):
-        conn = self.get_connection()
-        cur = conn.cursor(dictionary=True)
-
-        cur.execute("SELECT COUNT(*) AS count FROM fraud_alerts WHERE alert_level='High'")
-        critical_alerts = cur.fetchone()['count']
-
-        cur.execute("SELECT COUNT(*) AS count FROM employees")
-        total_employees = cur.fetchone()['count']
-
-        cur.execute("""
-            SELECT COUNT(DISTINCT employee_id) AS count
-            FROM login_logs
-            WHERE login_time > NOW() - INTERVAL 1 HOUR
-        """)
-        active_employees = cur.fetchone()['count']
-
-        cur.execute("""
-            SELECT 
-                IFNULL(ROUND(
-                    100 * SUM(mouse_activity + keyboard_activity) /
-                    (SUM(mouse_activity + keyboard_activity) + SUM(idle_time)), 1
-                ), 0) AS productivity
-            FROM activity_logs
-            WHERE DATE(timestamp) = CURDATE()
-        """)
-        avg_productivity = cur.fetchone()['productivity']
-
-        cur.close()
-        conn.close()
+        with self.connection() as conn:
+            cur = conn.cursor(dictionary=True)
 
-        return {
-            "critical_alerts": critical_alerts,
-            "total_employees": total_employees,
-            "active_employees": active_employees,
-            "avg_productivity": float(avg_productivity)
-        }
+            cur.execute(CRITICAL_ALERTS_SQL)
+            critical_alerts = cur.fetchone()['count']
+
+            cur.execute("SELECT COUNT(*) AS count FROM employees")
+            total_employees = cur.fetchone()['count']
+
+            cur.execute(ACTIVE_EMPLOYEES_SQL)
+            active_employees = cur.fetchone()['count']
+
+            cur.execute(TODAYS_PRODUCTIVITY_SQL)
+            avg_productivity = cur.fetchone()['productivity']
+
+            cur.close()
+
+            return {
+                "critical_alerts": critical_alerts,
+                "total_employees": total_employees,
+                "active_employees": active_employees,
+                "avg_productivity": float(avg_productivity)
+            }
 
     def get_employees_with_risk_scores(self):
-        conn = self.get_connection()
-        cur = conn.cursor(dictionary=True)
-
-        cur.execute("""
-            SELECT 
-                e.id, e.name, e.email, e.role,
-                    'Engineering' AS department, 
-                    '9:00 AM - 5:00 PM' AS shift_time,
-                COALESCE((
-                    SELECT risk_score FROM fraud_alerts 
-                    WHERE employee_id = e.id
-                    ORDER BY timestamp DESC LIMIT 1
-                ), 0) AS latest_risk_score,
-                
-                COALESCE((
-                    SELECT alert_level FROM fraud_alerts 
-                    WHERE employee_id = e.id
-                    ORDER BY timestamp DESC LIMIT 1
-                ), 'Low') AS alert_level
-
-            FROM employees e
-            ORDER BY latest_risk_score DESC
-        """)
-
-        data = cur.fetchall()
-        cur.close()
-        conn.close()
-        return data
+        with self.connection() as conn:
+            cur = conn.cursor(dictionary=True)
+
+            cur.execute(RISK_LEADERBOARD_SQL)
+
+            data = cur.fetchall()
+            cur.close()
+            return data
 
     # HOURLY ACTIVITY (FOR CHARTS)
     
     def get_hourly_activity_data(self):
-        conn = self.get_connection()
-        cur = conn.cursor(dictionary=True)
-
-        cur.execute("""
-            SELECT 
-                HOUR(timestamp) AS hour,
-                AVG(mouse_activity + keyboard_activity) AS avg_activity,
-                AVG(idle_time) AS avg_idle
-            FROM activity_logs
-            WHERE timestamp > NOW() - INTERVAL 7 DAY
-            GROUP BY HOUR(timestamp)
-            ORDER BY hour
-        """)
-
-        data = cur.fetchall()
-        cur.close()
-        conn.close()
-        return data
+        """Average activity per hour of day over the last 7 days, from the hourly rollup."""
+        with self.connection() as conn:
+            cur = conn.cursor(dictionary=True)
+
+            cur.execute(HOURLY_ACTIVITY_SQL)
+
+            data = cur.fetchall()
+            cur.close()
+            return data
+
+    def rebuild_activity_rollups(self, since=None):
+        """
+        Recomputes the hourly rollups from activity_logs, for every hour from
+        since (a datetime, rounded down to the hour) or for all history. Use
+        it to catch up after rows were written or deleted outside
+        create_activity_log(s). Hours before the archive watermark are kept as
+        they are, since their rows are no longer in activity_logs. Returns the
+        number of employee-hour buckets written.
+        """
+        watermark = self.get_archive_watermark()
+        if watermark is not None and (since is None or since < watermark):
+            since = watermark
+
+        log_where = bucket_where = ""
+        params = ()
+        if since is not None:
+            log_where = "WHERE timestamp >= %s"
+            bucket_where = "WHERE bucket >= %s"
+            params = (since.replace(minute=0, second=0, microsecond=0),)
+
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(f"DELETE FROM employee_activity_hourly {bucket_where}", params)
+
+            cur.execute(f"""
+                INSERT INTO employee_activity_hourly (employee_id, bucket, log_count, mouse_sum, keyboard_sum, idle_sum)
+                SELECT employee_id, DATE(timestamp) + INTERVAL HOUR(timestamp) HOUR AS hour_bucket,
+                       COUNT(*), IFNULL(SUM(mouse_activity), 0), IFNULL(SUM(keyboard_activity), 0), IFNULL(SUM(idle_time), 0)
+                FROM activity_logs
+                {log_where}
+                GROUP BY employee_id, hour_bucket
+            """, params)
+            buckets = cur.rowcount
+            conn.commit()
+            cur.close()
+            return buckets
 
     # ML ACTIVITY DATA
     def get_employee_activity_for_ml(self, employee_id):
         """Returns latest activity logs for ML model using real database tables."""
         try:
-            conn = self.get_connection()
-            cur = conn.cursor(dictionary=True)
+            with self.connection() as conn:
+                cur = conn.cursor(dictionary=True)
 
-            cur.execute("""
-                SELECT 
-                    a.idle_time,
-                    a.mouse_activity,
-                    a.keyboard_activity,
-                    HOUR(a.timestamp) AS hour,
-                    l.ip_address,
-                    l.device_id
-                FROM activity_logs a
-                LEFT JOIN login_logs l 
-                    ON a.employee_id = l.employee_id
-                    AND DATE(a.timestamp) = DATE(l.login_time)
-                WHERE a.employee_id = %s
-                ORDER BY a.timestamp DESC
-                LIMIT 100
-            """, (employee_id,))
+                cur.execute(ML_ACTIVITY_SQL, (employee_id,))
 
-            rows = cur.fetchall()
-            cur.close()
-            conn.close()
-            return rows
+                rows = cur.fetchall()
+                cur.close()
+                return rows
 
         except Exception as e:
             print("Error fetching ML activity:", e)
             return []
 
+    def get_activity_for_ml_batch(self, employee_ids=None, limit_per_employee=100):
+        """
+        Batch version of get_employee_activity_for_ml: returns the latest
+        activity rows of all (or the given) employees in one query, as
+        {employee_id: rows} with each employee's rows newest first.
+        """
+        if employee_ids is not None and len(employee_ids) == 0:
+            return {}
+
+        sql, params = ml_activity_batch_query(employee_ids, limit_per_employee)
+
+        try:
+            with self.connection() as conn:
+                cur = conn.cursor(dictionary=True)
+
+                cur.execute(sql, params)
+
+                rows = cur.fetchall()
+                cur.close()
+
+        except Exception as e:
+            print("Error fetching batch ML activity:", e)
+            return {}
+
+        activity_by_employee = {}
+        for row in rows:
+            activity_by_employee.setdefault(row['employee_id'], []).append(row)
+        return activity_by_employee
+
     # EMPLOYEE MANAGEMENT 
     def get_employee_by_id(self, employee_id):
         """Fetches a single employee record by ID."""
-        conn = self.get_connection()
-        cur = conn.cursor(dictionary=True)
-        try:
-            cur.execute("SELECT id, name, email, role FROM employees WHERE id = %s", (employee_id,))
-            data = cur.fetchone()
-            return data
-        except Exception as e:
-            print(f"Error fetching employee by ID: {e}")
-            return None
-        finally:
-            cur.close()
-            conn.close()
+        with self.connection() as conn:
+            cur = conn.cursor(dictionary=True)
+            try:
+                cur.execute("SELECT id, name, email, role FROM employees WHERE id = %s", (employee_id,))
+                data = cur.fetchone()
+                return data
+            except Exception as e:
+                print(f"Error fetching employee by ID: {e}")
+                return None
+            finally:
+                cur.close()
 
     def create_employee(self, name, email, password_hash, role='employee'):
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO employees (name, email, password_hash, role)
-            VALUES (%s, %s, %s, %s)
-        """, (name, email, password_hash, role))
-        conn.commit()
-        cur.close()
-        conn.close()
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO employees (name, email, password_hash, role)
+                VALUES (%s, %s, %s, %s)
+            """, (name, email, password_hash, role))
+            conn.commit()
+            cur.close()
 
     def delete_employee(self, employee_id):
-        conn = self.get_connection()
-        cur = conn.cursor()
-        cur.execute("DELETE FROM fraud_alerts WHERE employee_id = %s", (employee_id,))
-        cur.execute("DELETE FROM activity_logs WHERE employee_id = %s", (employee_id,))
-        cur.execute("DELETE FROM login_logs WHERE employee_id = %s", (employee_id,))
-        cur.execute("DELETE FROM employees WHERE id = %s", (employee_id,))
-        conn.commit()
-        cur.close()
-        conn.close()
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM employee_risk WHERE employee_id = %s", (employee_id,))
+            cur.execute("DELETE FROM fraud_alerts WHERE employee_id = %s", (employee_id,))
+            cur.execute("DELETE FROM employee_activity_hourly WHERE employee_id = %s", (employee_id,))
+            cur.execute("DELETE FROM employee_activity_totals WHERE employee_id = %s", (employee_id,))
+            cur.execute("DELETE FROM activity_logs WHERE employee_id = %s", (employee_id,))
+            cur.execute("DELETE FROM login_logs WHERE employee_id = %s", (employee_id,))
+            cur.execute("DELETE FROM employees WHERE id = %s", (employee_id,))
+            conn.commit()
+            cur.close()
 
     def get_all_employees(self):
         """Fetches all employee records (ID, name, email, role) from the database."""
-        conn = self.get_connection()
-        cur = conn.cursor(dictionary=True)
-        try:
-            cur.execute("SELECT id, name, email, role FROM employees ORDER BY name")
-            data = cur.fetchall()
-            return data
-        except Exception as e:
-            print(f"Error fetching all employees: {e}")
-            return []
-        finally:
-            cur.close()
-            conn.close()
+        with self.connection() as conn:
+            cur = conn.cursor(dictionary=True)
+            try:
+                cur.execute("SELECT id, name, email, role FROM employees ORDER BY name")
+                data = cur.fetchall()
+                return data
+            except Exception as e:
+                print(f"Error fetching all employees: {e}")
+                return []
+            finally:
+                cur.close()
     
     def get_risk_distribution(self):
         """
         Returns count of alerts grouped by alert level
         """
-        conn = self.get_connection()
-        cur = conn.cursor(dictionary=True)
+        with self.connection() as conn:
+            cur = conn.cursor(dictionary=True)
 
-        cur.execute("""
-            SELECT 
-                COALESCE(alert_level, 'Low') AS alert_level,
-                COUNT(*) AS count
-            FROM fraud_alerts
-            GROUP BY alert_level
-        """)
+            cur.execute("""
+                SELECT 
+                    COALESCE(alert_level, 'Low') AS alert_level,
+                    COUNT(*) AS count
+                FROM fraud_alerts
+                GROUP BY alert_level
+            """)
 
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
+            rows = cur.fetchall()
+            cur.close()
 
         distribution = {
             "Low": 0,
@@ -544,3 +1259,218 @@ class Database:
 
         return distribution
 
+
+class ActivityWriter:
+    """
+    Write-behind buffer for activity logs.
+
+    submit() queues a sample and immediately returns a synthetic log record
+    (id None, timestamp set at submit time); a background thread writes the
+    queue with Database.create_activity_logs once batch_size samples are
+    waiting or the oldest has waited flush_interval seconds. A failed flush
+    keeps its rows queued and the next attempt waits flush_interval, doubling
+    with each consecutive failure up to max_backoff. If the batch violates a
+    constraint (say its employee was deleted while the sample was queued),
+    the rows are written one at a time and those that still fail are
+    dropped. close() stops the thread and writes whatever is left, so call
+    it on shutdown. Past max_pending queued samples, submit() flushes in the
+    caller as backpressure.
+    """
+    def __init__(self, db, batch_size=500, flush_interval=1.0, max_pending=50000, max_backoff=60.0):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_backoff = max_backoff
+
+        self._pending = [] # (employee_id, mouse, keyboard, idle, title, timestamp)
+        self._oldest = None # perf_counter() when the oldest pending sample was queued
+        self._failures = 0 # consecutive failed flushes
+        self._retry_at = None # perf_counter() before which the writer thread won't retry
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock() # one flush at a time, so rows stay in order
+        self._closed = False
+
+        self.submitted = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.dropped = 0
+        self.discarded = 0
+        self.max_depth = 0
+        self.flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.last_flush_seconds = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="activity-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, employee_id, mouse, keyboard, idle, active_window_title=''):
+        """
+        Queues one sample and returns the activity_logs-shaped record it will
+        be written as, with the IP address and device of the employee's
+        current login session.
+        """
+        timestamp = datetime.now().replace(microsecond=0)
+        try:
+            login = self.db.get_current_session(employee_id)
+        except Exception as e:
+            # Still queue the sample; scoring falls back to the last session seen
+            print(f"Error resolving login session for employee {employee_id}: {e}")
+            login = None
+        login = login or {}
+
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("ActivityWriter is closed")
+            if not self._pending:
+                self._oldest = time.perf_counter()
+            self._pending.append((employee_id, mouse, keyboard, idle, active_window_title, timestamp))
+            self.submitted += 1
+            depth = len(self._pending)
+            self.max_depth = max(self.max_depth, depth)
+            # Wake the writer to start its flush timer, or to flush a full batch
+            if depth == 1 or depth >= self.batch_size:
+                self._cond.notify()
+
+        if depth >= self.max_pending:
+            self.flush()
+
+        return {
+            'id': None,
+            'employee_id': employee_id,
+            'timestamp': timestamp,
+            'mouse_activity': mouse,
+            'keyboard_activity': keyboard,
+            'idle_time': idle,
+            'active_window_title': active_window_title,
+            'login_id': login.get('id'), # resolved again when the batch is written
+            'ip_address': login.get('ip_address'),
+            'device_id': login.get('device_id')
+        }
+
+    def flush(self):
+        """Writes everything queued so far. Returns the number of rows written."""
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending = self._pending, []
+                self._oldest = None
+            if not batch:
+                return 0
+
+            started = time.perf_counter()
+            complete = True
+            try:
+                self.db.create_activity_logs(batch)
+                written = len(batch)
+            except IntegrityError as e:
+                print(f"Error flushing {len(batch)} activity logs, writing them one by one: {e}")
+                written, complete = self._write_each(batch, started)
+            except Exception as e:
+                self._requeue(batch, started, e)
+                return 0
+
+            elapsed = time.perf_counter() - started
+            with self._cond:
+                self.flushes += 1
+                self.flushed += written
+                self.flush_seconds += elapsed
+                self.last_flush_seconds = elapsed
+                self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+                if complete:
+                    self._failures = 0
+                    self._retry_at = None
+            return written
+
+    def _write_each(self, batch, started):
+        """
+        Writes rows singly, dropping those that violate a constraint. Returns
+        (rows written, False if another error put the rest back in the queue).
+        """
+        written = 0
+        for i, row in enumerate(batch):
+            try:
+                self.db.create_activity_logs([row])
+                written += 1
+            except IntegrityError as e:
+                print(f"Dropping activity log for employee {row[0]} that can't be written: {e}")
+                with self._cond:
+                    self.dropped += 1
+            except Exception as e:
+                self._requeue(batch[i:], started, e)
+                return written, False
+        return written, True
+
+    def _requeue(self, rows, started, error):
+        """Puts unwritten rows back at the head of the queue and backs off before the next try."""
+        with self._cond:
+            self._pending[:0] = rows
+            self._oldest = started
+            self.failed_flushes += 1
+            self._failures += 1
+            delay = min(self.flush_interval * 2 ** (self._failures - 1), self.max_backoff)
+            self._retry_at = time.perf_counter() + delay
+        print(f"Error flushing {len(rows)} activity logs, will retry in {delay:.1f}s: {error}")
+
+    def discard(self, employee_id):
+        """Drops an employee's queued samples, e.g. before deleting the employee. Returns how many."""
+        with self._cond:
+            kept = [row for row in self._pending if row[0] != employee_id]
+            count = len(self._pending) - len(kept)
+            self._pending = kept
+            if not kept:
+                self._oldest = None
+            self.discarded += count
+        return count
+
+    def close(self):
+        """Stops the background thread and writes any queued samples."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self.flush()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queue_depth': len(self._pending),
+                'max_depth': self.max_depth,
+                'oldest_pending_ms': round(1000 * (time.perf_counter() - self._oldest), 3) if self._oldest is not None else 0.0,
+                'submitted': self.submitted,
+                'flushed': self.flushed,
+                'flushes': self.flushes,
+                'failed_flushes': self.failed_flushes,
+                'dropped': self.dropped,
+                'discarded': self.discarded,
+                'retry_in_ms': round(1000 * max(self._retry_at - time.perf_counter(), 0), 3) if self._retry_at is not None else 0.0,
+                'avg_flush_ms': round(1000 * self.flush_seconds / self.flushes, 3) if self.flushes else 0.0,
+                'last_flush_ms': round(1000 * self.last_flush_seconds, 3),
+                'max_flush_ms': round(1000 * self.max_flush_seconds, 3)
+            }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    # After a failed flush, wait out the backoff even if a full batch is waiting
+                    if self._retry_at is not None:
+                        backoff = self._retry_at - time.perf_counter()
+                        if backoff > 0:
+                            self._cond.wait(backoff)
+                            continue
+                        self._retry_at = None
+                    if len(self._pending) >= self.batch_size:
+                        break
+                    if self._oldest is not None:
+                        remaining = self.flush_interval - (time.perf_counter() - self._oldest)
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                if self._closed:
+                    return
+            self.flush()
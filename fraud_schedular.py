@@ -1,23 +1,164 @@
 # fraud_schedular.py
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from database import Database
-from ml_engine import FraudDetector
+from ml_engine import create_detector
+from archive import archive_cold_days, ACTIVITY_HOT_DAYS
+from dotenv import load_dotenv
+import math
+import os
 import time
 
-db = Database()
-fd = FraudDetector()
+load_dotenv()
 
-print("Scheduler running...")
+# Most employees per work unit (one batch query / one worker task); smaller
+# fleets are split so every worker gets a chunk
+CHUNK_SIZE = int(os.getenv("SCHEDULER_CHUNK_SIZE", 500))
+# Worker processes for the sweep; 0 runs everything in this process
+WORKERS = int(os.getenv("SCHEDULER_WORKERS", 0))
+SWEEP_INTERVAL_SECONDS = int(os.getenv("SCHEDULER_INTERVAL", 60))
+# How often to move activity older than ACTIVITY_HOT_DAYS out to the archive
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv("ARCHIVE_INTERVAL", 3600))
 
-while True:
-    conn = db.get_connection()
-    cur = conn.cursor(dictionary=True)
-    cur.execute("SELECT id FROM employees")
-    employees = cur.fetchall()
-    cur.close()
-    conn.close()
+# Per-process state for pool workers, created once by _init_worker
+_worker_db = None
+_worker_detector = None
 
-    for emp in employees:
-        fd.analyze_and_flag(db, emp["id"])
 
-    time.sleep(60)
- 
\ No newline at end of file
+def _init_worker():
+    """Gives each worker process its own Database and detector (and model cache, loaded from checkpoints)."""
+    global _worker_db, _worker_detector
+    _worker_db = Database()
+    _worker_detector = create_detector()
+    _worker_detector.preload()
+
+
+def _score_chunk(employee_ids):
+    """Worker task: scores one chunk and hands the alerts back to the parent."""
+    results, alerts = _worker_detector.score_batch(_worker_db, employee_ids)
+    return len(results), alerts
+
+
+def get_employee_ids(db):
+    with db.connection() as conn:
+        cur = conn.cursor(dictionary=True)
+        cur.execute("SELECT id FROM employees")
+        employees = cur.fetchall()
+        cur.close()
+    return [emp["id"] for emp in employees]
+
+
+def run_sweep(db, detector, executor=None, chunk_size=CHUNK_SIZE, workers=WORKERS):
+    """
+    Scores every employee once, in chunks, either in this process or spread
+    across the executor's workers. Alerts are gathered and written here in one
+    multi-row insert, including those of the chunks that succeeded when
+    others failed (a broken pool is re-raised after that, so the caller can
+    replace it). Returns timing stats for the sweep.
+    """
+    started = time.perf_counter()
+
+    employee_ids = get_employee_ids(db)
+    if executor is not None and workers > 0:
+        chunk_size = max(1, min(chunk_size, math.ceil(len(employee_ids) / workers)))
+    chunks = [employee_ids[i:i + chunk_size] for i in range(0, len(employee_ids), chunk_size)]
+
+    outcomes = []
+    failed = 0
+    broken = None
+    if executor is None:
+        for chunk in chunks:
+            try:
+                outcomes.append(_score_serial(db, detector, chunk))
+            except Exception as e:
+                failed += 1
+                print(f"Error scoring chunk of {len(chunk)} employees: {e}")
+    else:
+        futures = [(executor.submit(_score_chunk, chunk), chunk) for chunk in chunks]
+        for future, chunk in futures:
+            try:
+                outcomes.append(future.result())
+            except BrokenProcessPool as e:
+                # The rest of the pool's futures fail too; keep what finished
+                failed += 1
+                broken = e
+            except Exception as e:
+                failed += 1
+                print(f"Error scoring chunk of {len(chunk)} employees: {e}")
+
+    scored = sum(count for count, _ in outcomes)
+    alerts = [alert for _, chunk_alerts in outcomes for alert in chunk_alerts]
+    if alerts:
+        db.create_fraud_alerts(alerts)
+    if broken is not None:
+        raise broken
+
+    wall_time = time.perf_counter() - started
+
+    return {
+        "employees": len(employee_ids),
+        "scored": scored,
+        "alerts": len(alerts),
+        "chunks": len(chunks),
+        "failed_chunks": failed,
+        "wall_time": wall_time,
+        "throughput": len(employee_ids) / wall_time if wall_time > 0 else 0.0
+    }
+
+
+def _score_serial(db, detector, employee_ids):
+    results, alerts = detector.score_batch(db, employee_ids)
+    return len(results), alerts
+
+
+def _make_executor():
+    return ProcessPoolExecutor(max_workers=WORKERS, initializer=_init_worker) if WORKERS > 0 else None
+
+
+def main():
+    db = Database()
+    # Sweeps read tables and columns added by migrations; apply any that are pending
+    db.init_db()
+    detector = None
+    if WORKERS == 0:
+        detector = create_detector()
+        detector.preload()
+    executor = _make_executor()
+
+    print(f"Scheduler running... (workers={WORKERS or 'serial'}, chunk_size={CHUNK_SIZE})")
+
+    next_archive = 0
+    try:
+        while True:
+            if ACTIVITY_HOT_DAYS > 0 and time.time() >= next_archive:
+                next_archive = time.time() + ARCHIVE_INTERVAL_SECONDS
+                try:
+                    archived = archive_cold_days(db)
+                    if archived['rows']:
+                        print(f"Archived {archived['rows']} activity rows from {archived['days']} days")
+                except Exception as e:
+                    print(f"Error archiving activity logs: {e}")
+
+            try:
+                stats = run_sweep(db, detector, executor)
+                print(
+                    f"Sweep: {stats['employees']} employees ({stats['scored']} scored) in "
+                    f"{stats['wall_time']:.2f}s, {stats['throughput']:.1f} employees/s, "
+                    f"{stats['alerts']} alerts"
+                    + (f", {stats['failed_chunks']} of {stats['chunks']} chunks failed" if stats['failed_chunks'] else "")
+                )
+            except BrokenProcessPool as e:
+                # A worker died (e.g. OOM-killed); the pool is unusable, so start a new one
+                print(f"Worker pool broke during sweep, restarting it: {e}")
+                executor.shutdown(wait=False)
+                executor = _make_executor()
+            except Exception as e:
+                print(f"Error running sweep: {e}")
+            time.sleep(SWEEP_INTERVAL_SECONDS)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
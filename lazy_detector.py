@@ -0,0 +1,56 @@
+# lazy_detector.py
+import threading
+import time
+
+
+class LazyDetector:
+    """
+    Stands in for an ml_engine detector without importing ml_engine, so
+    pandas and scikit-learn stay out of the web process until they're needed.
+    The real detector is built on first use (any attribute access), or earlier
+    by warm_up(), e.g. from a background task once the server is up.
+    """
+
+    def __init__(self, engine=None):
+        self._engine = engine
+        self._detector = None
+        self._lock = threading.Lock()
+        self.load_seconds = None
+
+    @property
+    def loaded(self):
+        return self._detector is not None
+
+    def warm_up(self):
+        """
+        Imports the ML stack, builds the detector and loads its model
+        checkpoints; safe to call from any thread.
+        """
+        if self._detector is None:
+            with self._lock:
+                if self._detector is None:
+                    started = time.perf_counter()
+                    from ml_engine import create_detector
+                    detector = create_detector(self._engine)
+                    detector.preload()
+                    self._detector = detector
+                    self.load_seconds = time.perf_counter() - started
+        return self._detector
+
+    def forget(self, employee_id):
+        # Nothing is cached per employee until the detector exists
+        if self._detector is not None:
+            self._detector.forget(employee_id)
+
+    def activity_logged(self, employee_id, activity_id=None):
+        if self._detector is not None:
+            self._detector.activity_logged(employee_id, activity_id)
+
+    def stats(self):
+        """Detector stats once loaded, plus how long the ML stack took to load."""
+        stats = self._detector.stats() if self._detector is not None else {}
+        stats['loader'] = {'loaded': self.loaded, 'load_seconds': self.load_seconds}
+        return stats
+
+    def __getattr__(self, name):
+        return getattr(self.warm_up(), name)
@@ -0,0 +1,347 @@
+# migrations.py
+"""
+Versioned schema migrations, applied by Database.init_db.
+
+Each migration is (version, description, steps). Steps run in order and are
+idempotent (they check information_schema first), so a migration that was
+interrupted halfway can simply be re-run. Applied versions are recorded in
+the schema_version table; processes that migrate at the same time take
+turns on a MySQL named lock.
+
+    python migrations.py            # apply pending migrations; run this before starting
+                                    # the app when an upgrade backfills large tables
+    python migrations.py --explain  # show how the hot queries are executed; exits 1 on
+                                    # a full scan no index could avoid
+    python migrations.py --rebuild-rollups [HOURS]  # recompute activity rollups
+    python migrations.py --rebuild-totals [EMPLOYEE_ID]  # reconcile activity totals
+"""
+import sys
+from datetime import datetime, timedelta
+
+
+def add_index(table, name, columns):
+    """Step that creates an index unless one with that name already exists."""
+    def step(cur):
+        cur.execute("""
+            SELECT COUNT(*) FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        """, (table, name))
+        if cur.fetchone()[0] == 0:
+            cur.execute(f"CREATE INDEX {name} ON {table} ({columns})")
+    return step
+
+
+def add_column(table, name, definition):
+    """Step that adds a column unless the table already has it."""
+    def step(cur):
+        cur.execute("""
+            SELECT COUNT(*) FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        """, (table, name))
+        if cur.fetchone()[0] == 0:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+    return step
+
+
+def update_in_batches(table, sql, batch_size=5000):
+    """
+    Step that runs an UPDATE over the table batch_size ids at a time. sql
+    takes the first and last id of a batch (WHERE id BETWEEN %s AND %s), and
+    each batch is committed on its own so no one transaction locks the table.
+    """
+    def step(cur):
+        cur.execute(f"SELECT MIN(id), MAX(id) FROM {table}")
+        low, high = cur.fetchone()
+        if low is None:
+            return
+        for start in range(low, high + 1, batch_size):
+            cur.execute(sql, (start, start + batch_size - 1))
+            cur.execute("COMMIT")
+    return step
+
+
+def in_day_batches(table, sql):
+    """
+    Step that runs sql over the table one calendar day of timestamps at a
+    time. sql takes the start and end of a day (WHERE timestamp >= %s AND
+    timestamp < %s), and each day is committed on its own.
+    """
+    def step(cur):
+        cur.execute(f"SELECT MIN(timestamp), MAX(timestamp) FROM {table}")
+        oldest, newest = cur.fetchone()
+        if oldest is None:
+            return
+        day = datetime.combine(oldest.date(), datetime.min.time())
+        while day <= newest:
+            cur.execute(sql, (day, day + timedelta(days=1)))
+            cur.execute("COMMIT")
+            day += timedelta(days=1)
+    return step
+
+
+def execute(sql):
+    """Step that runs one statement, which must itself be safe to re-run."""
+    def step(cur):
+        cur.execute(sql)
+    return step
+
+
+MIGRATIONS = [
+    (1, "Indexes for the employee/time access paths", [
+        # Per-employee history, newest first (ML fetch, reports, summaries)
+        add_index("activity_logs", "idx_activity_employee_time", "employee_id, timestamp"),
+        # Time-window dashboards (today's productivity, hourly chart)
+        add_index("activity_logs", "idx_activity_time", "timestamp"),
+        # is_employee_active / update_logout_time: open sessions per employee
+        add_index("login_logs", "idx_login_employee_logout", "employee_id, logout_time"),
+        # Active employees in the last hour
+        add_index("login_logs", "idx_login_time", "login_time"),
+        # Latest alert per employee (risk scores), and alert feeds by time
+        add_index("fraud_alerts", "idx_alerts_employee_time", "employee_id, timestamp"),
+        add_index("fraud_alerts", "idx_alerts_time", "timestamp"),
+        # Critical alert counts
+        add_index("fraud_alerts", "idx_alerts_level", "alert_level"),
+    ]),
+    (2, "Latest risk per employee, maintained with each alert", [
+        execute("""
+            CREATE TABLE IF NOT EXISTS employee_risk (
+                employee_id INT PRIMARY KEY,
+                risk_score FLOAT,
+                alert_level VARCHAR(20),
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (employee_id) REFERENCES employees(id)
+            )
+        """),
+        # Backfill from alert history: each employee's newest alert
+        execute("""
+            INSERT INTO employee_risk (employee_id, risk_score, alert_level, updated_at)
+            SELECT employee_id, risk_score, alert_level, timestamp
+            FROM (
+                SELECT employee_id, risk_score, alert_level, timestamp,
+                       ROW_NUMBER() OVER (PARTITION BY employee_id ORDER BY timestamp DESC, id DESC) AS row_num
+                FROM fraud_alerts
+            ) ranked
+            WHERE row_num = 1
+            ON DUPLICATE KEY UPDATE
+                risk_score = VALUES(risk_score),
+                alert_level = VALUES(alert_level),
+                updated_at = VALUES(updated_at)
+        """),
+    ]),
+    (3, "Hourly activity rollups for the dashboard", [
+        execute("""
+            CREATE TABLE IF NOT EXISTS employee_activity_hourly (
+                employee_id INT,
+                bucket DATETIME,
+                log_count INT NOT NULL DEFAULT 0,
+                mouse_sum BIGINT NOT NULL DEFAULT 0,
+                keyboard_sum BIGINT NOT NULL DEFAULT 0,
+                idle_sum BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (employee_id, bucket),
+                FOREIGN KEY (employee_id) REFERENCES employees(id)
+            )
+        """),
+        # Backfill from raw history a day at a time, so each hour is summed in
+        # one batch; totals are overwritten, so re-running is safe
+        in_day_batches("activity_logs", """
+            INSERT INTO employee_activity_hourly (employee_id, bucket, log_count, mouse_sum, keyboard_sum, idle_sum)
+            SELECT employee_id, DATE(timestamp) + INTERVAL HOUR(timestamp) HOUR AS hour_bucket,
+                   COUNT(*), IFNULL(SUM(mouse_activity), 0), IFNULL(SUM(keyboard_activity), 0), IFNULL(SUM(idle_time), 0)
+            FROM activity_logs
+            WHERE timestamp >= %s AND timestamp < %s
+            GROUP BY employee_id, hour_bucket
+            ON DUPLICATE KEY UPDATE
+                log_count = VALUES(log_count),
+                mouse_sum = VALUES(mouse_sum),
+                keyboard_sum = VALUES(keyboard_sum),
+                idle_sum = VALUES(idle_sum)
+        """),
+        # Today's productivity and the hourly chart filter by bucket alone
+        add_index("employee_activity_hourly", "idx_employee_hourly_bucket", "bucket"),
+    ]),
+    (4, "Running activity totals per employee", [
+        execute("""
+            CREATE TABLE IF NOT EXISTS employee_activity_totals (
+                employee_id INT PRIMARY KEY,
+                log_count INT NOT NULL DEFAULT 0,
+                mouse_sum BIGINT NOT NULL DEFAULT 0,
+                keyboard_sum BIGINT NOT NULL DEFAULT 0,
+                idle_sum BIGINT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (employee_id) REFERENCES employees(id)
+            )
+        """),
+        # Backfill from the hourly rollups, which already cover all history
+        execute("""
+            INSERT INTO employee_activity_totals (employee_id, log_count, mouse_sum, keyboard_sum, idle_sum)
+            SELECT employee_id, SUM(log_count), SUM(mouse_sum), SUM(keyboard_sum), SUM(idle_sum)
+            FROM employee_activity_hourly
+            GROUP BY employee_id
+            ON DUPLICATE KEY UPDATE
+                log_count = VALUES(log_count),
+                mouse_sum = VALUES(mouse_sum),
+                keyboard_sum = VALUES(keyboard_sum),
+                idle_sum = VALUES(idle_sum)
+        """),
+    ]),
+    (5, "Login session of each activity sample", [
+        add_column("activity_logs", "login_id", "INT NULL"),
+        # Serves the backfill's latest-login-before lookup without a filesort
+        add_index("login_logs", "idx_login_employee_time", "employee_id, login_time"),
+        # Backfill: the employee's latest login at or before the sample. It runs
+        # at app startup, so ingest is only held up for one batch at a time
+        update_in_batches("activity_logs", """
+            UPDATE activity_logs a
+            SET a.login_id = (
+                SELECT l.id FROM login_logs l
+                WHERE l.employee_id = a.employee_id AND l.login_time <= a.timestamp
+                ORDER BY l.login_time DESC, l.id DESC
+                LIMIT 1
+            )
+            WHERE a.id BETWEEN %s AND %s AND a.login_id IS NULL
+        """),
+    ]),
+    (6, "Index for alert pages filtered by level", [
+        add_index("fraud_alerts", "idx_alerts_level_time", "alert_level, timestamp"),
+    ]),
+    (7, "Days of activity archived out of activity_logs", [
+        execute("""
+            CREATE TABLE IF NOT EXISTS activity_archive (
+                day DATE PRIMARY KEY,
+                row_count INT NOT NULL,
+                path VARCHAR(255),
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """),
+    ]),
+]
+
+
+# Named lock (GET_LOCK) held while migrating, and how long to wait for it in seconds
+MIGRATION_LOCK = "fraud_detection.schema_migrations"
+MIGRATION_LOCK_TIMEOUT = 300
+
+
+def current_version(cur):
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cur.fetchone()[0]
+
+
+def run_migrations(conn, migrations=MIGRATIONS, wait=True):
+    """
+    Applies every migration newer than the recorded schema version. Returns
+    the versions applied. With wait=False, returns [] straight away if
+    another process holds the migration lock, rather than queueing behind it.
+    """
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            description VARCHAR(255),
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # The app and the scheduler both migrate on startup; the scheduler waits for
+    # the other to finish, app workers (wait=False) start without it
+    cur.execute("SELECT GET_LOCK(%s, %s)", (MIGRATION_LOCK, MIGRATION_LOCK_TIMEOUT if wait else 0))
+    if cur.fetchone()[0] != 1:
+        cur.close()
+        if not wait:
+            print(f"Another process holds {MIGRATION_LOCK}; starting without waiting for its migrations")
+            return []
+        raise RuntimeError(f"Timed out waiting for lock {MIGRATION_LOCK} held by another migration")
+    # Start a fresh snapshot so versions applied while we waited are seen
+    conn.commit()
+
+    applied = []
+    try:
+        for version, description, steps in sorted(migrations, key=lambda migration: migration[0]):
+            if version <= current_version(cur):
+                continue
+            for step in steps:
+                step(cur)
+            cur.execute(
+                "INSERT IGNORE INTO schema_version (version, description) VALUES (%s, %s)",
+                (version, description)
+            )
+            conn.commit()
+            applied.append(version)
+            print(f"Applied schema migration {version}: {description}")
+    finally:
+        cur.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK,))
+        cur.fetchone()
+        cur.close()
+    return applied
+
+
+def explain_hot_queries(conn, queries=None):
+    """
+    Runs EXPLAIN on each hot query (database.HOT_QUERIES by default) and
+    returns {name: plan rows}. A row is flagged 'full_scan' when MySQL reads
+    the whole table because no index could serve the query at all. Scans the
+    optimizer merely prefers on small or empty tables are not flagged, nor are
+    tables the query is meant to read whole. Rows that read a materialized
+    subquery (<derivedN>) are left out; the tables behind it get rows of their own.
+    """
+    if queries is None:
+        from database import HOT_QUERIES
+        queries = HOT_QUERIES
+
+    cur = conn.cursor(dictionary=True)
+    plans = {}
+    for name, sql, params, scanned in queries:
+        cur.execute("EXPLAIN " + sql, params)
+        plans[name] = [
+            {
+                'table': row['table'],
+                'type': row['type'],
+                'key': row['key'],
+                'rows': row['rows'],
+                'full_scan': (row['type'] == 'ALL' and not row['possible_keys']
+                              and row['table'] not in scanned)
+            }
+            for row in cur.fetchall()
+            if not str(row['table']).startswith('<derived')
+        ]
+    cur.close()
+    return plans
+
+
+def main(argv):
+    from database import Database
+
+    db = Database()
+    if '--rebuild-rollups' in argv:
+        # Optional lookback in hours; the default rebuilds all history
+        hours = argv[argv.index('--rebuild-rollups') + 1:][:1]
+        since = datetime.now() - timedelta(hours=int(hours[0])) if hours else None
+        buckets = db.rebuild_activity_rollups(since)
+        print(f"Rebuilt {buckets} hourly activity buckets")
+        return 0
+
+    if '--rebuild-totals' in argv:
+        employee_id = argv[argv.index('--rebuild-totals') + 1:][:1]
+        db.rebuild_activity_totals(int(employee_id[0]) if employee_id else None)
+        print("Reconciled activity totals with activity_logs")
+        return 0
+
+    if '--explain' not in argv:
+        # Creates any missing tables, then runs run_migrations()
+        db.init_db()
+        return 0
+
+    with db.connection() as conn:
+        plans = explain_hot_queries(conn)
+
+    full_scans = 0
+    for name, rows in plans.items():
+        for row in rows:
+            full_scans += row['full_scan']
+            print(f"{name:22} {str(row['table']):14} type={str(row['type']):8} key={row['key']} rows={row['rows']}"
+                  + ("  FULL SCAN" if row['full_scan'] else ""))
+    return 1 if full_scans else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
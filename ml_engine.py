@@ -3,14 +3,1467 @@ import numpy as np
 import pandas as pd # type: ignore
 from sklearn.ensemble import IsolationForest # type: ignore
 from sklearn.preprocessing import StandardScaler # type: ignore
+from sklearn.base import clone # type: ignore
+import sklearn # type: ignore
+import joblib # type: ignore
+from abc import ABC, abstractmethod
+import functools
+import json
+import re
+import zlib
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta
+import os
+import threading
+import time
 
-class FraudDetector:
+# Column order of the matrix produced by FraudDetector.prepare_features
+FEATURE_NAMES = [
+    'idle_time',
+    'mouse_activity',
+    'keyboard_activity',
+    'hour',
+    'ip_hash',
+    'device_hash',
+    'idle_ratio',
+    'is_after_hours',
+    'total_activity',
+    'non_work_app_flag'
+]
+
+# Minimum number of rows needed to train the model effectively
+MIN_FIT_SAMPLES = 10
+
+# Bump when the checkpoint payload layout changes
+MODEL_FORMAT_VERSION = 3
+
+# Refit a model once new rows drift this far (population stability index of
+# the worst feature) from its training data, or once it's this old
+DRIFT_THRESHOLD = float(os.getenv('DRIFT_THRESHOLD', 0.5))
+MODEL_MAX_AGE_SECONDS = int(os.getenv('MODEL_MAX_AGE_SECONDS', 6 * 3600))
+
+
+def _average_path_length(n_samples):
+    """
+    Average path length of an unsuccessful BST search over n_samples, the
+    c(n) normalizer of Isolation Forest (same arithmetic as scikit-learn).
+    """
+    n_samples = np.asarray(n_samples, dtype=np.float64)
+    lengths = np.zeros(n_samples.shape)
+    lengths[n_samples == 2] = 1.0
+    deep = n_samples > 2
+    lengths[deep] = (
+        2.0 * (np.log(n_samples[deep] - 1.0) + np.euler_gamma)
+        - 2.0 * (n_samples[deep] - 1.0) / n_samples[deep]
+    )
+    return lengths
+
+
+class CompactForest:
+    """
+    A fitted StandardScaler + IsolationForest flattened into a few contiguous
+    arrays for inference.
+
+    All trees share one node table (split feature, threshold, children and,
+    for leaves, the path length sklearn would credit), and evaluate() walks
+    every tree for every row at once, level by level, returning both
+    score_samples() and predict() from a single traversal. Results match
+    scikit-learn's: inputs are scaled in float64 and compared as float32
+    like its trees do, with thresholds rounded down to float32 so no
+    comparison changes.
+    """
+    __slots__ = ('mean', 'scale', 'feature', 'threshold', 'missing_left', 'left', 'right',
+                 'leaf_depth', 'roots', 'levels', 'denominator', 'offset')
+
+    @classmethod
+    def from_fitted(cls, scaler, model):
+        """Exports a fitted (StandardScaler, IsolationForest) pair."""
+        n_features = model.n_features_in_
+        trees = [estimator.tree_ for estimator in model.estimators_]
+        sizes = np.array([tree.node_count for tree in trees])
+        starts = np.r_[0, np.cumsum(sizes)[:-1]]
+
+        feature, threshold, missing_left, left, right, leaf_depth = [], [], [], [], [], []
+        levels = 0
+        for tree, columns, start in zip(trees, model.estimators_features_, starts):
+            nodes = np.arange(start, start + tree.node_count)
+            is_leaf = tree.children_left == -1
+
+            # Leaves point at themselves, so extra levels leave them in place
+            left.append(np.where(is_leaf, nodes, tree.children_left + start))
+            right.append(np.where(is_leaf, nodes, tree.children_right + start))
+            feature.append(np.asarray(columns)[np.where(is_leaf, 0, tree.feature)])
+
+            split = tree.threshold.astype(np.float32)
+            rounded_up = split > tree.threshold
+            split[rounded_up] = np.nextafter(split[rounded_up], np.float32(-np.inf))
+            threshold.append(split)
+
+            missing = getattr(tree, 'missing_go_to_left', None)
+            missing_left.append(np.zeros(tree.node_count, dtype=bool) if missing is None else missing.astype(bool))
+
+            depths = tree.compute_node_depths()
+            leaf_depth.append(depths + _average_path_length(tree.n_node_samples) - 1.0)
+            levels = max(levels, int(depths.max()) - 1)
+
+        forest = cls()
+        forest.mean = np.zeros(n_features) if scaler.mean_ is None else np.asarray(scaler.mean_, dtype=np.float64)
+        forest.scale = np.ones(n_features) if scaler.scale_ is None else np.asarray(scaler.scale_, dtype=np.float64)
+        forest.feature = np.concatenate(feature).astype(np.int16 if n_features < 2 ** 15 else np.int32)
+        forest.threshold = np.concatenate(threshold)
+        forest.missing_left = np.concatenate(missing_left)
+        forest.left = np.concatenate(left).astype(np.int32)
+        forest.right = np.concatenate(right).astype(np.int32)
+        forest.leaf_depth = np.concatenate(leaf_depth)
+        forest.roots = starts.astype(np.int32)
+        forest.levels = levels
+        forest.denominator = float(len(trees) * _average_path_length(model.max_samples_))
+        forest.offset = float(model.offset_)
+        return forest
+
+    def evaluate(self, features):
+        """
+        Returns (score_samples, predictions) for a feature matrix, equal to
+        IsolationForest.score_samples/predict on the scaled features.
+        """
+        scaled = ((np.asarray(features, dtype=np.float64) - self.mean) / self.scale).astype(np.float32)
+        columns = scaled.T
+        rows = np.arange(len(scaled))
+        has_missing = np.isnan(scaled).any()
+
+        nodes = np.repeat(self.roots[:, None], len(scaled), axis=1)
+        for _ in range(self.levels):
+            values = columns[self.feature[nodes], rows]
+            go_left = values <= self.threshold[nodes]
+            if has_missing:
+                go_left |= np.isnan(values) & self.missing_left[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+
+        # Accumulate tree by tree, in sklearn's order, so sums match bit for bit
+        depths = np.cumsum(self.leaf_depth[nodes], axis=0)[-1]
+        if self.denominator != 0:
+            scores = -(2 ** -(depths / self.denominator))
+        else:
+            scores = -np.ones(len(scaled))
+
+        predictions = np.where(scores - self.offset < 0, -1, 1)
+        return scores, predictions
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in (
+            'mean', 'scale', 'feature', 'threshold', 'missing_left', 'left', 'right', 'leaf_depth', 'roots'
+        ))
+
+
+class DriftSketch:
+    """
+    Per-feature histograms of a model's training features.
+
+    Bin edges are the training quintiles of each feature; drift() bins newer
+    rows the same way and returns each feature's population stability index
+    (PSI) against the training distribution. Counts are smoothed (+0.5 per
+    bin) so a few dozen new rows give a usable PSI instead of blowing up on
+    empty bins. About 1 KB per model.
+    """
+    __slots__ = ('edges', 'expected')
+
+    BINS = 5
+    SMOOTHING = 0.5
+
+    @classmethod
+    def from_features(cls, features):
+        sketch = cls()
+        quantiles = np.linspace(0, 1, cls.BINS + 1)[1:-1]
+        sketch.edges = np.quantile(features, quantiles, axis=0).T # (features, BINS - 1)
+        sketch.expected = sketch._histogram(features)
+        return sketch
+
+    def drift(self, features):
+        """PSI per feature of the rows in features against the training rows."""
+        actual = self._histogram(features)
+        return ((actual - self.expected) * np.log(actual / self.expected)).sum(axis=1)
+
+    def _histogram(self, features):
+        n_features = self.edges.shape[0]
+        bins = (np.asarray(features)[:, :, None] > self.edges[None, :, :]).sum(axis=2)
+        counts = np.bincount(
+            (np.arange(n_features) * self.BINS + bins).ravel(), minlength=n_features * self.BINS
+        ).reshape(n_features, self.BINS)
+        return (counts + self.SMOOTHING) / (len(features) + self.SMOOTHING * self.BINS)
+
+
+class FittedModel:
+    """A fitted CompactForest plus the bookkeeping used to decide when to refit."""
+    __slots__ = ('forest', 'sketch', 'fitted_at', 'row_count', 'watermark', 'unlogged', 'refits', 'drift')
+
+    def __init__(self, forest, sketch, row_count, watermark, fitted_at=None, refits=0, unlogged=0):
+        self.forest = forest
+        self.sketch = sketch
+        # Wall-clock time so the age survives a checkpoint/reload
+        self.fitted_at = time.time() if fitted_at is None else fitted_at
+        self.row_count = row_count
+        self.watermark = watermark
+        # Rows without an id yet (queued by write-behind) that were newer than the watermark at fit time
+        self.unlogged = unlogged
+        # Times this employee's model has been refit, carried across refits
+        self.refits = refits
+        # Per-feature PSI from the latest drift check (None until one runs)
+        self.drift = None
+
+
+class ModelStore:
+    """
+    On-disk checkpoints of fitted models, one file per employee.
+
+    Checkpoints are written with joblib and loaded with mmap_mode='r', so
+    their arrays are memory-mapped rather than read into memory up front.
+    Each checkpoint carries a schema stamp. Checkpoints written with a
+    different feature layout, model configuration or categorical encoder
+    are ignored.
+    """
+    def __init__(self, model_dir, stamp):
+        self.model_dir = model_dir
+        self.stamp = stamp
+        os.makedirs(model_dir, exist_ok=True)
+
+        self.saves = 0
+        self.loads = 0
+        self.stale = 0
+
+    def save(self, key, entry):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        payload = {
+            'stamp': self.stamp,
+            'forest': entry.forest,
+            'sketch': entry.sketch,
+            'refits': entry.refits,
+            'fitted_at': entry.fitted_at,
+            'row_count': entry.row_count,
+            'watermark': entry.watermark,
+            'unlogged': entry.unlogged
+        }
+        try:
+            joblib.dump(payload, tmp_path)
+            # Atomic swap so concurrent readers never see a partial file
+            os.replace(tmp_path, path)
+            self.saves += 1
+        except OSError as e:
+            print(f"Error saving model checkpoint {path}: {e}")
+
+    def load(self, key):
+        """Returns the checkpointed FittedModel, or None if missing or stale."""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            payload = joblib.load(path, mmap_mode='r')
+        except Exception as e:
+            print(f"Error loading model checkpoint {path}: {e}")
+            return None
+
+        if payload.get('stamp') != self.stamp:
+            self.stale += 1
+            return None
+
+        self.loads += 1
+        return FittedModel(
+            payload['forest'],
+            payload['sketch'],
+            payload['row_count'],
+            payload['watermark'],
+            fitted_at=payload['fitted_at'],
+            refits=payload['refits'],
+            unlogged=payload.get('unlogged', 0)
+        )
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def keys(self):
+        """Employee ids that have a checkpoint on disk."""
+        keys = []
+        for name in os.listdir(self.model_dir):
+            if name.startswith('employee_') and name.endswith('.joblib'):
+                key = name[len('employee_'):-len('.joblib')]
+                keys.append(int(key) if key.isdigit() else key)
+        return keys
+
+    def stats(self):
+        return {
+            'model_dir': self.model_dir,
+            'saves': self.saves,
+            'loads': self.loads,
+            'stale': self.stale
+        }
+
+    def _path(self, key):
+        return os.path.join(self.model_dir, f"employee_{key}.joblib")
+
+
+class ModelRegistry:
+    """
+    Per-employee cache of fitted models.
+
+    A model is reused until the rows that arrived since it was fitted drift
+    from its training data (see DriftSketch) by drift_threshold, or until it
+    is older than max_age_seconds. Drift is only measured once at least
+    min_drift_rows new rows are available. The least recently used models are
+    evicted once more than max_models are held. With a ModelStore, misses are
+    served from disk checkpoints before falling back to a refit, and every
+    fit is checkpointed.
+    """
+    def __init__(self, max_models=1000, drift_threshold=DRIFT_THRESHOLD, min_drift_rows=30,
+                 max_age_seconds=MODEL_MAX_AGE_SECONDS, store=None):
+        self.max_models = max_models
+        self.drift_threshold = drift_threshold
+        self.min_drift_rows = min_drift_rows
+        self.max_age_seconds = max_age_seconds
+        self.store = store
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.refits = 0
+        self.drift_refits = 0
+        self.deadline_refits = 0
+        self.drift_checks = 0
+        self.evictions = 0
+        self.disk_hits = 0
+
+    def get(self, employee_id, features, fit_func, ids=None):
+        """
+        Returns a FittedModel for the employee, calling fit_func(features)
+        (which returns a CompactForest or None) only on a miss, on drift or
+        past the age deadline. Returns None if no model could be fitted.
+
+        features are the employee's recent feature rows, newest first; ids
+        are their activity log ids (negative for unknown).
+        """
+        ids = np.full(len(features), -1, dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+        known_ids = ids[ids >= 0]
+        watermark = int(known_ids.max()) if len(known_ids) else None
+        unlogged = self._rows_after(ids, watermark) if watermark is not None else 0
+        row_count = len(features)
+
+        with self._lock:
+            entry = self._entries.get(employee_id)
+            if entry is not None:
+                self._entries.move_to_end(employee_id)
+        from_disk = False
+        if entry is None and self.store is not None:
+            entry = self.store.load(employee_id)
+            from_disk = entry is not None
+
+        reason = None
+        if entry is not None:
+            reason = self._refit_reason(entry, features, ids)
+            if reason is None:
+                with self._lock:
+                    if from_disk:
+                        self.disk_hits += 1
+                        self._insert(employee_id, entry)
+                    else:
+                        self.hits += 1
+                return entry
+
+        # Fit outside the lock so one slow fit doesn't block other employees
+        fitted = fit_func(features)
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.refits += 1
+                if reason == 'drift':
+                    self.drift_refits += 1
+                else:
+                    self.deadline_refits += 1
+
+            if fitted is None:
+                # Keep serving the previous model rather than nothing
+                return entry
+
+            refits = 0 if entry is None else entry.refits + 1
+            new_entry = FittedModel(fitted, DriftSketch.from_features(features), row_count, watermark,
+                                    refits=refits, unlogged=unlogged)
+            if entry is not None:
+                # Keep reporting the drift that triggered the refit until the next check
+                new_entry.drift = entry.drift
+            self._insert(employee_id, new_entry)
+
+        if self.store is not None:
+            self.store.save(employee_id, new_entry)
+
+        return new_entry
+
+    def put(self, employee_id, entry):
+        """Stores an already fitted model, e.g. one fitted by another worker."""
+        with self._lock:
+            self._insert(employee_id, entry)
+
+    def preload(self, limit=None):
+        """
+        Loads checkpoints from the store into memory, without touching the
+        database. Returns the number of models loaded.
+        """
+        if self.store is None:
+            return 0
+
+        limit = self.max_models if limit is None else min(limit, self.max_models)
+        loaded = 0
+        for employee_id in self.store.keys():
+            if loaded >= limit:
+                break
+            entry = self.store.load(employee_id)
+            if entry is not None:
+                self.put(employee_id, entry)
+                loaded += 1
+        return loaded
+
+    def invalidate(self, employee_id):
+        """Drops the cached model for an employee (e.g. after deletion)."""
+        with self._lock:
+            self._entries.pop(employee_id, None)
+        if self.store is not None:
+            self.store.delete(employee_id)
+
+    def _insert(self, employee_id, entry):
+        # Caller holds the lock
+        self._entries[employee_id] = entry
+        self._entries.move_to_end(employee_id)
+        while len(self._entries) > self.max_models:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def drift_report(self, employee_id=None):
+        """
+        Per-employee drift and refit metrics for the models held in memory:
+        {employee_id: {'drift', 'feature_drift', 'refits', 'age_seconds'}}.
+        drift is the worst feature's PSI from the latest check.
+        """
+        now = time.time()
+        with self._lock:
+            if employee_id is None:
+                entries = list(self._entries.items())
+            else:
+                entries = [(employee_id, self._entries[employee_id])] if employee_id in self._entries else []
+
+        return {
+            key: {
+                'drift': None if entry.drift is None else round(float(entry.drift.max()), 4),
+                'feature_drift': None if entry.drift is None else [round(float(value), 4) for value in entry.drift],
+                'refits': entry.refits,
+                'age_seconds': round(now - entry.fitted_at, 1)
+            }
+            for key, entry in entries
+        }
+
+    def stats(self):
+        """Returns cache counters for monitoring."""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses + self.refits
+            stats = {
+                'size': len(self._entries),
+                'max_models': self.max_models,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'refits': self.refits,
+                'drift_refits': self.drift_refits,
+                'deadline_refits': self.deadline_refits,
+                'drift_checks': self.drift_checks,
+                'drift_threshold': self.drift_threshold,
+                'evictions': self.evictions,
+                'hit_rate': round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                'model_bytes': sum(entry.forest.nbytes for entry in self._entries.values())
+            }
+        if self.store is not None:
+            stats['store'] = self.store.stats()
+        return stats
+
+    def _refit_reason(self, entry, features, ids):
+        """'deadline', 'drift' or None if the model can still be used."""
+        if time.time() - entry.fitted_at > self.max_age_seconds:
+            return 'deadline'
+
+        new_rows = self._new_rows(entry, features, ids)
+        if len(new_rows) < self.min_drift_rows:
+            return None
+
+        entry.drift = entry.sketch.drift(new_rows)
+        with self._lock:
+            self.drift_checks += 1
+        return 'drift' if entry.drift.max() >= self.drift_threshold else None
+
+    @classmethod
+    def _new_rows(cls, entry, features, ids):
+        """
+        Feature rows logged after the model was fitted. Rows are newest first,
+        so these are the rows in front of the newest row the model saw.
+        That covers id-less rows too (samples still queued by write-behind),
+        less those that were already in front of it at fit time.
+        """
+        if entry.watermark is None or not (ids >= 0).any():
+            # No row ids available, fall back to growth in row count
+            return features[:max(0, len(features) - entry.row_count)]
+        return features[:max(0, cls._rows_after(ids, entry.watermark) - entry.unlogged)]
+
+    @staticmethod
+    def _rows_after(ids, watermark):
+        """Number of leading (newest) rows before the first row with a known id at or below watermark."""
+        seen = np.flatnonzero((ids >= 0) & (ids <= watermark))
+        return int(seen[0]) if len(seen) else len(ids)
+
+
+class CategoricalEncoder:
+    """
+    Deterministic encoding of categorical strings (IP address, device id) into
+    a fixed number of buckets.
+
+    Uses CRC32 of the UTF-8 bytes instead of Python's hash(), which is salted
+    per process. Every process (app, scheduler, pool workers) therefore builds
+    identical features for the same row, and fitted models can be shared
+    between them through the ModelStore.
+    """
+    def __init__(self, buckets=1000):
+        self.buckets = buckets
+
+    def encode(self, value):
+        return zlib.crc32(str(value).encode('utf-8')) % self.buckets
+
+    def describe(self):
+        return {'algorithm': 'crc32', 'buckets': self.buckets}
+
+
+# Window-title categories used for non_work_app_flag and the Distracting App
+# Use factor. Override at startup with a JSON file named by TITLE_CATEGORIES_FILE.
+DEFAULT_TITLE_CATEGORIES = {
+    'social': {
+        'weight': 1.0,
+        'keywords': ['social', 'facebook', 'twitter', 'instagram', 'tiktok', 'reddit', 'discord', 'telegram']
+    },
+    'streaming': {
+        'weight': 1.0,
+        'keywords': ['youtube', 'netflix', 'hulu', 'prime video', 'spotify']
+    },
+    'gaming': {
+        'weight': 1.0,
+        'keywords': ['game', 'steam']
+    }
+}
+
+
+class TitleClassifier:
+    """
+    Matches window titles against keyword categories with a single compiled
+    regex alternation. Results are memoized per normalized title in a bounded
+    LRU cache, since the same titles repeat constantly across the fleet.
+    """
+    def __init__(self, categories=None, cache_size=65536):
+        categories = DEFAULT_TITLE_CATEGORIES if categories is None else categories
+
+        self.weights = {}
+        self._keyword_category = {}
+        for name, spec in categories.items():
+            # A category may be a bare keyword list (weight 1.0)
+            if isinstance(spec, (list, tuple)):
+                spec = {'keywords': spec}
+            self.weights[name] = float(spec.get('weight', 1.0))
+            for keyword in spec['keywords']:
+                self._keyword_category[keyword.lower()] = name
+
+        # Longest first so overlapping keywords report the more specific one
+        self.keywords = sorted(self._keyword_category, key=len, reverse=True)
+        self._pattern = re.compile('|'.join(re.escape(k) for k in self.keywords)) if self.keywords else None
+
+        self.cache_size = cache_size
+        self._cached_match = functools.lru_cache(maxsize=cache_size)(self._match)
+
+    @classmethod
+    def from_file(cls, path, cache_size=65536):
+        """
+        Loads categories from JSON: either a plain keyword list, or
+        {category: {"weight": w, "keywords": [...]}}.
+        """
+        with open(path) as f:
+            config = json.load(f)
+        if isinstance(config, list):
+            config = {'distracting': {'weight': 1.0, 'keywords': config}}
+        return cls(config, cache_size=cache_size)
+
+    @staticmethod
+    def normalize(title):
+        return str(title).lower().strip()
+
+    def classify(self, title):
+        """Returns the sorted tuple of categories the title matches."""
+        return self._cached_match(self.normalize(title))[0]
+
+    def weight(self, title):
+        """Weight of the heaviest matching category, 0.0 if none match."""
+        return self._cached_match(self.normalize(title))[1]
+
+    def describe(self):
+        """Keywords and weights, used to stamp model checkpoints."""
+        return {
+            'keywords': sorted((k, self._keyword_category[k]) for k in self.keywords),
+            'weights': sorted(self.weights.items())
+        }
+
+    def stats(self):
+        info = self._cached_match.cache_info()
+        lookups = info.hits + info.misses
+        return {
+            'keywords': len(self.keywords),
+            'categories': len(self.weights),
+            'cache_size': info.currsize,
+            'cache_max': info.maxsize,
+            'hits': info.hits,
+            'misses': info.misses,
+            'hit_rate': round(info.hits / lookups, 4) if lookups else 0.0
+        }
+
+    def _match(self, normalized_title):
+        if self._pattern is None:
+            return (), 0.0
+        categories = tuple(sorted({
+            self._keyword_category[m.group(0)] for m in self._pattern.finditer(normalized_title)
+        }))
+        weight = max((self.weights[c] for c in categories), default=0.0)
+        return categories, weight
+
+
+def load_title_classifier():
+    """Builds the title classifier from TITLE_CATEGORIES_FILE, or the defaults."""
+    path = os.getenv('TITLE_CATEGORIES_FILE')
+    if path:
+        try:
+            return TitleClassifier.from_file(path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error loading title categories from {path}, using defaults: {e}")
+    return TitleClassifier()
+
+
+def activity_ids(activity_data):
+    """Activity log ids of the rows, in order, with -1 for rows without one."""
+    return np.array([
+        -1 if row.get('id') is None else row['id'] for row in activity_data
+    ], dtype=np.int64)
+
+
+def stack_activity(activity_by_employee):
+    """
+    Stacks {employee_id: activity_rows} into one DataFrame with an employee_id
+    column, keeping each employee's rows contiguous. Returns None if empty.
+    """
+    employee_ids = []
+    counts = []
+    chunks = []
+    for employee_id, rows in activity_by_employee.items():
+        if rows is None or len(rows) == 0:
+            continue
+        employee_ids.append(employee_id)
+        counts.append(len(rows))
+        chunks.append(rows)
+
+    if not chunks:
+        return None
+
+    if any(isinstance(rows, pd.DataFrame) for rows in chunks):
+        df = pd.concat([pd.DataFrame(rows) for rows in chunks], ignore_index=True)
+    else:
+        # One DataFrame over all rows is far cheaper than one per employee
+        df = pd.DataFrame([row for rows in chunks for row in rows])
+
+    df['employee_id'] = np.repeat(np.array(employee_ids, dtype=object), counts)
+    return df
+
+
+# Rule-based risk factors, evaluated in order by RiskRuleEngine. Each rule fires
+# when its metric exceeds threshold, and becomes high severity above high_above.
+# Rules are skipped when the columns they require are missing from the rows.
+# Override at startup with a JSON file named by RISK_RULES_FILE.
+DEFAULT_RISK_RULES = [
+    {
+        'type': 'Distracting App Use',
+        'requires': ['active_window_title'],
+        'metric': 'distracting_ratio',
+        'threshold': 0.3,
+        'severity': 'medium',
+        'high_above': 0.5,
+        'message': '{distracting_count} out of {row_count} recent logs show foreground use of non-work applications (e.g., social media, streaming).'
+    },
+    {
+        'type': 'High Idle Time',
+        'requires': ['idle_time'],
+        'metric': 'avg_idle',
+        'threshold': 45, # seconds
+        'severity': 'medium',
+        'high_above': 60,
+        'message': 'Average idle time of {avg_idle:.0f} seconds exceeds normal threshold (low physical input).'
+    },
+    {
+        'type': 'After Hours Activity',
+        'requires': ['hour'],
+        'metric': 'after_hours_ratio',
+        'threshold': 0.3,
+        'severity': 'medium',
+        'message': 'Significant activity detected outside normal business hours (8AM-6PM).'
+    },
+    {
+        'type': 'IP Mismatch',
+        'requires': ['ip_address'],
+        'metric': 'unique_ips',
+        'threshold': 3,
+        'severity': 'high',
+        'message': 'Multiple IP addresses ({unique_ips}) detected in recent sessions, indicating a change in working location.'
+    },
+    {
+        'type': 'Device Anomaly',
+        'requires': ['device_id'],
+        'metric': 'unique_devices',
+        'threshold': 2,
+        'severity': 'medium',
+        'message': 'Multiple devices ({unique_devices}) used in recent sessions.'
+    },
+    {
+        # High variance relative to the mean indicates spiky, irregular input
+        'type': 'Pattern Deviation',
+        'requires': ['mouse_activity', 'keyboard_activity'],
+        'metric': 'activity_cv',
+        'threshold': 1.5,
+        'severity': 'medium',
+        'message': 'Irregular activity patterns detected (high variance in mouse/keyboard inputs).'
+    }
+]
+
+
+class RiskRuleEngine:
+    """
+    Evaluates the risk rules over activity rows in one vectorized pass.
+
+    All metrics the rules can reference are computed once per employee
+    group with bincount-style aggregations, and each rule is then a single
+    comparison over the per-group metric array. Adding a rule on an existing
+    metric costs one comparison, not another pass over the data.
+    """
+    # Columns each metric is derived from
+    METRIC_COLUMNS = {
+        'row_count': [],
+        'distracting_count': ['active_window_title'],
+        'distracting_ratio': ['active_window_title'],
+        'avg_idle': ['idle_time'],
+        'after_hours_count': ['hour'],
+        'after_hours_ratio': ['hour'],
+        'unique_ips': ['ip_address'],
+        'unique_devices': ['device_id'],
+        'activity_mean': ['mouse_activity', 'keyboard_activity'],
+        'activity_std': ['mouse_activity', 'keyboard_activity'],
+        'activity_cv': ['mouse_activity', 'keyboard_activity']
+    }
+
+    def __init__(self, rules=None, title_classifier=None):
+        self.rules = DEFAULT_RISK_RULES if rules is None else rules
+        self.title_classifier = title_classifier or TitleClassifier()
+
+        for rule in self.rules:
+            if rule['metric'] not in self.METRIC_COLUMNS:
+                raise ValueError(f"Risk rule '{rule['type']}' uses unknown metric '{rule['metric']}'")
+
+    def evaluate(self, activity_data):
+        """Returns the list of risk factors for one employee's activity rows."""
+        if activity_data is None or len(activity_data) == 0:
+            return []
+
+        columns = self._as_columns(activity_data)
+        return self._evaluate(columns, np.zeros(len(activity_data), dtype=np.intp), 1)[0]
+
+    def evaluate_grouped(self, activity_by_employee):
+        """
+        Evaluates many employees at once. Takes {employee_id: rows} (or a
+        DataFrame with an employee_id column) and returns {employee_id: factors}.
+        """
+        df = activity_by_employee if isinstance(activity_by_employee, pd.DataFrame) else stack_activity(activity_by_employee)
+        if df is None or len(df) == 0:
+            return {}
+
+        codes, employee_ids = pd.factorize(df['employee_id'])
+        factors = self._evaluate(self._as_columns(df), codes, len(employee_ids))
+        return dict(zip(employee_ids, factors))
+
+    def compute_metrics(self, columns, groups, n_groups):
+        """
+        Per-group metric arrays for every metric whose columns are present.
+        columns maps column names to equal-length arrays (see _as_columns).
+        """
+        metrics = {}
+        row_count = np.bincount(groups, minlength=n_groups).astype(float)
+        metrics['row_count'] = row_count.astype(int)
+
+        if 'active_window_title' in columns:
+            weights = self._map_distinct(columns['active_window_title'], self.title_classifier.weight)
+            distracting = np.bincount(groups, weights=(weights > 0), minlength=n_groups)
+            metrics['distracting_count'] = distracting.astype(int)
+            metrics['distracting_ratio'] = distracting / row_count
+
+        if 'idle_time' in columns:
+            metrics['avg_idle'] = self._group_mean(self._float_column(columns['idle_time']), groups, n_groups)
+
+        if 'hour' in columns:
+            hour = self._float_column(columns['hour'])
+            after_hours = np.bincount(groups, weights=((hour < 8) | (hour > 18)), minlength=n_groups)
+            metrics['after_hours_count'] = after_hours.astype(int)
+            metrics['after_hours_ratio'] = after_hours / row_count
+
+        if 'ip_address' in columns:
+            metrics['unique_ips'] = self._group_nunique(columns['ip_address'], groups, n_groups)
+
+        if 'device_id' in columns:
+            metrics['unique_devices'] = self._group_nunique(columns['device_id'], groups, n_groups)
+
+        if 'mouse_activity' in columns and 'keyboard_activity' in columns:
+            total_activity = self._float_column(columns['mouse_activity']) + self._float_column(columns['keyboard_activity'])
+            mean = self._group_mean(total_activity, groups, n_groups)
+            std = self._group_std(total_activity, mean, groups, n_groups)
+            metrics['activity_mean'] = mean
+            metrics['activity_std'] = std
+            with np.errstate(divide='ignore', invalid='ignore'):
+                metrics['activity_cv'] = np.where(mean > 0, std / mean, np.nan)
+
+        return metrics
+
+    def _evaluate(self, columns, groups, n_groups):
+        metrics = self.compute_metrics(columns, groups, n_groups)
+        factors = [[] for _ in range(n_groups)]
+
+        for rule in self.rules:
+            values = metrics.get(rule['metric'])
+            if values is None or any(column not in columns for column in rule.get('requires', [])):
+                continue
+
+            # NaN metrics (e.g. no valid rows) compare False and never fire
+            with np.errstate(invalid='ignore'):
+                fired = np.flatnonzero(values > rule['threshold'])
+                high = values > rule['high_above'] if 'high_above' in rule else None
+
+            for group in fired:
+                context = {name: metric[group] for name, metric in metrics.items()}
+                factors[group].append({
+                    'type': rule['type'],
+                    'severity': 'high' if high is not None and high[group] else rule['severity'],
+                    'description': rule['message'].format(**context)
+                })
+
+        return factors
+
+    @staticmethod
+    def _as_columns(activity_data):
+        """
+        Column name -> array view of the rows. Lists of dicts are transposed
+        directly, which is much cheaper than building a DataFrame for the
+        handful of rows scored per event. Keys missing from a row read as None.
+        """
+        if isinstance(activity_data, pd.DataFrame):
+            return {name: activity_data[name].to_numpy() for name in activity_data.columns}
+
+        names = dict.fromkeys(key for row in activity_data for key in row)
+        columns = {}
+        for name in names:
+            column = np.empty(len(activity_data), dtype=object)
+            column[:] = [row.get(name) for row in activity_data]
+            columns[name] = column
+        return columns
+
+    @staticmethod
+    def _float_column(column):
+        """Float array with None/NaN as NaN, like a numeric pandas column."""
+        if column.dtype != object:
+            return column.astype(float)
+        return np.array([np.nan if value is None else value for value in column], dtype=float)
+
+    @staticmethod
+    def _map_distinct(column, func):
+        codes, uniques = pd.factorize(np.asarray(column, dtype=object), use_na_sentinel=False)
+        return np.array([func(str(value)) for value in uniques], dtype=float)[codes]
+
+    @staticmethod
+    def _group_mean(values, groups, n_groups):
+        """Per-group mean ignoring NaN, like pandas .mean()."""
+        valid = ~np.isnan(values)
+        sums = np.bincount(groups[valid], weights=values[valid], minlength=n_groups)
+        counts = np.bincount(groups[valid], minlength=n_groups)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return sums / counts
+
+    @staticmethod
+    def _group_std(values, mean, groups, n_groups):
+        """Per-group sample standard deviation (ddof=1) ignoring NaN, like pandas .std()."""
+        valid = ~np.isnan(values)
+        deviations = (values[valid] - mean[groups[valid]]) ** 2
+        sums = np.bincount(groups[valid], weights=deviations, minlength=n_groups)
+        counts = np.bincount(groups[valid], minlength=n_groups)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.sqrt(sums / (counts - 1))
+
+    @staticmethod
+    def _group_nunique(column, groups, n_groups):
+        """Distinct non-null values per group, like pandas .nunique()."""
+        codes, uniques = pd.factorize(np.asarray(column, dtype=object))
+        valid = codes >= 0
+        if len(uniques) == 0:
+            return np.zeros(n_groups, dtype=int)
+        pairs = np.unique(groups[valid].astype(np.int64) * len(uniques) + codes[valid])
+        return np.bincount(pairs // len(uniques), minlength=n_groups)
+
+
+def load_risk_rules():
+    """Returns the risk rules from RISK_RULES_FILE (a JSON list), or the defaults."""
+    path = os.getenv('RISK_RULES_FILE')
+    if path:
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error loading risk rules from {path}, using defaults: {e}")
+    return DEFAULT_RISK_RULES
+
+
+def complete_sample(sample, ip_address=None, device_id=None):
+    """
+    Completes an ingest sample with the fields the agent doesn't send: the
+    hour (from its timestamp, else now) and, for a sample recorded outside
+    any login session, the IP/device last seen for this employee. Samples
+    with a session keep the IP/device of that login. Returns a new dict.
+    """
+    sample = dict(sample)
+
+    if sample.get('hour') is None:
+        timestamp = sample.get('timestamp')
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp)
+        sample['hour'] = (timestamp or datetime.now()).hour
+
+    if sample.get('login_id') is None:
+        if sample.get('ip_address') is None:
+            sample['ip_address'] = ip_address
+        if sample.get('device_id') is None:
+            sample['device_id'] = device_id
+
+    return sample
+
+
+class FeatureWindow:
+    """Newest-first snapshot of one employee's buffered feature rows."""
+    __slots__ = ('features', 'ids', 'recent_rows')
+
+    def __init__(self, features, ids, recent_rows):
+        self.features = features
+        self.ids = ids
+        self.recent_rows = recent_rows
+
+    def __len__(self):
+        return len(self.features)
+
+
+class FeatureBuffer:
+    """
+    Fixed-size ring buffer of one employee's feature rows, with running
+    aggregates that are updated as rows enter and leave the window.
+    """
+    IDLE = FEATURE_NAMES.index('idle_time')
+    IP = FEATURE_NAMES.index('ip_hash')
+    DEVICE = FEATURE_NAMES.index('device_hash')
+    ACTIVITY = FEATURE_NAMES.index('total_activity')
+
+    def __init__(self, capacity, recent_size):
+        self.capacity = capacity
+        self.features = np.zeros((capacity, len(FEATURE_NAMES)))
+        self.ids = np.full(capacity, -1, dtype=np.int64)
+        self.size = 0
+        self.head = 0 # next slot to write
+
+        self.idle_sum = 0.0
+        self.activity_sum = 0.0
+        self.activity_sq_sum = 0.0
+        self.ip_counts = {}
+        self.device_counts = {}
+
+        # Raw rows, only kept for the rule-based risk factors
+        self.recent = deque(maxlen=recent_size)
+        self.ip_address = None
+        self.device_id = None
+        self.seeded_at = time.time()
+
+    def append(self, feature_row, row_id, raw_row):
+        if self.size == self.capacity:
+            self._account(self.features[self.head], -1)
+        else:
+            self.size += 1
+
+        self.features[self.head] = feature_row
+        self.ids[self.head] = -1 if row_id is None else row_id
+        self._account(feature_row, 1)
+        self.head = (self.head + 1) % self.capacity
+
+        self.recent.appendleft(raw_row)
+        self.ip_address = raw_row.get('ip_address')
+        self.device_id = raw_row.get('device_id')
+
+    def window(self):
+        order = (self.head - 1 - np.arange(self.size)) % self.capacity
+        return FeatureWindow(self.features[order], self.ids[order], list(self.recent))
+
+    def aggregates(self):
+        n = self.size
+        variance = 0.0
+        if n > 1:
+            variance = max(0.0, (self.activity_sq_sum - self.activity_sum ** 2 / n) / (n - 1))
+        return {
+            'rows': n,
+            'mean_idle': float(self.idle_sum / n) if n else 0.0,
+            'mean_activity': float(self.activity_sum / n) if n else 0.0,
+            'activity_variance': float(variance),
+            'distinct_ips': len(self.ip_counts),
+            'distinct_devices': len(self.device_counts)
+        }
+
+    def _account(self, feature_row, sign):
+        self.idle_sum += sign * feature_row[self.IDLE]
+        activity = feature_row[self.ACTIVITY]
+        self.activity_sum += sign * activity
+        self.activity_sq_sum += sign * activity * activity
+        self._count(self.ip_counts, feature_row[self.IP], sign)
+        self._count(self.device_counts, feature_row[self.DEVICE], sign)
+
+    @staticmethod
+    def _count(counts, key, sign):
+        remaining = counts.get(key, 0) + sign
+        if remaining > 0:
+            counts[key] = remaining
+        else:
+            counts.pop(key, None)
+
+
+class FeatureStore:
+    """
+    In-memory rolling feature store: a FeatureBuffer of the last `capacity`
+    feature rows per employee, updated incrementally as activity is ingested.
+
+    Employees are seeded from the database only on a miss, or once their
+    buffer is older than max_age_seconds (a safety net for rows written by
+    other processes). Least recently used employees are evicted past
+    max_employees.
+    """
+    def __init__(self, capacity=100, recent_size=10, max_employees=5000, max_age_seconds=300):
+        self.capacity = capacity
+        self.recent_size = recent_size
+        self.max_employees = max_employees
+        self.max_age_seconds = max_age_seconds
+
+        self._buffers = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.seeds = 0
+        self.evictions = 0
+
+    def get(self, employee_id):
+        """Returns the employee's live FeatureBuffer, or None on a miss or if it's expired."""
+        with self._lock:
+            buffer = self._buffers.get(employee_id)
+            if buffer is None or time.time() - buffer.seeded_at > self.max_age_seconds:
+                return None
+            self._buffers.move_to_end(employee_id)
+            return buffer
+
+    def append(self, employee_id, feature_row, raw_row):
+        """Adds one ingested row. Returns False if the employee isn't buffered."""
+        with self._lock:
+            buffer = self._buffers.get(employee_id)
+            if buffer is None:
+                return False
+            buffer.append(feature_row, raw_row.get('id'), raw_row)
+            self._buffers.move_to_end(employee_id)
+            self.hits += 1
+            return True
+
+    def seed(self, employee_id, rows, features):
+        """Replaces the employee's buffer with rows (newest first) and their feature matrix."""
+        buffer = FeatureBuffer(self.capacity, self.recent_size)
+        for index in range(min(len(rows), self.capacity) - 1, -1, -1):
+            buffer.append(features[index], rows[index].get('id'), rows[index])
+
+        with self._lock:
+            self._buffers[employee_id] = buffer
+            self._buffers.move_to_end(employee_id)
+            self.seeds += 1
+            while len(self._buffers) > self.max_employees:
+                self._buffers.popitem(last=False)
+                self.evictions += 1
+        return buffer
+
+    def aggregates(self, employee_id):
+        """Running aggregates over the buffered window, or None if not buffered."""
+        with self._lock:
+            buffer = self._buffers.get(employee_id)
+            return buffer.aggregates() if buffer is not None else None
+
+    def forget(self, employee_id):
+        with self._lock:
+            self._buffers.pop(employee_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'employees': len(self._buffers),
+                'max_employees': self.max_employees,
+                'capacity': self.capacity,
+                'appends': self.hits,
+                'seeds': self.seeds,
+                'evictions': self.evictions
+            }
+
+
+class RiskScoreCache:
+    """
+    Last risk summary per employee, tagged with the newest activity log id it
+    was computed from. A new activity row for the employee drops the entry;
+    entries also expire after ttl_seconds (for rows written by other
+    processes) and the least recently used are evicted past max_entries.
+    """
+    def __init__(self, max_entries=10000, ttl_seconds=60):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._entries = OrderedDict() # employee_id -> (activity_id, stored_at, summary)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def get(self, employee_id):
+        """Returns a copy of the cached summary, or None on a miss or if it's expired."""
+        with self._lock:
+            entry = self._entries.get(employee_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            if time.time() - entry[1] > self.ttl_seconds:
+                del self._entries[employee_id]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(employee_id)
+            self.hits += 1
+            return dict(entry[2])
+
+    def put(self, employee_id, activity_id, summary):
+        with self._lock:
+            self._entries[employee_id] = (activity_id, time.time(), dict(summary))
+            self._entries.move_to_end(employee_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def activity_logged(self, employee_id, activity_id=None):
+        """Drops the entry unless it already covers activity_id."""
+        with self._lock:
+            entry = self._entries.get(employee_id)
+            if entry is None:
+                return
+            cached_id = entry[0]
+            if activity_id is not None and cached_id is not None and activity_id <= cached_id:
+                return
+            del self._entries[employee_id]
+            self.invalidations += 1
+
+    def invalidate(self, employee_id):
+        with self._lock:
+            self._entries.pop(employee_id, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'expirations': self.expirations,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+class AnomalyDetector(ABC):
+    """
+    Common interface for the fraud detection engines.
+
+    Subclasses implement analyze_and_flag() and get_risk_score(); feature
+    building, rule-based risk factors and alert creation are shared.
+    """
+    def __init__(self, title_classifier=None, rule_engine=None, encoder=None):
+        self.encoder = encoder or CategoricalEncoder()
+        self.title_classifier = title_classifier or load_title_classifier()
+        self.rule_engine = rule_engine or RiskRuleEngine(load_risk_rules(), self.title_classifier)
+
+    def prepare_features(self, activity_data):
+        """
+        Transforms raw activity log dictionaries into a structured NumPy array 
+        of numerical features for the ML model.
+        
+        Includes new feature: non_work_app_flag based on window title.
+        """
+        if activity_data is None or len(activity_data) == 0:
+            return None
+
+        return self.build_feature_matrix(activity_data)
+
+    def build_feature_matrix(self, activity_data):
+        """
+        Columnar feature builder. Computes every feature as a whole-array
+        operation instead of walking the rows one at a time.
+
+        Accepts a list of activity dicts or a DataFrame. Categorical columns
+        (IP, device, window title) are only evaluated once per distinct value.
+        """
+        df = activity_data if isinstance(activity_data, pd.DataFrame) else pd.DataFrame(activity_data)
+        n = len(df)
+
+        idle_time = self._numeric_column(df, 'idle_time', 0, n)
+        mouse_activity = self._numeric_column(df, 'mouse_activity', 0, n)
+        keyboard_activity = self._numeric_column(df, 'keyboard_activity', 0, n)
+        hour = self._numeric_column(df, 'hour', 12, n)
+
+        ip_hash = self._map_distinct(df, 'ip_address', n, self._hash_value)
+        device_hash = self._map_distinct(df, 'device_id', n, self._hash_value)
+        non_work_app_flag = self._map_distinct(df, 'active_window_title', n, self._is_distracting)
+
+        total_activity = mouse_activity + keyboard_activity
+        idle_ratio = idle_time / (idle_time + total_activity + 1)
+        is_after_hours = ((hour < 8) | (hour > 18)).astype(float)
+
+        return np.column_stack([
+            idle_time,
+            mouse_activity,
+            keyboard_activity,
+            hour,
+            ip_hash,
+            device_hash,
+            idle_ratio,
+            is_after_hours,
+            total_activity,
+            non_work_app_flag
+        ])
+
+    def prepare_features_batch(self, activity_by_employee):
+        """
+        Builds one stacked feature matrix for many employees at once.
+
+        Takes a dict of {employee_id: activity_rows} and returns a tuple of
+        (features, employee_ids) where employee_ids[i] owns features[i].
+        """
+        df = stack_activity(activity_by_employee)
+
+        if df is None:
+            return np.empty((0, len(FEATURE_NAMES))), np.empty(0, dtype=object)
+
+        return self.build_feature_matrix(df), df['employee_id'].to_numpy()
+
+    @staticmethod
+    def _numeric_column(df, name, default, n):
+        """Returns a float column with NULL/NaN read as default, or a constant column if it is missing."""
+        if name not in df.columns:
+            return np.full(n, float(default))
+        values = df[name].to_numpy(dtype=float)
+        return np.where(np.isnan(values), float(default), values)
+
+    @staticmethod
+    def _map_distinct(df, name, n, func):
+        """Applies func to each distinct string value of a column and broadcasts back."""
+        if name not in df.columns:
+            return np.full(n, float(func('')))
+        codes, uniques = pd.factorize(df[name].to_numpy(dtype=object), use_na_sentinel=False)
+        mapped = np.array([func(AnomalyDetector._category_text(value)) for value in uniques], dtype=float)
+        return mapped[codes]
+
+    @staticmethod
+    def _category_text(value):
+        """String form of a categorical value; NULL/NaN and missing all read as ''."""
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            return ''
+        return str(value)
+
+    def build_feature_row(self, sample):
+        """
+        Builds the feature vector for a single activity dict without going
+        through a DataFrame. Matches one row of build_feature_matrix.
+        """
+        idle_time = self._as_float(sample.get('idle_time'), 0)
+        mouse_activity = self._as_float(sample.get('mouse_activity'), 0)
+        keyboard_activity = self._as_float(sample.get('keyboard_activity'), 0)
+        hour = self._as_float(sample.get('hour'), 12)
+
+        total_activity = mouse_activity + keyboard_activity
+
+        return np.array([
+            idle_time,
+            mouse_activity,
+            keyboard_activity,
+            hour,
+            self._hash_value(self._category_text(sample.get('ip_address'))),
+            self._hash_value(self._category_text(sample.get('device_id'))),
+            idle_time / (idle_time + total_activity + 1),
+            1.0 if hour < 8 or hour > 18 else 0.0,
+            total_activity,
+            self._is_distracting(self._category_text(sample.get('active_window_title')))
+        ])
+
+    @staticmethod
+    def _as_float(value, default):
+        if value is None:
+            return float(default)
+        value = float(value)
+        return float(default) if np.isnan(value) else value
+
+    def _hash_value(self, value):
+        """Encodes a categorical string value (IP, device) as a number."""
+        return self.encoder.encode(value)
+
+    def _is_distracting(self, title):
+        """Category weight of the window title (1 for a default distracting app), else 0."""
+        return self.title_classifier.weight(title)
+
+    @abstractmethod
+    def analyze_and_flag(self, db, employee_id, sample=None):
+        """
+        Scores the employee's recent activity and creates a fraud alert if a
+        high-risk anomaly is detected. sample is the activity row that was
+        just logged, if the caller has it.
+        """
+
+    @abstractmethod
+    def get_risk_score(self, db, employee_id):
+        """Returns the current risk score and factors without creating an alert."""
+
+    def preload(self):
+        """Loads checkpointed per-employee state ahead of first use. Returns the number of entries loaded."""
+        return 0
+
+    def forget(self, employee_id):
+        """Drops any per-employee state (e.g. after the employee is deleted)."""
+
+    def activity_logged(self, employee_id, activity_id=None):
+        """Notifies the engine that a new activity row was written for the employee."""
+
+    def drift_report(self, employee_id=None):
+        """Per-employee model drift and refit metrics; empty for engines without fitted models."""
+        return {}
+
+    def stats(self):
+        """Returns engine counters for monitoring."""
+        return {
+            'title_classifier': self.title_classifier.stats()
+        }
+
+    @staticmethod
+    def _alert_level(risk_score):
+        if risk_score >= 80:
+            return 'High'
+        elif risk_score >= 50:
+            return 'Medium'
+        return 'Low'
+
+    def analyze_batch(self, db, employee_ids=None):
+        """
+        Analyzes many employees in one sweep, writes the resulting alerts in one
+        multi-row insert and returns {employee_id: summary}.
+        """
+        results, alerts = self.score_batch(db, employee_ids)
+        if alerts:
+            db.create_fraud_alerts(alerts)
+        return results
+
+    def score_batch(self, db, employee_ids=None):
+        """
+        Scores many employees without writing alerts. Returns (results, alerts)
+        where alerts are rows for Database.create_fraud_alerts.
+
+        Engines without a batch path fall back to analyze_and_flag, which
+        writes its own alerts, so no alert rows are returned.
+        """
+        if employee_ids is None:
+            employee_ids = [emp['id'] for emp in db.get_all_employees()]
+        results = {employee_id: self.analyze_and_flag(db, employee_id) for employee_id in employee_ids}
+        return {k: v for k, v in results.items() if v is not None}, []
+
+    def _build_alert(self, employee_id, result, factors):
+        """Returns an (employee_id, risk, level, description) alert row for a high-risk anomaly, else None."""
+        risk_score = result['anomaly_score']
+
+        if result['is_anomaly'] and risk_score > 60:
+            description = self._generate_alert_description(factors)
+            return (employee_id, risk_score, self._alert_level(risk_score), description)
+        return None
+
+    def _flag_if_anomalous(self, db, employee_id, result, factors):
+        """Creates a fraud alert for a high-risk anomaly and returns the analysis summary."""
+        alert = self._build_alert(employee_id, result, factors)
+        if alert:
+            db.create_fraud_alert(*alert)
+
+        return self._summary(result, factors)
+
+    def _summary(self, result, factors):
+        risk_score = result['anomaly_score']
+        return {
+            'risk_score': risk_score,
+            'alert_level': self._alert_level(risk_score),
+            'factors': factors
+        }
+
+    def _identify_risk_factors(self, activity_data):
+        """
+        Checks for specific, rule-based risk factors in the recent activity logs.
+        """
+        return self.rule_engine.evaluate(activity_data)
+
+    def _generate_alert_description(self, factors):
+        """Generates a concise alert summary based on the highest severity factor."""
+        if not factors:
+            return 'Anomalous behavior detected by ML model'
+
+        high_severity = [f for f in factors if f['severity'] == 'high']
+
+        if high_severity:
+            return high_severity[0]['description']
+        return factors[0]['description']
+
+
+class FraudDetector(AnomalyDetector):
     """
     Analyzes employee activity logs using Isolation Forest to detect anomalies
     and potential fraud/slacking behavior.
     """
-    def __init__(self):
+    def __init__(self, model_dir=None, title_classifier=None):
+        super().__init__(title_classifier)
         self.model = IsolationForest(
             n_estimators=100,
             contamination=0.1, 
@@ -18,72 +1471,32 @@ class FraudDetector:
             max_samples='auto'
         )
         self.scaler = StandardScaler()
+        self.forest = None
         self.is_fitted = False
-   
-        self.distracting_keywords = [
-            'youtube', 'reddit', 'netflix', 'game', 'social', 
-            'facebook', 'twitter', 'instagram', 'discord', 'steam', 
-            'tiktok', 'hulu', 'prime video', 'spotify', 'telegram'
-        ]
 
-    def prepare_features(self, activity_data):
-        """
-        Transforms raw activity log dictionaries into a structured NumPy array 
-        of numerical features for the ML model.
-        
-        Includes new feature: non_work_app_flag based on window title.
-        """
-        if not activity_data:
-            return None
+        # Fitted models per employee, reused across analyze_and_flag/get_risk_score calls.
+        # Checkpointed to MODEL_DIR (set it empty to disable) so restarts start warm.
+        model_dir = os.getenv('MODEL_DIR', 'models') if model_dir is None else model_dir
+        store = ModelStore(model_dir, self.schema_stamp()) if model_dir else None
+        self.models = ModelRegistry(store=store)
 
-        df = pd.DataFrame(activity_data)
-
-        features = []
-        for _, row in df.iterrows():
-            idle_time = float(row.get('idle_time', 0))
-            mouse_activity = float(row.get('mouse_activity', 0))
-            keyboard_activity = float(row.get('keyboard_activity', 0))
-            hour = float(row.get('hour', 12))
-          
-            active_window_title = str(row.get('active_window_title', '')).lower()
-
-            ip_hash = hash(str(row.get('ip_address', ''))) % 1000
-            device_hash = hash(str(row.get('device_id', ''))) % 1000
-
-            total_activity = mouse_activity + keyboard_activity
- 
-            idle_ratio = idle_time / (idle_time + total_activity + 1)
-
-            is_after_hours = 1 if hour < 8 or hour > 18 else 0
-  
-            non_work_app_flag = 1 if any(keyword in active_window_title for keyword in self.distracting_keywords) else 0
-
-            features.append([
-                idle_time,
-                mouse_activity,
-                keyboard_activity,
-                hour,
-                ip_hash,
-                device_hash,
-                idle_ratio,
-                is_after_hours,
-                total_activity,
-                non_work_app_flag 
-            ])
-
-        return np.array(features)
+        # Rolling per-employee feature rows, so ingest doesn't re-read the DB
+        self.feature_store = FeatureStore()
+
+        # Last get_risk_score() result per employee, until new activity arrives
+        self.score_cache = RiskScoreCache()
 
     def fit(self, activity_data):
         """Fits the Isolation Forest model and the StandardScaler."""
         features = self.prepare_features(activity_data)
 
-        if features is None or len(features) < 10:
+        if features is None or len(features) < MIN_FIT_SAMPLES:
             # Need a minimum number of samples to train the model effectively
             return False
 
         try:
-            scaled_features = self.scaler.fit_transform(features)
-            self.model.fit(scaled_features)
+            self.scaler, self.model = self._fit_pair(features)
+            self.forest = CompactForest.from_fitted(self.scaler, self.model)
             self.is_fitted = True
             return True
         except ValueError as e:
@@ -91,9 +1504,55 @@ class FraudDetector:
             self.is_fitted = False
             return False
 
-    def predict_anomaly(self, activity_data):
-        """Predicts anomaly scores for a given batch of activity data."""
-        if not self.is_fitted:
+    def schema_stamp(self):
+        """
+        Identifies everything a checkpoint depends on. The encoder probe catches
+        categorical encodings that differ between processes.
+        """
+        return {
+            'format': MODEL_FORMAT_VERSION,
+            'features': list(FEATURE_NAMES),
+            'sklearn': sklearn.__version__,
+            'model_params': self.model.get_params(),
+            'encoder': self.encoder.describe(),
+            'encoder_probe': [self._hash_value(value) for value in ('127.0.0.1', 'device', '')],
+            'title_categories': self.title_classifier.describe()
+        }
+
+    def _fit_pair(self, features):
+        """Fits a fresh, unshared (scaler, model) pair on a feature matrix."""
+        scaler = clone(self.scaler)
+        model = clone(self.model)
+        model.fit(scaler.fit_transform(features))
+        return scaler, model
+
+    def _fit_forest(self, features):
+        """Fits a (scaler, model) pair and keeps only its CompactForest export."""
+        return CompactForest.from_fitted(*self._fit_pair(features))
+
+    def _fit_features(self, features):
+        """fit_func used by ModelRegistry; returns a CompactForest or None."""
+        if features is None or len(features) < MIN_FIT_SAMPLES:
+            return None
+
+        try:
+            return self._fit_forest(features)
+        except ValueError as e:
+            print(f"Error during ML model fitting (likely due to insufficient or non-numeric data): {e}")
+            return None
+
+    def predict_anomaly(self, activity_data, fitted_model=None):
+        """
+        Predicts anomaly scores for a given batch of activity data.
+
+        Uses the given FittedModel if provided, otherwise the detector's own
+        model from the last fit() call.
+        """
+        if fitted_model is not None:
+            forest = fitted_model.forest
+        elif self.is_fitted:
+            forest = self.forest
+        else:
             return {'is_anomaly': False, 'anomaly_score': 0.0}
 
         features = self.prepare_features(activity_data)
@@ -101,11 +1560,14 @@ class FraudDetector:
         if features is None or len(features) == 0:
             return {'is_anomaly': False, 'anomaly_score': 0.0}
 
-        scaled_features = self.scaler.transform(features)
+        return self._score_features(forest, features)
+
+    @staticmethod
+    def _score_features(forest, features):
+        """Scores an already-built feature matrix with a CompactForest."""
+        # One traversal gives both sklearn's score_samples and predict
+        scores, predictions = forest.evaluate(features)
 
-        scores = self.model.score_samples(scaled_features)
-        predictions = self.model.predict(scaled_features)
-        
         avg_score = np.mean(scores)
         # Calculate the ratio of data points flagged as an anomaly (-1)
         anomaly_ratio = np.sum(predictions == -1) / len(predictions)
@@ -121,164 +1583,417 @@ class FraudDetector:
             'anomaly_ratio': float(anomaly_ratio)
         }
 
-    def analyze_and_flag(self, db, employee_id):
+    def analyze_and_flag(self, db, employee_id, sample=None):
         """
         Fetches recent activity, runs the ML model, and creates a fraud alert 
         in the database if a high-risk anomaly is detected.
         """
-        activity_data = db.get_employee_activity_for_ml(employee_id)
+        if sample is not None:
+            self.score_cache.activity_logged(employee_id, sample.get('id'))
+
+        window = self._activity_window(db, employee_id, sample)
 
-        if not activity_data or len(activity_data) < 5:
+        if window is None or len(window) < 5:
             return None
 
-        self.fit(activity_data)
+        result = self._score_window(employee_id, window)
+        factors = self._identify_risk_factors(window.recent_rows)
 
-        recent_data = activity_data[:10]
-        result = self.predict_anomaly(recent_data)
+        return self._flag_if_anomalous(db, employee_id, result, factors)
 
-        factors = self._identify_risk_factors(recent_data)
+    def score_batch(self, db, employee_ids=None):
+        """
+        Fleet-wide version of analyze_and_flag. Pulls activity for all (or the
+        given) employees in one query, builds one stacked feature matrix (used
+        both for drift checks/refits and scoring) and scores each employee's
+        recent rows. Alerts are returned rather than
+        written so callers (analyze_batch, the scheduler's worker pool) can
+        insert them in one go.
 
-        risk_score = result['anomaly_score']
+        Returns (results, alerts) where results has a summary for every
+        employee with enough activity.
+        """
+        activity_by_employee = db.get_activity_for_ml_batch(employee_ids)
 
-        if result['is_anomaly'] and risk_score > 60:
-            if risk_score >= 80:
-                alert_level = 'High'
-            elif risk_score >= 50:
-                alert_level = 'Medium'
+        eligible = {
+            employee_id: rows for employee_id, rows in activity_by_employee.items()
+            if rows and len(rows) >= 5
+        }
+        if not eligible:
+            return {}, []
+
+        features, owners = self.prepare_features_batch(eligible)
+
+        recent_by_employee = {employee_id: rows[:10] for employee_id, rows in eligible.items()}
+        factors_by_employee = self.rule_engine.evaluate_grouped(recent_by_employee)
+
+        # Rows are stacked in dict order, so each employee owns one contiguous slice
+        offsets = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+        bounds = dict(zip(owners[offsets], zip(offsets, np.r_[offsets[1:], len(owners)])))
+
+        results = {}
+        alerts = []
+        for employee_id, rows in eligible.items():
+            start, end = bounds[employee_id]
+            employee_features = features[start:end]
+            fitted_model = self.models.get(employee_id, employee_features, self._fit_features, ids=activity_ids(rows))
+
+            if fitted_model is None:
+                result = {'is_anomaly': False, 'anomaly_score': 0.0}
             else:
-                alert_level = 'Low'
+                result = self._score_features(fitted_model.forest, employee_features[:10])
 
-            description = self._generate_alert_description(factors)
-            db.create_fraud_alert(employee_id, risk_score, alert_level, description)
+            factors = factors_by_employee.get(employee_id, [])
 
-        return {
-            'risk_score': risk_score,
-            'alert_level': 'High' if risk_score >= 80 else 'Medium' if risk_score >= 50 else 'Low',
-            'factors': factors
-        }
+            alert = self._build_alert(employee_id, result, factors)
+            if alert:
+                alerts.append(alert)
+            results[employee_id] = self._summary(result, factors)
+
+        return results, alerts
 
     def get_risk_score(self, db, employee_id):
         """
         Provides the current risk score and human-readable factors for the 
         Employee Report dashboard without necessarily creating an alert.
+        Served from score_cache until new activity is logged for the employee.
         """
-        activity_data = db.get_employee_activity_for_ml(employee_id)
+        cached = self.score_cache.get(employee_id)
+        if cached is not None:
+            return cached
 
-        if not activity_data or len(activity_data) < 5:
-            return {
+        window = self._activity_window(db, employee_id)
+
+        if window is None or len(window) < 5:
+            summary = {
                 'risk_score': 0,
                 'alert_level': 'Low',
                 'factors': []
             }
+        else:
+            result = self._score_window(employee_id, window)
+            factors = self._identify_risk_factors(window.recent_rows)
 
-        self.fit(activity_data)
+            risk_score = result['anomaly_score']
 
-        result = self.predict_anomaly(activity_data[:10])
-        factors = self._identify_risk_factors(activity_data[:10])
+            summary = {
+                'risk_score': round(risk_score, 2),
+                'alert_level': self._alert_level(risk_score),
+                'factors': factors
+            }
 
-        risk_score = result['anomaly_score']
+        latest_id = int(window.ids[0]) if window is not None and len(window) and window.ids[0] >= 0 else None
+        self.score_cache.put(employee_id, latest_id, summary)
+        return summary
 
-        if risk_score >= 80:
-            alert_level = 'High'
-        elif risk_score >= 50:
-            alert_level = 'Medium'
-        else:
-            alert_level = 'Low'
+    def _activity_window(self, db, employee_id, sample=None):
+        """
+        Returns the employee's recent feature rows from the feature store.
+        A freshly ingested sample is appended in place; the database is only
+        read to seed an employee who isn't buffered (or whose buffer expired).
+        """
+        buffer = self.feature_store.get(employee_id)
+
+        if buffer is not None:
+            if sample is not None:
+                sample = complete_sample(sample, buffer.ip_address, buffer.device_id)
+                self.feature_store.append(employee_id, self.build_feature_row(sample), sample)
+            return buffer.window()
+
+        # The database already contains the sample that was just logged,
+        # unless write-behind still has it queued (id None)
+        activity_data = db.get_employee_activity_for_ml(employee_id)
+        if not activity_data:
+            if sample is None or sample.get('id') is not None:
+                return None
+            activity_data = []
+
+        features = self.prepare_features(activity_data) if activity_data else np.zeros((0, len(FEATURE_NAMES)))
+        buffer = self.feature_store.seed(employee_id, activity_data, features)
+        if sample is not None and sample.get('id') is None:
+            sample = complete_sample(sample, buffer.ip_address, buffer.device_id)
+            self.feature_store.append(employee_id, self.build_feature_row(sample), sample)
+        return buffer.window()
+
+    def _score_window(self, employee_id, window):
+        """Scores the newest 10 rows of a FeatureWindow with the employee's cached model."""
+        fitted_model = self.models.get(employee_id, window.features, self._fit_features, ids=window.ids)
+
+        if fitted_model is None:
+            return {'is_anomaly': False, 'anomaly_score': 0.0}
+
+        return self._score_features(fitted_model.forest, window.features[:10])
+
+    def preload(self):
+        return self.models.preload()
+
+    def forget(self, employee_id):
+        self.models.invalidate(employee_id)
+        self.feature_store.forget(employee_id)
+        self.score_cache.invalidate(employee_id)
+
+    def activity_logged(self, employee_id, activity_id=None):
+        self.score_cache.activity_logged(employee_id, activity_id)
+
+    def drift_report(self, employee_id=None):
+        """
+        The model registry's drift metrics, plus the running aggregates of
+        each employee's buffered window (None when they aren't buffered), to
+        show what the activity looks like now next to how far it has drifted.
+        """
+        report = self.models.drift_report(employee_id)
+        for key, metrics in report.items():
+            if metrics['feature_drift'] is not None:
+                metrics['feature_drift'] = dict(zip(FEATURE_NAMES, metrics['feature_drift']))
+            metrics['window'] = self.feature_store.aggregates(key)
+        return report
+
+    def stats(self):
+        stats = super().stats()
+        stats.update({
+            'engine': 'isolation_forest',
+            'models': self.models.stats(),
+            'feature_store': self.feature_store.stats(),
+            'score_cache': self.score_cache.stats()
+        })
+        return stats
+
+
+class StreamState:
+    """Constant-size running statistics for one employee's feature stream."""
+    __slots__ = ('count', 'mean', 'var', 'anomaly_score', 'anomaly_ratio',
+                 'last_id', 'unlogged', 'ip_address', 'device_id', 'recent')
+
+    def __init__(self, recent_size):
+        self.count = 0
+        self.mean = np.zeros(len(FEATURE_NAMES))
+        self.var = np.zeros(len(FEATURE_NAMES))
+        self.anomaly_score = 0.0
+        self.anomaly_ratio = 0.0
+        self.last_id = None
+        # Keys of applied samples that had no id yet (queued by write-behind),
+        # so they aren't applied again when their rows turn up in the database
+        self.unlogged = deque(maxlen=1000)
+        self.ip_address = None
+        self.device_id = None
+        # Raw rows kept only for the rule-based risk factors
+        self.recent = deque(maxlen=recent_size)
+
+
+class StreamingDetector(AnomalyDetector):
+    """
+    Incremental anomaly detector for the realtime ingest path.
+
+    Keeps exponentially weighted, winsorized mean/variance per feature for each
+    employee and scores every new sample against them in O(1), instead of
+    refitting an Isolation Forest over the last 100 rows.
+    """
+    # Lower bound on each feature's scale, in FEATURE_NAMES order, so that
+    # features which are constant for a while (hour, IP) don't blow up z-scores
+    SCALE_FLOOR = np.array([5.0, 10.0, 10.0, 2.0, 0.5, 0.5, 0.05, 0.5, 10.0, 0.5])
+
+    def __init__(self, alpha=0.05, score_alpha=0.2, ratio_alpha=0.1, warmup=10,
+                 outlier_threshold=3.0, z_cap=10.0, max_employees=10000, title_classifier=None):
+        super().__init__(title_classifier)
+        self.alpha = alpha
+        self.score_alpha = score_alpha
+        self.ratio_alpha = ratio_alpha
+        self.warmup = warmup
+        self.outlier_threshold = outlier_threshold
+        self.z_cap = z_cap
+        self.max_employees = max_employees
+
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def analyze_and_flag(self, db, employee_id, sample=None):
+        """
+        Updates the employee's stream with the new sample (or any rows logged
+        since the last update) and creates an alert on a high-risk anomaly.
+        """
+        state = self._sync(db, employee_id, sample)
+
+        if state is None or state.count < self.warmup:
+            return None
+
+        result = self._result(state)
+
+        # Rule-based factors are only worth the DataFrame work when alerting
+        factors = []
+        if result['is_anomaly'] and result['anomaly_score'] > 60:
+            factors = self._identify_risk_factors(list(state.recent))
+
+        return self._flag_if_anomalous(db, employee_id, result, factors)
+
+    def get_risk_score(self, db, employee_id):
+        state = self._sync(db, employee_id)
+
+        if state is None or state.count < self.warmup:
+            return {
+                'risk_score': 0,
+                'alert_level': 'Low',
+                'factors': []
+            }
+
+        risk_score = state.anomaly_score
 
         return {
             'risk_score': round(risk_score, 2),
-            'alert_level': alert_level,
-            'factors': factors
+            'alert_level': self._alert_level(risk_score),
+            'factors': self._identify_risk_factors(list(state.recent))
         }
 
-    def _identify_risk_factors(self, activity_data):
+    def score_sample(self, employee_id, sample):
         """
-        Checks for specific, rule-based risk factors in the recent activity logs.
+        Scores one activity sample and folds it into the employee's running
+        statistics. Returns the same dict shape as FraudDetector.predict_anomaly.
         """
-        if not activity_data:
-            return []
+        with self._lock:
+            state = self._get_state(employee_id)
+            self._update(state, sample)
+            return self._result(state)
 
-        factors = []
-        df = pd.DataFrame(activity_data)
-        
-        # Distracting Application Usage
-        if 'active_window_title' in df.columns:
-            # Count logs where the window title contains any distracting keyword
-            distracting_logs = df['active_window_title'].apply(
-                lambda x: 1 if any(k in str(x).lower() for k in self.distracting_keywords) else 0
-            ).sum()
-            
-            if len(df) > 0:
-                distracting_ratio = distracting_logs / len(df)
-                if distracting_ratio > 0.3:
-                    factors.append({
-                        'type': 'Distracting App Use',
-                        'severity': 'high' if distracting_ratio > 0.5 else 'medium',
-                        'description': f'{distracting_logs} out of {len(df)} recent logs show foreground use of non-work applications (e.g., social media, streaming).'
-                    })
-        
-        #High Idle Time
-        if 'idle_time' in df.columns:
-            avg_idle = df['idle_time'].mean()
-            if avg_idle > 45: # Threshold in seconds
-                factors.append({
-                    'type': 'High Idle Time',
-                    'severity': 'high' if avg_idle > 60 else 'medium',
-                    'description': f'Average idle time of {avg_idle:.0f} seconds exceeds normal threshold (low physical input).'
-                })
+    def forget(self, employee_id):
+        with self._lock:
+            self._states.pop(employee_id, None)
 
-        #After Hours Activity
-        if 'hour' in df.columns:
-            after_hours = df[df['hour'].apply(lambda x: x < 8 or x > 18)]
-            if len(after_hours) > len(df) * 0.3:
-                factors.append({
-                    'type': 'After Hours Activity',
-                    'severity': 'medium',
-                    'description': 'Significant activity detected outside normal business hours (8AM-6PM).'
-                })
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            stats.update({
+                'engine': 'streaming',
+                'employees': len(self._states),
+                'max_employees': self.max_employees
+            })
+        return stats
 
-        #IP/Device Mismatch
-        if 'ip_address' in df.columns:
-            unique_ips = df['ip_address'].nunique()
-            if unique_ips > 3:
-                factors.append({
-                    'type': 'IP Mismatch',
-                    'severity': 'high',
-                    'description': f'Multiple IP addresses ({unique_ips}) detected in recent sessions, indicating a change in working location.'
-                })
+    def _sync(self, db, employee_id, sample=None):
+        """
+        Brings the employee's state up to date. A cold state is seeded from
+        the database; a warm one only applies the new sample, or, without a
+        sample, the rows logged after the last one seen. Rows of samples that
+        were applied while still queued by write-behind are skipped, and a
+        queued sample of a cold employee is applied after the seed.
+        """
+        with self._lock:
+            state = self._states.get(employee_id)
+            if state is not None and sample is not None:
+                self._states.move_to_end(employee_id)
+                self._update(state, sample)
+                return state
 
-        if 'device_id' in df.columns:
-            unique_devices = df['device_id'].nunique()
-            if unique_devices > 2:
-                factors.append({
-                    'type': 'Device Anomaly',
-                    'severity': 'medium',
-                    'description': f'Multiple devices ({unique_devices}) used in recent sessions.'
-                })
-        
-        #Irregular Activity Patterns
-        if 'mouse_activity' in df.columns and 'keyboard_activity' in df.columns:
-            total_activity = df['mouse_activity'] + df['keyboard_activity']
-            activity_std = total_activity.std()
-            activity_mean = total_activity.mean()
-
-            # High variance relative to the mean indicates spiky, irregular input
-            if activity_mean > 0 and activity_std / activity_mean > 1.5:
-                factors.append({
-                    'type': 'Pattern Deviation',
-                    'severity': 'medium',
-                    'description': 'Irregular activity patterns detected (high variance in mouse/keyboard inputs).'
-                })
+        rows = db.get_employee_activity_for_ml(employee_id)
 
-        return factors
+        with self._lock:
+            state = self._get_state(employee_id)
+            if state.last_id is not None:
+                rows = [row for row in rows if (row.get('id') or 0) > state.last_id]
+            elif state.count > len(state.unlogged):
+                # Warm state with samples that can't be told apart from rows, nothing safe to replay
+                rows = []
 
-    def _generate_alert_description(self, factors):
-        """Generates a concise alert summary based on the highest severity factor."""
-        if not factors:
-            return 'Anomalous behavior detected by ML model'
+            # Rows come newest first
+            for row in reversed(rows):
+                key = self._sample_key(row)
+                if key is not None and key in state.unlogged:
+                    # Already applied while it was queued
+                    state.unlogged.remove(key)
+                    state.last_id = row['id']
+                    continue
+                self._update(state, row)
 
-        high_severity = [f for f in factors if f['severity'] == 'high']
+            if sample is not None and sample.get('id') is None:
+                self._update(state, sample)
 
-        if high_severity:
-            return high_severity[0]['description']
-        return factors[0]['description']
+            return state if state.count > 0 else None
+
+    def _get_state(self, employee_id):
+        state = self._states.get(employee_id)
+        if state is None:
+            state = StreamState(recent_size=10)
+            self._states[employee_id] = state
+            while len(self._states) > self.max_employees:
+                self._states.popitem(last=False)
+        self._states.move_to_end(employee_id)
+        return state
+
+    def _update(self, state, sample):
+        """Scores the sample against the running statistics, then updates them."""
+        sample = self._fill_sample(state, sample)
+        x = self.build_feature_row(sample)
+
+        if state.count == 0:
+            state.mean = x.copy()
+        else:
+            scale = np.maximum(np.sqrt(state.var), self.SCALE_FLOOR)
+            deviation = x - state.mean
+            z = np.minimum(np.abs(deviation) / scale, self.z_cap)
+
+            if state.count >= self.warmup:
+                event_score = float(np.sqrt(np.mean(z ** 2)))
+                is_outlier = event_score > self.outlier_threshold
+                event_risk = min(100.0, 100.0 * event_score / (2 * self.outlier_threshold))
+
+                state.anomaly_score += self.score_alpha * (event_risk - state.anomaly_score)
+                state.anomaly_ratio += self.ratio_alpha * ((1.0 if is_outlier else 0.0) - state.anomaly_ratio)
+
+            # Winsorize so a single outlier can't drag the baseline with it
+            deviation = np.clip(deviation, -self.outlier_threshold * scale, self.outlier_threshold * scale)
+            # Plain running mean during warm-up, exponential weighting after
+            alpha = max(self.alpha, 1.0 / (state.count + 1))
+            state.mean += alpha * deviation
+            state.var = (1 - alpha) * (state.var + alpha * deviation ** 2)
+
+        state.count += 1
+        if sample.get('id') is not None:
+            state.last_id = sample['id']
+        else:
+            key = self._sample_key(sample)
+            if key is not None:
+                state.unlogged.append(key)
+        state.recent.appendleft(sample)
+
+    @classmethod
+    def _sample_key(cls, sample):
+        """A queued sample's timestamp and inputs, which its row will have once written, or None."""
+        timestamp = sample.get('timestamp')
+        if timestamp is None:
+            return None
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp)
+        return (
+            timestamp.replace(microsecond=0),
+            cls._as_float(sample.get('mouse_activity'), 0),
+            cls._as_float(sample.get('keyboard_activity'), 0),
+            cls._as_float(sample.get('idle_time'), 0)
+        )
+
+    @staticmethod
+    def _fill_sample(state, sample):
+        sample = complete_sample(sample, state.ip_address, state.device_id)
+        state.ip_address = sample.get('ip_address')
+        state.device_id = sample.get('device_id')
+        return sample
+
+    @staticmethod
+    def _result(state):
+        return {
+            'is_anomaly': state.anomaly_ratio > 0.3,
+            'anomaly_score': float(state.anomaly_score),
+            'anomaly_ratio': float(state.anomaly_ratio)
+        }
+
+
+# Engines selectable through create_detector / the FRAUD_ENGINE env variable
+DETECTORS = {
+    'isolation_forest': FraudDetector,
+    'streaming': StreamingDetector
+}
+
+
+def create_detector(engine=None):
+    """Returns a detector for the named engine (defaults to FRAUD_ENGINE, then Isolation Forest)."""
+    engine = engine or os.getenv('FRAUD_ENGINE', 'isolation_forest')
+    if engine not in DETECTORS:
+        raise ValueError(f"Unknown fraud detection engine '{engine}'. Choose one of: {', '.join(DETECTORS)}")
+    return DETECTORS[engine]()
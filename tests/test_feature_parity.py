@@ -0,0 +1,160 @@
+# tests/test_feature_parity.py
+"""
+Checks the columnar feature builders (build_feature_matrix,
+prepare_features_batch and the ingest path's build_feature_row) against the
+original row-at-a-time prepare_features:
+
+    python -m pytest tests
+"""
+import math
+import os
+import sys
+import unittest
+
+import numpy as np
+import pandas as pd # type: ignore
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import SyntheticWorkload
+from ml_engine import FraudDetector
+
+# FraudDetector.distracting_keywords before the title classifier replaced them
+LEGACY_DISTRACTING_KEYWORDS = [
+    'youtube', 'reddit', 'netflix', 'game', 'social',
+    'facebook', 'twitter', 'instagram', 'discord', 'steam',
+    'tiktok', 'hulu', 'prime video', 'spotify', 'telegram'
+]
+
+# What the builders read a NULL, NaN or missing value as
+COLUMN_DEFAULTS = {
+    'idle_time': 0,
+    'mouse_activity': 0,
+    'keyboard_activity': 0,
+    'hour': 12,
+    'ip_address': '',
+    'device_id': '',
+    'active_window_title': ''
+}
+
+
+def legacy_prepare_features(encoder, activity_data):
+    """
+    The original FraudDetector.prepare_features (DataFrame.iterrows and a
+    keyword any() scan), with the encoder in place of the salted hash() % 1000.
+    """
+    if not activity_data:
+        return None
+
+    df = pd.DataFrame(activity_data)
+
+    features = []
+    for _, row in df.iterrows():
+        idle_time = float(row.get('idle_time', 0))
+        mouse_activity = float(row.get('mouse_activity', 0))
+        keyboard_activity = float(row.get('keyboard_activity', 0))
+        hour = float(row.get('hour', 12))
+
+        active_window_title = str(row.get('active_window_title', '')).lower()
+
+        ip_hash = encoder.encode(str(row.get('ip_address', '')))
+        device_hash = encoder.encode(str(row.get('device_id', '')))
+
+        total_activity = mouse_activity + keyboard_activity
+
+        idle_ratio = idle_time / (idle_time + total_activity + 1)
+
+        is_after_hours = 1 if hour < 8 or hour > 18 else 0
+
+        non_work_app_flag = 1 if any(keyword in active_window_title for keyword in LEGACY_DISTRACTING_KEYWORDS) else 0
+
+        features.append([
+            idle_time,
+            mouse_activity,
+            keyboard_activity,
+            hour,
+            ip_hash,
+            device_hash,
+            idle_ratio,
+            is_after_hours,
+            total_activity,
+            non_work_app_flag
+        ])
+
+    return np.array(features)
+
+
+def with_defaults(row):
+    """The row with every NULL, NaN or missing feature column set to its default."""
+    def is_null(value):
+        return value is None or (isinstance(value, float) and math.isnan(value))
+
+    return {**row, **{name: default for name, default in COLUMN_DEFAULTS.items() if is_null(row.get(name))}}
+
+
+def feature_edge_cases(seed=42):
+    """
+    {employee_id: rows} covering what the feature builders must agree on:
+    NULL IP/device/title, NaN and NULL numerics, columns missing from some
+    rows or from a whole employee, and non-string categorical values.
+    """
+    workload = SyntheticWorkload(seed, anomaly_rate=0.3)
+    activity = workload.fleet(3, 20)
+
+    nulls = activity[1]
+    nulls[0].update(ip_address=None, device_id=None, active_window_title=None)
+    nulls[1].update(idle_time=None, mouse_activity=float('nan'), hour=None)
+    nulls[2].update(ip_address=float('nan'), device_id=12345)
+
+    partial = activity[2]
+    for row in partial[:5]:
+        del row['hour']
+        del row['active_window_title']
+
+    # Employee 3 never has IP/device columns, as before any login
+    for row in activity[3]:
+        del row['ip_address']
+        del row['device_id']
+
+    return activity
+
+
+class FeatureParityTest(unittest.TestCase):
+    def setUp(self):
+        self.detector = FraudDetector(model_dir='')
+
+    def assert_builders_match(self, activity, reference):
+        for employee_id, rows in activity.items():
+            with self.subTest(builder='build_feature_matrix', employee_id=employee_id):
+                np.testing.assert_array_equal(self.detector.build_feature_matrix(rows), reference[employee_id])
+
+        batch, owners = self.detector.prepare_features_batch(activity)
+        for employee_id in activity:
+            with self.subTest(builder='prepare_features_batch', employee_id=employee_id):
+                np.testing.assert_array_equal(batch[owners == employee_id], reference[employee_id])
+
+        for employee_id, rows in activity.items():
+            for index, row in enumerate(rows):
+                with self.subTest(builder='build_feature_row', employee_id=employee_id, row=index):
+                    np.testing.assert_array_equal(self.detector.build_feature_row(row), reference[employee_id][index])
+
+    def test_matches_legacy_builder(self):
+        # A high anomaly rate mixes in off-hours rows, new IPs/devices and distracting titles
+        activity = SyntheticWorkload(seed=7, anomaly_rate=0.3).fleet(5, 50)
+        reference = {
+            employee_id: legacy_prepare_features(self.detector.encoder, rows)
+            for employee_id, rows in activity.items()
+        }
+        self.assert_builders_match(activity, reference)
+
+    def test_null_and_missing_values_read_as_defaults(self):
+        activity = feature_edge_cases()
+        reference = {
+            employee_id: legacy_prepare_features(self.detector.encoder, [with_defaults(row) for row in rows])
+            for employee_id, rows in activity.items()
+        }
+        self.assert_builders_match(activity, reference)
+
+
+if __name__ == "__main__":
+    unittest.main()
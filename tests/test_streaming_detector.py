@@ -0,0 +1,93 @@
+# tests/test_streaming_detector.py
+"""
+Checks that StreamingDetector applies each activity sample exactly once when
+write-behind ingestion queues samples before they reach the database:
+
+    python -m pytest tests
+"""
+import os
+import sys
+import unittest
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import InMemoryDatabase, SyntheticWorkload
+from ml_engine import StreamingDetector
+
+
+def queued_samples(employee_id, count, start):
+    """Samples shaped like ActivityWriter.submit's records: no id yet, timestamps from start on."""
+    return [
+        {
+            'id': None,
+            'employee_id': employee_id,
+            'timestamp': start + timedelta(seconds=15 * n),
+            'mouse_activity': 100 + n,
+            'keyboard_activity': 120,
+            'idle_time': 5,
+            'active_window_title': 'Terminal',
+            'login_id': None
+        }
+        for n in range(count)
+    ]
+
+
+def written(samples, first_id):
+    """The rows the samples become once flushed, newest first, with their ids."""
+    rows = [dict(sample, id=first_id + n, hour=sample['timestamp'].hour) for n, sample in enumerate(samples)]
+    return list(reversed(rows))
+
+
+class StreamingWriteBehindTest(unittest.TestCase):
+    def setUp(self):
+        self.workload = SyntheticWorkload(seed=3)
+        self.detector = StreamingDetector()
+
+    def count(self, employee_id):
+        return self.detector._states[employee_id].count
+
+    def test_flushed_samples_are_not_replayed(self):
+        history = self.workload.employee_rows(1, 50)
+        db = InMemoryDatabase({1: history})
+        self.detector.get_risk_score(db, 1)
+        self.assertEqual(self.count(1), 50)
+
+        samples = queued_samples(1, 5, history[0]['timestamp'] + timedelta(seconds=15))
+        for sample in samples:
+            self.detector.analyze_and_flag(db, 1, sample=sample)
+        self.assertEqual(self.count(1), 55)
+
+        # The writer flushes them; a later read must not count them again
+        db.add_activity(1, written(samples, history[0]['id'] + 1))
+        self.detector.get_risk_score(db, 1)
+        self.assertEqual(self.count(1), 55)
+        self.assertEqual(self.detector._states[1].last_id, history[0]['id'] + 5)
+
+        # Rows written by someone else after that are still picked up
+        db.add_activity(1, written(queued_samples(1, 2, samples[-1]['timestamp'] + timedelta(minutes=5)),
+                                   history[0]['id'] + 6))
+        self.detector.get_risk_score(db, 1)
+        self.assertEqual(self.count(1), 57)
+
+    def test_queued_sample_of_cold_employee_is_applied(self):
+        history = self.workload.employee_rows(2, 20)
+        db = InMemoryDatabase({2: history})
+        sample = queued_samples(2, 1, history[0]['timestamp'] + timedelta(seconds=15))[0]
+        self.detector.analyze_and_flag(db, 2, sample=sample)
+        self.assertEqual(self.count(2), 21)
+
+    def test_first_sample_of_new_employee_is_applied(self):
+        db = InMemoryDatabase()
+        samples = queued_samples(3, 3, datetime(2026, 1, 15, 10, 0))
+        for sample in samples:
+            self.detector.analyze_and_flag(db, 3, sample=sample)
+        self.assertEqual(self.count(3), 3)
+
+        db.add_activity(3, written(samples, 1))
+        self.detector.get_risk_score(db, 3)
+        self.assertEqual(self.count(3), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()